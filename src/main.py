@@ -1,8 +1,10 @@
+import multiprocessing
 import os
 import sys
 
 from PyQt5.QtWidgets import QApplication, QMessageBox
 
+from model.settings.default_filenames import spot_cache_default_directory
 from model.sidrs_model import SidrsModel
 from controllers.signals import Signals
 from view.sidrs_window import SidrsWindow
@@ -17,10 +19,13 @@ def set_except_hook(window):
 
 
 if __name__ == "__main__":
+    # Required for the import worker processes to start from the pyinstaller executables.
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
 
 
     model = SidrsModel()
+    model.set_spot_cache_directory(spot_cache_default_directory)
     window = SidrsWindow(model)
 
     set_except_hook(window)
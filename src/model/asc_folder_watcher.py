@@ -0,0 +1,97 @@
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtCore import QTimer
+
+from model.spot import parse_asc_file_into_spot
+
+
+class AscFolderWatcher:
+    """
+    Finds the asc files that appear in a folder while a session is still running on the instrument.
+    """
+
+    def __init__(self, directory, ignored_filenames=()):
+        self.directory = directory
+        self._seen_filenames = {os.path.abspath(filename) for filename in ignored_filenames}
+        self._file_sizes = {}
+
+    def find_new_files(self):
+        # A file is only returned once its size is unchanged between two polls, so that files which are still being
+        # written by the instrument are not picked up half written.
+        new_filenames = []
+        file_sizes = {}
+        for filename in sorted(glob.glob(os.path.join(self.directory, "*.asc"))):
+            filename = os.path.abspath(filename)
+            if filename in self._seen_filenames:
+                continue
+            try:
+                file_size = os.path.getsize(filename)
+            except OSError:
+                continue
+
+            if file_size > 0 and self._file_sizes.get(filename) == file_size:
+                new_filenames.append(filename)
+                self._seen_filenames.add(filename)
+            else:
+                file_sizes[filename] = file_size
+
+        self._file_sizes = file_sizes
+        return new_filenames
+
+
+class LiveImport:
+    """
+    Polls a folder for new asc files, parses them in a background process and adds the spots to the model's session.
+    Everything apart from the parsing happens on the Qt event loop, so the model is only changed from one thread.
+    """
+
+    def __init__(self, model, directory, poll_interval_ms):
+        self.model = model
+        self.folder_watcher = AscFolderWatcher(directory, model.imported_files)
+        self._parse_futures = []
+
+        number_of_processes = max(1, model.number_of_import_processes)
+        self._executor = ProcessPoolExecutor(max_workers=number_of_processes,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.poll)
+        self._timer.start(poll_interval_ms)
+
+    def poll(self):
+        for filename in self.folder_watcher.find_new_files():
+            future = self._executor.submit(parse_asc_file_into_spot, filename, self.model.isotopes,
+                                           self.model.spot_cache)
+            self._parse_futures.append((filename, future))
+
+        # Spots are added in the order the files were found, so only the completed futures at the front are used. A
+        # file that cannot be parsed is skipped, as it will not be found again, and reported once the other spots have
+        # been added.
+        spots = []
+        errors = []
+        while self._parse_futures and self._parse_futures[0][1].done():
+            filename, future = self._parse_futures.pop(0)
+            try:
+                spots.append(future.result())
+            except Exception as exception:
+                errors.append(filename + ": " + str(exception))
+
+        if spots:
+            try:
+                self.model.add_spots_to_session(spots)
+            except Exception as exception:
+                errors.append(str(exception))
+
+        if errors:
+            raise Exception("Not all of the new files could be added to the session:\n" + "\n".join(errors))
+
+    def stop(self):
+        self._timer.stop()
+        # The files that have not started to be parsed are not parsed at all
+        for _, future in self._parse_futures:
+            future.cancel()
+        self._parse_futures = []
+        self._executor.shutdown(wait=False)
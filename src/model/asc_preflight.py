@@ -0,0 +1,181 @@
+import mmap
+from collections import Counter
+
+from model.get_data_from_import import get_datetime_from_asc_date_and_time
+from model.settings.asc_file_settings_general import DATE_INDEX, TIME_INDEX, X_POSITION_INDEX, Y_POSITION_INDEX
+from utils.general_utils import split_cameca_data_filename
+
+####################################################
+### Checking asc files before they are imported ###
+####################################################
+
+
+class AscFileHeader:
+    """
+    The few values of an asc file that are needed to check that it belongs with the rest of a session.
+    """
+
+    def __init__(self, date, time, x_position, y_position, block_number, number_of_cycles, mass_peak_names):
+        self.date = date
+        self.time = time
+        self.x_position = x_position
+        self.y_position = y_position
+        self.block_number = block_number
+        self.number_of_cycles = number_of_cycles
+        self.mass_peak_names = mass_peak_names
+
+    def get_number_of_measurements(self):
+        return self.block_number * self.number_of_cycles
+
+
+class PreflightReport:
+    def __init__(self):
+        self.headers_by_filename = {}
+        self.problems_by_filename = {}
+
+    def add_problem(self, filename, problem):
+        self.problems_by_filename.setdefault(filename, []).append(problem)
+
+    def is_valid(self):
+        return len(self.problems_by_filename) == 0
+
+    def get_valid_filenames(self):
+        return [filename for filename in self.headers_by_filename if filename not in self.problems_by_filename]
+
+    def get_message(self):
+        lines = []
+        for filename, problems in self.problems_by_filename.items():
+            lines.append(filename + ": " + " ".join(problems))
+        return "\n".join(lines)
+
+
+def preflight_check_asc_files(filenames, isotopes, contents_by_filename=None):
+    """
+    Reads only the header values of each file and reports the files that cannot be imported with the others, before
+    any of them are fully parsed.
+
+    :param filenames: the asc files in the session
+    :param isotopes: the isotopes that each file must contain
+    :param contents_by_filename: the contents of files that are already in memory, e.g. from a zip archive
+    :return: a PreflightReport
+    """
+    if contents_by_filename is None:
+        contents_by_filename = {}
+
+    report = PreflightReport()
+    for filename in filenames:
+        try:
+            split_cameca_data_filename(filename)
+        except Exception as exception:
+            report.add_problem(filename, str(exception))
+
+        try:
+            if filename in contents_by_filename:
+                header = read_asc_file_header_from_contents(contents_by_filename[filename])
+            else:
+                header = read_asc_file_header(filename)
+        except (OSError, ValueError, IndexError) as exception:
+            report.add_problem(filename, "The file header could not be read: " + str(exception))
+            continue
+        report.headers_by_filename[filename] = header
+
+        try:
+            get_datetime_from_asc_date_and_time(header.date, header.time)
+        except (ValueError, TypeError, AttributeError):
+            report.add_problem(filename, "The date and time '" + header.date + " " + header.time + "' are not valid.")
+
+        missing_isotopes = [isotope.isotope_name for isotope in isotopes
+                            if isotope.isotope_name not in header.mass_peak_names]
+        if missing_isotopes:
+            report.add_problem(filename, "The mass peaks " + ", ".join(missing_isotopes) + " are missing.")
+
+    # Files that disagree with the majority of the session are reported, rather than the first file being assumed
+    # to be correct.
+    headers = report.headers_by_filename
+    if headers:
+        measurements_counter = Counter(header.get_number_of_measurements() for header in headers.values())
+        expected_number_of_measurements = measurements_counter.most_common(1)[0][0]
+        mass_peaks_counter = Counter(tuple(header.mass_peak_names) for header in headers.values())
+        expected_mass_peak_names = mass_peaks_counter.most_common(1)[0][0]
+
+        for filename, header in headers.items():
+            if header.get_number_of_measurements() != expected_number_of_measurements:
+                report.add_problem(filename, "The file has " + str(header.block_number) + " blocks of "
+                                   + str(header.number_of_cycles) + " cycles, whereas the other files have "
+                                   + str(expected_number_of_measurements) + " measurements.")
+            if tuple(header.mass_peak_names) != expected_mass_peak_names:
+                report.add_problem(filename, "The mass peaks " + ", ".join(header.mass_peak_names)
+                                   + " do not match the other files (" + ", ".join(expected_mass_peak_names) + ").")
+
+    return report
+
+
+def read_asc_file_header(filename):
+    # The file is memory mapped so that only the pages containing the header values are read from disk.
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            return read_asc_file_header_from_contents(contents)
+
+
+def read_asc_file_header_from_contents(contents):
+    """
+    :param contents: the bytes of an asc file, or a memory map of one
+    :return: an AscFileHeader
+    """
+    # The date, time and position are on fixed lines at the start of the file.
+    first_lines = _get_lines(contents, 0, max(DATE_INDEX[0], TIME_INDEX[0], X_POSITION_INDEX[0],
+                                              Y_POSITION_INDEX[0]) + 1)
+    date = first_lines[DATE_INDEX[0]][DATE_INDEX[1]]
+    time = first_lines[TIME_INDEX[0]][TIME_INDEX[1]]
+    x_position = int(first_lines[X_POSITION_INDEX[0]][X_POSITION_INDEX[1]])
+    y_position = int(first_lines[Y_POSITION_INDEX[0]][Y_POSITION_INDEX[1]])
+
+    raw_data_position = contents.find(b"RAW DATA")
+    if raw_data_position == -1:
+        raise ValueError("The asc file is missing the RAW DATA section.")
+
+    # The number of blocks is on the last line before the raw data with a "Blocks" column.
+    blocks_position = contents.rfind(b"\tBlocks", 0, raw_data_position)
+    if blocks_position == -1:
+        raise ValueError("The asc file is missing the number of blocks.")
+    blocks_line = _get_lines(contents, contents.rfind(b"\n", 0, blocks_position) + 1, 1)[0]
+    block_number = int(blocks_line[blocks_line.index("Blocks") - 1])
+
+    # As for the full parse the mass peak names are 4 lines after the raw data header, and the data 6 lines after.
+    raw_data_line_start = contents.rfind(b"\n", 0, raw_data_position) + 1
+    raw_data_lines = _get_lines(contents, raw_data_line_start, 7)
+    mass_peak_names = [name for name in raw_data_lines[4] if name]
+
+    # All of the cycles of the first block are counted, which is the only part of the raw data that is read.
+    number_of_cycles = 0
+    position = contents.find(b"\n", raw_data_line_start)
+    for _ in range(5):
+        position = contents.find(b"\n", position + 1)
+    for line in _iterate_lines(contents, position + 1):
+        if not line or line[0] != "0":
+            break
+        number_of_cycles += 1
+
+    return AscFileHeader(date, time, x_position, y_position, block_number, number_of_cycles, mass_peak_names)
+
+
+def _iterate_lines(contents, position):
+    while position < len(contents):
+        end = contents.find(b"\n", position)
+        if end == -1:
+            end = len(contents)
+        line = contents[position:end].decode(errors="replace")
+        yield [field.strip() for field in line.split("\t")]
+        position = end + 1
+
+
+def _get_lines(contents, position, number_of_lines):
+    lines = []
+    for line in _iterate_lines(contents, position):
+        lines.append(line)
+        if len(lines) == number_of_lines:
+            break
+
+    if len(lines) != number_of_lines:
+        raise ValueError("The asc file ended unexpectedly.")
+    return lines
@@ -1,68 +1,280 @@
-import math
 from collections import defaultdict
 
 import numpy as np
-import time
+import scipy.stats
 import statsmodels.api as sm
 
+from model.correction_stage import CorrectionStage
 from model.drift_correction_type import DriftCorrectionType
 from model.elements import Element
+from model.error_propagation import PropagatedResults
 from model.isotopes import Isotope
-from model.maths import calculate_outlier_resistant_mean_and_st_dev, \
-    calculate_delta_from_ratio, calculate_number_of_outliers_to_remove, drift_correction, calculate_sims_alpha, \
-    calculate_alpha_correction, calculate_cap_value_and_uncertainty, calculate_the_total_sum_of_squares_from_the_mean, \
-    calculate_rsquared_from_tss_and_rss
+from model.maths import calculate_outlier_resistant_means_and_st_devs, calculate_number_of_outliers_to_remove, \
+    calculate_sims_alpha, calculate_the_total_sum_of_squares_from_the_mean, calculate_rsquared_from_tss_and_rss
+from model.montecarlo import MonteCarloBatch, MonteCarloRandomStreams, MonteCarloStatistics, MonteCarloSummary, \
+    create_montecarlo_seed, get_adaptive_montecarlo_numbers, has_montecarlo_summary_converged, \
+    SINGLE_PRECISION_CHECK_NUMBER_OF_SPOTS, SINGLE_PRECISION_TOLERANCE
+from model.sampling_method import SamplingMethod
 from model.settings.delta_constants import DeltaReferenceMaterial
 from model.settings.delta_constants import oxygen_isotope_reference, sulphur_isotope_reference, \
     carbon_isotope_reference, chlorine_isotope_reference
 import model.settings.isotope_reference_materials as rm_settings
 from model.settings.methods_from_isotopes import S36_S32, S34_S32, S33_S32
 from model.settings.statistics_values import PROBABILITY_CUTOFF, PROBABILITY_OF_SINGLE_OUTLIER
+from model.uncertainty_method import UncertaintyMethod
 
 
 class CalculationResults:
-    def __init__(self):
+    def __init__(self, timeline, montecarlo_seed=None, montecarlo_dtype=np.float64,
+                 uncertainty_method=UncertaintyMethod.MONTE_CARLO, montecarlo_chunk_size=None,
+                 sampling_method=SamplingMethod.PSEUDO_RANDOM, random_streams=None, montecarlo_number_of_threads=1,
+                 montecarlo_tolerance=None):
+        """
+        :param random_streams: streams to draw from instead of those of the seed, e.g. deviates kept for the session
+        :param montecarlo_number_of_threads: the number of threads that the spots of a Monte Carlo batch are split over
+        :param montecarlo_tolerance: in adaptive mode the tolerance that the final values must converge to, when the
+        number of trials is chosen by the calculation up to the number given
+        """
+        self.timeline = timeline
+        if random_streams is None:
+            if montecarlo_seed is None:
+                montecarlo_seed = create_montecarlo_seed()
+            random_streams = MonteCarloRandomStreams(montecarlo_seed, sampling_method=sampling_method)
+        self.random_streams = random_streams
+        self.montecarlo_dtype = montecarlo_dtype
+        self.montecarlo_number_of_threads = montecarlo_number_of_threads
+        # The number of trials of the Monte Carlo distributions, which is chosen by the calculation in adaptive mode
+        self.montecarlo_number = None
+        self.montecarlo_tolerance = montecarlo_tolerance
+        # The uncertainties are always propagated, as it is cheap, whereas the Monte Carlo distributions are only
+        # drawn when they are the uncertainty method.
+        self.uncertainty_method = uncertainty_method
+        # In chunked mode only summary statistics of the Monte Carlo distributions are kept
+        self.montecarlo_chunk_size = montecarlo_chunk_size
+        self.montecarlo_statistics = None
+        # The summary statistics of the Monte Carlo distribution of each spot, stage and ratio
+        self._montecarlo_summaries = {}
         self._t_zero = None
         self.all_ratio_results = defaultdict(RatioResults)
+        self.secondary_ion_yield_factor = None
+        self.alpha_sims_by_ratio = {}
+        self.external_values_by_ratio = {}
+        self.montecarlo_batches = []
+        self.propagated_results = None
 
     def calculate_raw_delta_values(self, samples, method, element, montecarlo_number, factor):
-        for sample in samples:
-            for spot in sample.spots:
-                spot.secondary_ion_yield = calculate_relative_secondary_ion_yield(spot, factor)
-                spot.raw_isotope_ratios = calculate_raw_isotope_ratios(spot.mass_peaks, method)
-                spot.mean_st_error_isotope_ratios, spot.outliers_removed_from_raw_data, spot.outlier_bounds_by_ratio, spot.cycle_flagging_information = calculate_mean_st_error_for_isotope_ratios(
-                    spot.number_of_count_measurements, spot.raw_isotope_ratios)
-                spot.not_corrected_deltas = calculate_raw_delta_for_isotope_ratio(spot, element, montecarlo_number)
-                spot.not_corrected_ratios = calculate_montecarlo_ratios(spot, element, montecarlo_number)
+        self.secondary_ion_yield_factor = factor
+        self.montecarlo_number = montecarlo_number
+        self.montecarlo_batches = []
+        spots = [spot for sample in samples for spot in sample.spots]
+        self.calculate_raw_delta_values_for_spots(spots, method, element, montecarlo_number, factor)
+
+    def calculate_raw_delta_values_for_spots(self, spots, method, element, montecarlo_number, factor):
+        for spot in spots:
+            spot.secondary_ion_yield = calculate_relative_secondary_ion_yield(spot, factor)
+            spot.raw_isotope_ratios = calculate_raw_isotope_ratios(spot.mass_peaks, method)
+        calculate_mean_st_error_for_isotope_ratios_of_spots(spots)
+        self.calculate_not_corrected_data(spots, method, element, montecarlo_number)
 
     def calculate_raw_delta_with_changed_cycle_data(self, samples, method, element, montecarlo_number, factor):
-        for sample in samples:
-            for spot in sample.spots:
-                spot.secondary_ion_yield = calculate_relative_secondary_ion_yield(spot, factor)
-                spot.raw_isotope_ratios = calculate_raw_isotope_ratios(spot.mass_peaks, method)
-                spot.mean_st_error_isotope_ratios = calculate_mean_and_st_dev_for_isotope_ratio_user_picked_outliers(
-                    spot)
-                spot.not_corrected_deltas = calculate_raw_delta_for_isotope_ratio(spot, element, montecarlo_number)
-                spot.not_corrected_ratios = calculate_montecarlo_ratios(spot, element, montecarlo_number)
+        self.secondary_ion_yield_factor = factor
+        self.montecarlo_number = montecarlo_number
+        self.montecarlo_batches = []
+        spots = [spot for sample in samples for spot in sample.spots]
+        for spot in spots:
+            spot.secondary_ion_yield = calculate_relative_secondary_ion_yield(spot, factor)
+            spot.raw_isotope_ratios = calculate_raw_isotope_ratios(spot.mass_peaks, method)
+        calculate_mean_and_st_error_for_isotope_ratios_user_picked_outliers(spots)
+        self.calculate_not_corrected_data(spots, method, element, montecarlo_number)
+
+    def calculate_not_corrected_data(self, spots, method, element, montecarlo_number):
+        # Chunks and adaptive steps are drawn when they are corrected
+        if self.uncertainty_method == UncertaintyMethod.MONTE_CARLO and not self.is_montecarlo_chunked() and \
+                self.montecarlo_tolerance is None:
+            self.create_montecarlo_batch(spots, method, element, montecarlo_number)
+
+        # Propagated for every spot in the session, as the corrections of new spots depend on the existing ones
+        self.propagated_results = PropagatedResults(self.timeline.spots, method.ratios)
+        self.propagated_results.propagate_not_corrected(get_standard_ratios(element))
+
+    def create_montecarlo_batch(self, spots, method, element, montecarlo_number):
+        batch = MonteCarloBatch(spots, method.ratios, montecarlo_number, self.montecarlo_dtype,
+                                number_of_threads=self.montecarlo_number_of_threads)
+        batch.draw_not_corrected_data(get_standard_ratios(element), self.random_streams)
+        self.montecarlo_batches.append(batch)
+        return batch
+
+    def is_montecarlo_chunked(self):
+        return self.montecarlo_chunk_size is not None
 
     def calculate_data_from_drift_correction_onwards(self, primary_rm, method, samples, drift_correction_type_by_ratio,
                                                      element, material, montecarlo_number):
-        self.all_ratio_results = self.drift_correction_process(primary_rm, method, samples, drift_correction_type_by_ratio, montecarlo_number)
-        self.SIMS_correction_process(primary_rm, method, samples, element, material, montecarlo_number)
-        if Isotope.S33 in method.isotopes:
-            self.calculate_cap_values_S33(samples)
-        if Isotope.S36 in method.isotopes:
-            self.calculate_cap_values_S36(samples)
+        if self.uncertainty_method == UncertaintyMethod.MONTE_CARLO and self.is_montecarlo_chunked():
+            self.calculate_montecarlo_in_chunks(primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                                material, montecarlo_number)
+        elif self.uncertainty_method == UncertaintyMethod.MONTE_CARLO and self.montecarlo_tolerance is not None:
+            self.calculate_montecarlo_adaptively(primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                                 material, montecarlo_number)
+        else:
+            self.all_ratio_results = self.drift_correction_process(primary_rm, method, samples, drift_correction_type_by_ratio, montecarlo_number)
+            self.SIMS_correction_process(primary_rm, method, samples, element, material, montecarlo_number)
+            for batch in self.montecarlo_batches:
+                self.calculate_cap_values(batch, method)
+                self.check_single_precision_accuracy(batch, method, element, drift_correction_type_by_ratio)
+        self.propagate_corrections(method, drift_correction_type_by_ratio)
+
+    def calculate_montecarlo_in_chunks(self, primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                       material, montecarlo_number):
+        """
+        Draws and corrects the Monte Carlo distributions of every spot one chunk of trials at a time, keeping only
+        their summary statistics. The drift regression of the first chunk is kept as a sample for the drift graphs.
+        """
+        first_chunk_ratio_results = []
+
+        def add_chunk(batch, all_ratio_results):
+            batch.remove_from_spots()
+            if not first_chunk_ratio_results:
+                first_chunk_ratio_results.append(all_ratio_results)
+
+        self.montecarlo_statistics = self._calculate_montecarlo_chunks(
+            primary_rm, method, samples, drift_correction_type_by_ratio, element, material, montecarlo_number,
+            self.montecarlo_chunk_size, add_chunk)
+        self.all_ratio_results = first_chunk_ratio_results[0]
+
+    def calculate_montecarlo_adaptively(self, primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                        material, montecarlo_number):
+        """
+        Draws and corrects the Monte Carlo distributions of every spot in steps that double the number of trials, up to
+        montecarlo_number, until the final values converge. Each step only calculates its new trials and appends them
+        to those of the earlier steps.
+        """
+        steps = []
+
+        def add_step(batch, all_ratio_results):
+            steps.append((batch, all_ratio_results, self.alpha_sims_by_ratio))
+
+        self._calculate_montecarlo_chunks(primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                          material, montecarlo_number, montecarlo_number, add_step)
+
+        # The steps are joined once they are all calculated, so each trial is only copied once
+        batch, self.all_ratio_results, self.alpha_sims_by_ratio = steps[0]
+        batch.extend(step[0] for step in steps[1:])
+        for ratio in method.ratios:
+            self.all_ratio_results[ratio].extend([step[1][ratio] for step in steps[1:]], ratio)
+            if ratio in self.alpha_sims_by_ratio:
+                self.alpha_sims_by_ratio[ratio] = np.concatenate([step[2][ratio] for step in steps])
+        self.montecarlo_batches = [batch]
+
+    def _calculate_montecarlo_chunks(self, primary_rm, method, samples, drift_correction_type_by_ratio, element,
+                                     material, montecarlo_number, maximum_chunk_size, add_chunk):
+        """
+        Draws and corrects the trials of every spot in chunks of at most maximum_chunk_size trials and calls
+        add_chunk(batch, all_ratio_results) with each. The chunk streams of the session carry on from one chunk to the
+        next, so with pseudo-random sampling the trials are the same as those drawn all at once. In adaptive mode the
+        chunks stop once the final values have converged, which is checked each time the number of trials doubles.
+        :return: the summary statistics of the trials, whose number is set as the number of trials of the results
+        """
+        spots = [spot for sample in samples for spot in sample.spots]
+        # Without chunks the statistics are only used to check for convergence
+        statistics = MonteCarloStatistics(spots, method.ratios,
+                                          are_only_final_values_kept=not self.is_montecarlo_chunked())
+        if self.montecarlo_tolerance is None:
+            checked_montecarlo_numbers = [montecarlo_number]
+        else:
+            checked_montecarlo_numbers = get_adaptive_montecarlo_numbers(montecarlo_number)
+
+        random_streams = self.random_streams
+        self.random_streams = random_streams.get_chunk_streams()
+        number_calculated = 0
+        summary = None
+        try:
+            for checked_montecarlo_number in checked_montecarlo_numbers:
+                while number_calculated < checked_montecarlo_number:
+                    chunk_size = min(maximum_chunk_size, checked_montecarlo_number - number_calculated)
+                    if number_calculated > 0:
+                        self.random_streams.start_next_chunk()
+                    self.montecarlo_batches = []
+                    batch = self.create_montecarlo_batch(spots, method, element, chunk_size)
+
+                    all_ratio_results = self.drift_correction_process(primary_rm, method, samples,
+                                                                      drift_correction_type_by_ratio, chunk_size)
+                    self.SIMS_correction_process(primary_rm, method, samples, element, material, chunk_size)
+                    self.calculate_cap_values(batch, method)
+                    self.check_single_precision_accuracy(batch, method, element, drift_correction_type_by_ratio)
+
+                    statistics.add_batch(batch, all_ratio_results)
+                    add_chunk(batch, all_ratio_results)
+                    number_calculated += chunk_size
+
+                if self.montecarlo_tolerance is not None:
+                    previous_summary, summary = summary, statistics.get_summary()
+                    if previous_summary is not None and \
+                            has_montecarlo_summary_converged(previous_summary, summary, self.montecarlo_tolerance):
+                        break
+        finally:
+            self.random_streams = random_streams
+            self.montecarlo_batches = []
+
+        self.montecarlo_number = number_calculated
+        # Once it has been chosen the number of trials is kept when the session is recalculated
+        self.montecarlo_tolerance = None
+        return statistics
+
+    def calculate_data_for_new_spots(self, spots, method, element, montecarlo_number, drift_correction_type_by_ratio):
+        """
+        Processes spots added to a session that has already been calculated, reusing the drift correction and the
+        SIMS alpha of the existing primary reference material spots. Only valid if none of the new spots are primary
+        reference material spots, the secondary ion yield factor is unchanged and the Monte Carlo is not chunked.
+        """
+        self.calculate_raw_delta_values_for_spots(spots, method, element, montecarlo_number,
+                                                  self.secondary_ion_yield_factor)
+        if self.uncertainty_method == UncertaintyMethod.MONTE_CARLO:
+            batch = self.montecarlo_batches[-1]
+            for ratio in method.ratios:
+                self.apply_drift_correction_to_batch(batch, ratio, drift_correction_type_by_ratio[ratio])
+                self.apply_SIMS_correction_to_batch(batch, ratio)
+
+            self.calculate_cap_values(batch, method)
+            self.check_single_precision_accuracy(batch, method, element, drift_correction_type_by_ratio)
+        self.propagate_corrections(method, drift_correction_type_by_ratio)
+
+    def check_single_precision_accuracy(self, batch, method, element, drift_correction_type_by_ratio):
+        """
+        Repeats the calculation of the first few spots of a single precision batch in double precision, from the same
+        random streams, and raises an exception if the results differ by more than the tolerance.
+        """
+        if batch.dtype == np.float64:
+            return
+
+        spots = batch.spots[:SINGLE_PRECISION_CHECK_NUMBER_OF_SPOTS]
+        reference_batch = MonteCarloBatch(spots, method.ratios, batch.montecarlo_number, np.float64,
+                                          assign_to_spots=False, number_of_threads=self.montecarlo_number_of_threads)
+        reference_batch.draw_not_corrected_data(get_standard_ratios(element), self.random_streams)
+        for ratio in method.ratios:
+            self.apply_drift_correction_to_batch(reference_batch, ratio, drift_correction_type_by_ratio[ratio])
+            self.apply_SIMS_correction_to_batch(reference_batch, ratio)
+
+        for ratio in method.ratios:
+            error = batch.get_single_precision_error(reference_batch, ratio)
+            if error > SINGLE_PRECISION_TOLERANCE:
+                raise Exception("The single precision Monte Carlo results for " + ratio.name() + " differ from the "
+                                "double precision results by " + format(error, ".2g") + " standard deviations. "
+                                "Use double precision for this session.")
 
     def drift_correction_process(self, primary_rm, method, samples, drift_correction_type_by_ratio, montecarlo_number):
         all_ratio_results = {}
         # Currently t_zero is not used anywhere else, however I feel it might be required in the future
-        self.calculate_t_zero(primary_rm.spots)
+        self.calculate_t_zero()
         t_zero = self.get_t_zero()
 
         for ratio in method.ratios:
             ratio_results = RatioResults()
-            ratio_results.assign_primary_rm_data_for_drift_corr_by_ratio(primary_rm, ratio, montecarlo_number, t_zero)
+            # Without Monte Carlo distributions the drift is characterised from the mean of each spot.
+            propagated_results = None
+            if self.uncertainty_method == UncertaintyMethod.ERROR_PROPAGATION:
+                propagated_results = self.propagated_results
+            ratio_results.assign_primary_rm_data_for_drift_corr_by_ratio(primary_rm, ratio, montecarlo_number, t_zero,
+                                                                         self.timeline, propagated_results)
             data = ratio_results.get_primary_rm_data_for_drift_corr()
             times = ratio_results.get_primary_rm_times()
             ratio_results.linear_regression_result = characterise_linear_drift(data, times)
@@ -70,46 +282,32 @@ class CalculationResults:
             ratio_results.drift_coefficient, ratio_results.drift_y_intercept = ratio_results.linear_regression_result[1]
 
             if ratio == S36_S32:
-                ratio_results.statsmodel_curvilinear_regression_result = characterise_curvilinear_drift(ratio,
-                                                                                                        primary_rm.spots,
-                                                                                                        montecarlo_number,
-                                                                                                        t_zero)
-
-            for sample in samples:
-                for spot in sample.spots:
-
-                    if drift_correction_type_by_ratio[ratio] == DriftCorrectionType.NONE:
-                        if ratio.has_delta:
-                            spot.drift_corrected_data[ratio] = spot.not_corrected_deltas[ratio]
-                        else:
-                            spot.drift_corrected_data[ratio] = spot.not_corrected_ratios[ratio]
+                ratio_results.statsmodel_curvilinear_regression_result = characterise_curvilinear_drift(data, times)
 
-                    elif drift_correction_type_by_ratio[ratio] == DriftCorrectionType.LIN:
-                        drift_correction_coef = ratio_results.drift_coefficient
+            all_ratio_results[ratio] = ratio_results
 
-                        spot.drift_corrected_data[ratio] = correct_data_for_linear_drift(spot,
-                                                                                         ratio,
-                                                                                         drift_correction_coef,
-                                                                                         t_zero)
+        self.all_ratio_results = all_ratio_results
+        for ratio in method.ratios:
+            for batch in self.montecarlo_batches:
+                self.apply_drift_correction_to_batch(batch, ratio, drift_correction_type_by_ratio[ratio])
 
-                    elif drift_correction_type_by_ratio[ratio] == DriftCorrectionType.QUAD:
-                        print("Not yet it's not")
-                    else:
-                        raise Exception("There is not a valid input drift type.")
+        return all_ratio_results
 
-            all_ratio_results[ratio] = ratio_results
+    def apply_drift_correction_to_batch(self, batch, ratio, drift_correction_type):
+        if drift_correction_type == DriftCorrectionType.NONE:
+            batch.apply_no_drift_correction(ratio)
 
-        return all_ratio_results
+        elif drift_correction_type == DriftCorrectionType.LIN:
+            relative_times = self.timeline.get_times_relative_to_t_zero(self.get_t_zero(), batch.spots)
+            batch.apply_linear_drift_correction(ratio, relative_times, self.all_ratio_results[ratio].drift_coefficient)
 
-    def calculate_t_zero(self, spots):
-        times = []
-        for spot in spots:
-            if spot.is_flagged:
-                continue
-            timestamp = time.mktime(spot.datetime.timetuple())
-            times.append(timestamp)
+        elif drift_correction_type == DriftCorrectionType.QUAD:
+            print("Not yet it's not")
+        else:
+            raise Exception("There is not a valid input drift type.")
 
-        self._t_zero = np.median(times)
+    def calculate_t_zero(self):
+        self._t_zero = self.timeline.calculate_t_zero()
 
     def get_t_zero(self):
         return self._t_zero
@@ -117,48 +315,140 @@ class CalculationResults:
     def SIMS_correction_process(self, primary_rm, method, samples, element, material, montecarlo_number):
         # This correction method is described fully in  Kita et al., 2009
         # TODO How does the ratio process work? Can you have different corrections for each one?
+        self.alpha_sims_by_ratio = {}
 
         for ratio in method.ratios:
             if ratio.has_delta:
+                external_mean, external_st_dev = get_primary_reference_material_external_values_by_ratio(ratio, element,
+                                                                                                         material,
+                                                                                                         primary_rm)
+                self.external_values_by_ratio[ratio] = (external_mean, external_st_dev)
+
+            if ratio.has_delta and self.uncertainty_method == UncertaintyMethod.MONTE_CARLO:
                 primary_rm_spot_data = [spot.drift_corrected_data[ratio] for spot in primary_rm.spots if not spot.is_flagged and ratio.has_delta]
 
                 if not primary_rm_spot_data:
                     raise Exception("There is not primary reference material data available")
 
-                primary_rm_mean = np.mean(primary_rm_spot_data, axis=0)
+                # Summed one spot at a time, rather than stacking the distributions of every spot into one array
+                primary_rm_mean = np.zeros(montecarlo_number)
+                for spot_data in primary_rm_spot_data:
+                    np.add(primary_rm_mean, spot_data, out=primary_rm_mean)
+                primary_rm_mean /= len(primary_rm_spot_data)
 
-                external_mean, external_st_dev = get_primary_reference_material_external_values_by_ratio(ratio, element,
-                                                                                                         material,
-                                                                                                         primary_rm)
-                external_rm_montecarlo = np.random.normal(external_mean, external_st_dev, montecarlo_number)
-                alpha_sims = calculate_sims_alpha(
+                external_rm_montecarlo = external_mean + external_st_dev * \
+                    self.random_streams.draw_reference_material_standard_normal(ratio, montecarlo_number)
+                self.alpha_sims_by_ratio[ratio] = calculate_sims_alpha(
                     primary_reference_material_mean_delta=primary_rm_mean,
                     externally_measured_primary_reference_value=external_rm_montecarlo)
 
-            for sample in samples:
-                for spot in sample.spots:
+            for batch in self.montecarlo_batches:
+                self.apply_SIMS_correction_to_batch(batch, ratio)
 
-                    if ratio.has_delta:
-                        data = spot.drift_corrected_data[ratio]
-                        spot.alpha_corrected_data[ratio] = calculate_alpha_correction(data, alpha_sims)
-                    else:
-                        spot.alpha_corrected_data[ratio] = spot.drift_corrected_data[ratio]
+    def apply_SIMS_correction_to_batch(self, batch, ratio):
+        batch.apply_alpha_correction(ratio, self.alpha_sims_by_ratio.get(ratio))
 
-    def calculate_cap_values_S33(self, samples):
-        for sample in samples:
-            for spot in sample.spots:
-                spot.cap_data_S33 = calculate_cap_value_and_uncertainty(
-                    delta_value_x=spot.alpha_corrected_data[S33_S32],
-                    delta_value_relative=spot.alpha_corrected_data[S34_S32],
-                    MDF=0.515)
+    def calculate_cap_values(self, batch, method):
+        if Isotope.S33 in method.isotopes:
+            batch.cap_data_S33 = batch.calculate_cap_values(S33_S32, S34_S32, MDF=0.515, out=batch.cap_data_S33)
+            for i, spot in enumerate(batch.spots):
+                spot.cap_data_S33 = batch.cap_data_S33[i]
+        if Isotope.S36 in method.isotopes:
+            batch.cap_data_S36 = batch.calculate_cap_values(S36_S32, S34_S32, MDF=1.91, out=batch.cap_data_S36)
+            for i, spot in enumerate(batch.spots):
+                spot.cap_data_S36 = batch.cap_data_S36[i]
 
-    def calculate_cap_values_S36(self, samples):
-        for sample in samples:
-            for spot in sample.spots:
-                spot.cap_data_S36 = calculate_cap_value_and_uncertainty(
-                    delta_value_x=spot.alpha_corrected_data[S36_S32],
-                    delta_value_relative=spot.alpha_corrected_data[S34_S32],
-                    MDF=1.91)
+    def propagate_corrections(self, method, drift_correction_type_by_ratio):
+        relative_times = self.timeline.get_times_relative_to_t_zero(self.get_t_zero())
+        primary_rm_mask = self.timeline.primary_mask & ~self.timeline.get_flagged_mask()
+        for ratio in method.ratios:
+            self.propagated_results.propagate_drift_correction(ratio, drift_correction_type_by_ratio[ratio],
+                                                               relative_times, primary_rm_mask)
+            external_mean, external_st_dev = self.external_values_by_ratio.get(ratio, (None, None))
+            self.propagated_results.propagate_alpha_correction(ratio, external_mean, external_st_dev, primary_rm_mask)
+
+        if Isotope.S33 in method.isotopes:
+            self.propagated_results.propagate_cap(CorrectionStage.CAP_S33, S33_S32, S34_S32, MDF=0.515)
+        if Isotope.S36 in method.isotopes:
+            self.propagated_results.propagate_cap(CorrectionStage.CAP_S36, S36_S32, S34_S32, MDF=1.91)
+
+    def get_mean_and_st_dev(self, spot, stage, ratio=None, uncertainty_method=None):
+        """
+        :param stage: a CorrectionStage
+        :param ratio: the ratio, which is not needed for the CAP values
+        :param uncertainty_method: the method of the results to use, by default the uncertainty method of the session
+        :return: the mean and standard deviation of the value of the spot
+        """
+        if uncertainty_method is None:
+            uncertainty_method = self.uncertainty_method
+
+        if uncertainty_method == UncertaintyMethod.ERROR_PROPAGATION:
+            return self.propagated_results.get_mean_and_st_dev(spot, stage, ratio)
+
+        if self.is_montecarlo_chunked():
+            return self.montecarlo_statistics.get_mean_and_st_dev(spot, stage, ratio)
+
+        return self._get_spot_montecarlo_summary(spot, stage, ratio).get_mean_and_st_dev()
+
+    def get_quartiles(self, spot, stage, ratio=None):
+        if self.uncertainty_method == UncertaintyMethod.ERROR_PROPAGATION:
+            # The propagated value is normally distributed
+            mean, st_dev = self.propagated_results.get_mean_and_st_dev(spot, stage, ratio)
+            return scipy.stats.norm.ppf([0.25, 0.75], loc=mean, scale=st_dev)
+
+        if self.is_montecarlo_chunked():
+            return self.montecarlo_statistics.get_quartiles(spot, stage, ratio)
+
+        return self._get_spot_montecarlo_summary(spot, stage, ratio).get_quartiles()
+
+    def _get_spot_montecarlo_summary(self, spot, stage, ratio):
+        data = get_montecarlo_data(spot, stage, ratio)
+        summary = self._montecarlo_summaries.get((spot, stage, ratio))
+        # A distribution that is recalculated is assigned to the spot again, so a summary of another array is stale
+        if summary is None or summary.data is not data:
+            summary = MonteCarloSummary(data)
+            self._montecarlo_summaries[(spot, stage, ratio)] = summary
+        return summary
+
+    def get_montecarlo_summary(self):
+        """
+        :return: the means and standard deviations of the final corrected values, i.e. the alpha corrected and CAP
+        values, of every spot and ratio in the Monte Carlo batches
+        """
+        if self.is_montecarlo_chunked():
+            return self.montecarlo_statistics.get_summary()
+
+        final_data = []
+        for batch in self.montecarlo_batches:
+            final_data.extend(batch.get_alpha_corrected_data(ratio) for ratio in batch.ratios)
+            final_data.extend(data for data in (batch.cap_data_S33, batch.cap_data_S36) if data is not None)
+
+        final_data = np.concatenate(final_data)
+        return np.mean(final_data, axis=1, dtype=np.float64), np.std(final_data, axis=1, dtype=np.float64)
+
+    def get_drift_coefficient_mean_and_st_dev(self, ratio):
+        if self.uncertainty_method == UncertaintyMethod.ERROR_PROPAGATION:
+            return self.propagated_results.drift_coefficients[ratio]
+
+        if self.is_montecarlo_chunked():
+            return self.montecarlo_statistics.get_drift_coefficient_mean_and_st_dev(ratio)
+
+        drift_coefficient = self.all_ratio_results[ratio].drift_coefficient
+        return np.mean(drift_coefficient), np.std(drift_coefficient)
+
+
+def get_montecarlo_data(spot, stage, ratio=None):
+    if stage == CorrectionStage.NOT_CORRECTED:
+        return spot.not_corrected_deltas[ratio] if ratio.has_delta else spot.not_corrected_ratios[ratio]
+    elif stage == CorrectionStage.DRIFT_CORRECTED:
+        return spot.drift_corrected_data[ratio]
+    elif stage == CorrectionStage.ALPHA_CORRECTED:
+        return spot.alpha_corrected_data[ratio]
+    elif stage == CorrectionStage.CAP_S33:
+        return spot.cap_data_S33
+    elif stage == CorrectionStage.CAP_S36:
+        return spot.cap_data_S36
+    raise Exception("There is not a valid correction stage.")
 
 
 # TODO write a test for this function
@@ -187,66 +477,64 @@ def calculate_raw_isotope_ratios(mass_peaks, method):
     return raw_isotope_ratios
 
 
-def calculate_mean_st_error_for_isotope_ratios(number_of_count_measurements, raw_isotope_ratios):
-    number_of_outliers_to_remove = calculate_number_of_outliers_to_remove(number_of_count_measurements,
-                                                                          PROBABILITY_CUTOFF,
-                                                                          PROBABILITY_OF_SINGLE_OUTLIER)
-    mean_st_error_isotope_ratios = {}
-    outliers_removed_from_raw_data = {}
-    outlier_bounds_by_ratio = {}
-    cycle_flagging_information = {}
-    for ratio, raw_ratio_list in raw_isotope_ratios.items():
-        mean, st_dev, n, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(raw_ratio_list,
-                                                                                                    number_of_outliers_to_remove)
-
-        st_error = st_dev / math.sqrt(n)
-        mean_st_error_isotope_ratios[ratio] = [mean, st_error]
-        outliers_removed_from_raw_data[ratio] = removed_data
-        outlier_bounds_by_ratio[ratio] = outlier_bounds
-
-        cycle_exclude_list = [value in outliers_removed_from_raw_data[ratio] for value in raw_ratio_list]
-        cycle_flagging_information[ratio] = cycle_exclude_list
-
-    return mean_st_error_isotope_ratios, outliers_removed_from_raw_data, outlier_bounds_by_ratio, cycle_flagging_information
-
-
-def calculate_raw_delta_for_isotope_ratio(spot, element, montecarlo_number):
+def get_raw_isotope_ratio_data(spots):
+    """
+    :return: the spot and ratio of each row, the raw isotope ratios of every cycle of every ratio of the spots as the
+    rows of a 2D array, and a mask of the cycles of each row, as spots may have different numbers of cycles
+    """
+    spots_and_ratios = [(spot, ratio) for spot in spots for ratio in spot.raw_isotope_ratios]
+    number_of_cycles = max((len(spot.raw_isotope_ratios[ratio]) for spot, ratio in spots_and_ratios), default=0)
+    raw_ratio_data = np.zeros((len(spots_and_ratios), number_of_cycles))
+    is_cycle = np.zeros(raw_ratio_data.shape, dtype=bool)
+    for i, (spot, ratio) in enumerate(spots_and_ratios):
+        raw_ratio_list = spot.raw_isotope_ratios[ratio]
+        raw_ratio_data[i, :len(raw_ratio_list)] = raw_ratio_list
+        is_cycle[i, :len(raw_ratio_list)] = True
+
+    return spots_and_ratios, raw_ratio_data, is_cycle
+
+
+def calculate_mean_st_error_for_isotope_ratios_of_spots(spots):
+    # The outliers of every ratio of every spot are removed at once
+    spots_and_ratios, raw_ratio_data, is_cycle = get_raw_isotope_ratio_data(spots)
+    for spot in spots:
+        spot.mean_st_error_isotope_ratios = {}
+        spot.outliers_removed_from_raw_data = {}
+        spot.outlier_bounds_by_ratio = {}
+        spot.cycle_flagging_information = {}
+    if not spots_and_ratios:
+        return
+
+    numbers_of_outliers_to_remove = {number: calculate_number_of_outliers_to_remove(number, PROBABILITY_CUTOFF,
+                                                                                    PROBABILITY_OF_SINGLE_OUTLIER)
+                                     for number in {spot.number_of_count_measurements for spot in spots}}
+    means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+        raw_ratio_data,
+        [numbers_of_outliers_to_remove[spot.number_of_count_measurements] for spot, _ in spots_and_ratios],
+        is_cycle)
+    st_errors = st_devs / np.sqrt(numbers_used)
+
+    for i, (spot, ratio) in enumerate(spots_and_ratios):
+        number_of_cycles = len(spot.raw_isotope_ratios[ratio])
+        spot.mean_st_error_isotope_ratios[ratio] = [means[i], st_errors[i]]
+        spot.outliers_removed_from_raw_data[ratio] = raw_ratio_data[i][is_removed[i]].tolist()
+        spot.outlier_bounds_by_ratio[ratio] = tuple(outlier_bounds[i]) if number_of_cycles > 1 else ()
+        spot.cycle_flagging_information[ratio] = is_removed[i, :number_of_cycles].tolist()
+
+
+def get_standard_ratios(element):
     # TODO this is not quite right yet
     if element == Element.OXY:
-        standard_ratios = oxygen_isotope_reference[DeltaReferenceMaterial.VSMOW]
+        return oxygen_isotope_reference[DeltaReferenceMaterial.VSMOW]
     elif element == Element.SUL:
-        standard_ratios = sulphur_isotope_reference[DeltaReferenceMaterial.VCDT]
+        return sulphur_isotope_reference[DeltaReferenceMaterial.VCDT]
     elif element == Element.CAR:
-        standard_ratios = carbon_isotope_reference[DeltaReferenceMaterial.VPDB]
+        return carbon_isotope_reference[DeltaReferenceMaterial.VPDB]
     elif element == Element.CHL:
-        standard_ratios = chlorine_isotope_reference[DeltaReferenceMaterial.SMOC]
+        return chlorine_isotope_reference[DeltaReferenceMaterial.SMOC]
     else:
         raise Exception
 
-    not_corrected_deltas = {}
-
-    for ratio, [mean, st_dev] in spot.mean_st_error_isotope_ratios.items():
-        mean_montecarlo = np.random.normal(mean, st_dev, montecarlo_number)
-        if ratio.has_delta:
-            standard_ratio_value, uncertainty = standard_ratios[ratio]
-            if uncertainty == 0:
-                standard_ratio_value_montecarlo = np.full((montecarlo_number,), standard_ratio_value)
-            else:
-                standard_ratio_value_montecarlo = np.random.normal(loc=standard_ratio_value, scale=uncertainty,
-                                                                   size=montecarlo_number)
-            delta_montecarlo = calculate_delta_from_ratio(mean_montecarlo, standard_ratio_value_montecarlo)
-            not_corrected_deltas[ratio] = delta_montecarlo
-
-    return not_corrected_deltas
-
-def calculate_montecarlo_ratios(spot, element, montecarlo_number):
-    not_corrected_ratios = {}
-    for ratio, [mean, st_dev] in spot.mean_st_error_isotope_ratios.items():
-        mean_montecarlo = np.random.normal(mean, st_dev, montecarlo_number)
-        if not ratio.has_delta:
-            not_corrected_ratios[ratio] = mean_montecarlo
-
-    return not_corrected_ratios
 
 def characterise_linear_drift(data, times):
     # adding a column of '1s' for linear regression modelling to the array 'times'
@@ -262,8 +550,7 @@ def characterise_linear_drift(data, times):
 
     return [r_squared, (m, c)]
 
-def characterise_curvilinear_drift(ratio, spots, montecarlo_number, t_zero):
-    values, times = get_data_for_drift_characterisation_input(ratio, spots, montecarlo_number, t_zero)
+def characterise_curvilinear_drift(values, times):
     Y = values
     x1 = times
     x2 = [t ** 2 for t in times]
@@ -275,72 +562,49 @@ def characterise_curvilinear_drift(ratio, spots, montecarlo_number, t_zero):
     return statsmodel_result
 
 
-def get_data_for_drift_characterisation_input(ratio, spots, montecarlo_number, t_zero):
-    times = []
+def get_data_for_drift_characterisation_input(ratio, spots, montecarlo_number, t_zero, timeline,
+                                              propagated_results=None):
     spots_to_use = [spot for spot in spots if not spot.is_flagged]
     if len(spots_to_use) < 2:
         raise Exception("The number of spots which are not excluded is not sufficient to characterise drift.")
-    k = montecarlo_number
+    times = timeline.get_times_relative_to_t_zero(t_zero, spots_to_use)
+    k = montecarlo_number if propagated_results is None else 1
     values = np.empty((len(spots_to_use), k))
     for i, spot in enumerate(spots_to_use):
-        if spot.is_flagged:
-            continue
-        timestamp = time.mktime(spot.datetime.timetuple())
-        relative_time = timestamp - t_zero
-        if ratio.has_delta:
+        # The distributions drawn for the spot are shared rather than drawn again
+        if propagated_results is not None:
+            value_montecarlo = propagated_results.get_mean_and_st_dev(spot, CorrectionStage.NOT_CORRECTED, ratio)[0]
+        elif ratio.has_delta:
             value_montecarlo = spot.not_corrected_deltas[ratio]
         else:
+            value_montecarlo = spot.not_corrected_ratios[ratio]
 
-            value_montecarlo = np.random.normal(spot.mean_st_error_isotope_ratios[ratio][0],
-                                                spot.mean_st_error_isotope_ratios[ratio][1], montecarlo_number)
-
-        times.append(relative_time)
         values[i] = value_montecarlo
 
     return values, times
 
 
-def correct_data_for_linear_drift(spot, ratio, drift_correction_coef, t_zero):
-    timestamp = time.mktime(spot.datetime.timetuple())
-    relative_time = timestamp - t_zero
-    if ratio.has_delta:
-        montecarlo_value = spot.not_corrected_deltas[ratio]
-
-    else:
-        montecarlo_value = spot.not_corrected_ratios[ratio]
-
-
-    drift_corrected_data = drift_correction(
-        x=relative_time,
-        y=montecarlo_value,
-        drift_coefficient=drift_correction_coef,
-        zero_time=t_zero)
-    return drift_corrected_data
-
-
 def get_primary_reference_material_external_values_by_ratio(ratio, element, material, primary_reference_material):
     key = (element, material, primary_reference_material.name)
     return rm_settings.reference_material_dictionary[key][ratio]
 
 
-def calculate_mean_and_st_dev_for_isotope_ratio_user_picked_outliers(spot):
-    mean_st_dev_isotope_ratios = {}
-    for ratio in spot.raw_isotope_ratios.keys():
-        list_of_cycle_exclusion_information = spot.cycle_flagging_information[ratio]
-        raw_ratio_list = spot.raw_isotope_ratios[ratio]
-        raw_ratio_list_exclude = []
-        for i, boolean in enumerate(list_of_cycle_exclusion_information):
-            if not boolean:
-                raw_ratio_list_exclude.append(i)
-
-        raw_ratio_list = [raw_ratio_list[i] for i in raw_ratio_list_exclude]
+def calculate_mean_and_st_error_for_isotope_ratios_user_picked_outliers(spots):
+    # The cycles flagged by the user are excluded, and no further outliers are removed
+    spots_and_ratios, raw_ratio_data, is_cycle = get_raw_isotope_ratio_data(spots)
+    for spot in spots:
+        spot.mean_st_error_isotope_ratios = {}
+    if not spots_and_ratios:
+        return
 
-        mean, st_dev, n, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(raw_ratio_list,
-                                                                                                    0)
-        st_error = st_dev / math.sqrt(n)
-        mean_st_dev_isotope_ratios[ratio] = [mean, st_error]
+    for i, (spot, ratio) in enumerate(spots_and_ratios):
+        is_cycle[i, :len(spot.raw_isotope_ratios[ratio])] &= ~np.array(spot.cycle_flagging_information[ratio],
+                                                                        dtype=bool)
+    means, st_devs, numbers_used, _, _ = calculate_outlier_resistant_means_and_st_devs(raw_ratio_data, 0, is_cycle)
+    st_errors = st_devs / np.sqrt(numbers_used)
 
-    return mean_st_dev_isotope_ratios
+    for i, (spot, ratio) in enumerate(spots_and_ratios):
+        spot.mean_st_error_isotope_ratios[ratio] = [means[i], st_errors[i]]
 
 
 class RatioResults:
@@ -356,11 +620,28 @@ class RatioResults:
         self.drift_y_intercept = None
         self.drift_correction_type = None
 
-    def assign_primary_rm_data_for_drift_corr_by_ratio(self, primary_rm, ratio, montecarlo_number, t_zero):
-        values, times = get_data_for_drift_characterisation_input(ratio, primary_rm.spots, montecarlo_number, t_zero)
+    def assign_primary_rm_data_for_drift_corr_by_ratio(self, primary_rm, ratio, montecarlo_number, t_zero, timeline,
+                                                       propagated_results=None):
+        values, times = get_data_for_drift_characterisation_input(ratio, primary_rm.spots, montecarlo_number, t_zero,
+                                                                  timeline, propagated_results)
         self._primary_rm_data_for_drift_corr = values
         self._primary_rm_times_relative_to_t_zero = times
 
+    def extend(self, all_ratio_results, ratio):
+        """
+        Appends the drift regressions of the trials of other results of the ratio, e.g. those of the next trials.
+        """
+        all_ratio_results = [self] + list(all_ratio_results)
+        self._primary_rm_data_for_drift_corr = np.concatenate(
+            [ratio_results.get_primary_rm_data_for_drift_corr() for ratio_results in all_ratio_results], axis=1)
+        r_squared = np.concatenate([ratio_results.linear_regression_result[0] for ratio_results in all_ratio_results])
+        self.drift_coefficient = np.concatenate([results.drift_coefficient for results in all_ratio_results])
+        self.drift_y_intercept = np.concatenate([results.drift_y_intercept for results in all_ratio_results])
+        self.linear_regression_result = [r_squared, (self.drift_coefficient, self.drift_y_intercept)]
+        if ratio == S36_S32:
+            self.statsmodel_curvilinear_regression_result = characterise_curvilinear_drift(
+                self._primary_rm_data_for_drift_corr, self._primary_rm_times_relative_to_t_zero)
+
     def get_primary_rm_data_for_drift_corr(self):
         return self._primary_rm_data_for_drift_corr
 
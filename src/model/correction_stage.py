@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class CorrectionStage(Enum):
+    NOT_CORRECTED = "Not corrected"
+    DRIFT_CORRECTED = "Drift corrected"
+    ALPHA_CORRECTED = "Alpha corrected"
+    CAP_S33 = "Cap S33"
+    CAP_S36 = "Cap S36"
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class DetectorParameterSet:
+    def __init__(self, parameter_set_id, detector_names, detector_yields, detector_backgrounds, dead_times):
+        self.id = parameter_set_id
+        self.detector_names = detector_names
+        self.detector_yields = detector_yields
+        self.detector_backgrounds = detector_backgrounds
+        self.dead_times = dead_times
+
+
+class DetectorParameterTable:
+    """
+    The distinct sets of detector parameters used by the spots of a session. The parameters are normally the same for
+    a whole session, so each spot refers to a shared parameter set by its id rather than holding its own copy. More
+    than one parameter set means that the detectors were recalibrated partway through the session.
+    """
+
+    def __init__(self, spots=()):
+        self.parameter_sets = []
+        self._parameter_set_ids_by_key = {}
+        self._spots = []
+
+        for spot in spots:
+            self.add_spot(spot)
+
+    def add_spot(self, spot):
+        key = (tuple(spot.detector_names), tuple(spot.detector_yields), tuple(spot.detector_backgrounds),
+               tuple(spot.dead_times))
+        parameter_set_id = self._parameter_set_ids_by_key.get(key)
+        if parameter_set_id is None:
+            parameter_set_id = len(self.parameter_sets)
+            self._parameter_set_ids_by_key[key] = parameter_set_id
+            self.parameter_sets.append(DetectorParameterSet(parameter_set_id,
+                                                            list(spot.detector_names),
+                                                            np.array(spot.detector_yields, dtype=np.float64),
+                                                            np.array(spot.detector_backgrounds, dtype=np.float64),
+                                                            np.array(spot.dead_times, dtype=np.float64)))
+
+        # The spot uses the arrays of the shared parameter set from now on.
+        parameter_set = self.parameter_sets[parameter_set_id]
+        spot.detector_parameter_set_id = parameter_set_id
+        spot.detector_yields = parameter_set.detector_yields
+        spot.detector_backgrounds = parameter_set.detector_backgrounds
+        spot.dead_times = parameter_set.dead_times
+        self._spots.append(spot)
+
+    def get_parameter_set(self, spot):
+        return self.parameter_sets[spot.detector_parameter_set_id]
+
+    def has_calibration_changed(self):
+        return len(self.parameter_sets) > 1
+
+    def get_calibration_changes(self):
+        """
+        :return: list of (spot, previous parameter set id, new parameter set id) for each spot, in time order, whose
+        detector parameters differ from those of the spot measured before it
+        """
+        calibration_changes = []
+        spots_in_time_order = sorted(self._spots, key=lambda spot: spot.timestamp)
+        for previous_spot, spot in zip(spots_in_time_order, spots_in_time_order[1:]):
+            if spot.detector_parameter_set_id != previous_spot.detector_parameter_set_id:
+                calibration_changes.append((spot, previous_spot.detector_parameter_set_id,
+                                            spot.detector_parameter_set_id))
+        return calibration_changes
@@ -0,0 +1,151 @@
+import math
+
+import numpy as np
+
+from model.correction_stage import CorrectionStage
+from model.drift_correction_type import DriftCorrectionType
+from model.maths import calculate_delta_from_ratio, calculate_sims_alpha, calculate_alpha_correction, \
+    calculate_cap_value_and_uncertainty
+
+
+class PropagatedResults:
+    """
+    First order propagation of the uncertainties of every spot in a session through the same delta, drift, SIMS alpha
+    and CAP calculations as the Monte Carlo distributions. This gives their means and standard deviations without
+    drawing any samples.
+
+    As in the Monte Carlo calculation the measured ratio of each spot, the standard ratio and the externally measured
+    value of the primary reference material are independent. The correlation between a primary reference material
+    spot and the drift and alpha corrections that it contributes to is kept.
+    """
+
+    def __init__(self, spots, ratios):
+        self.spots = list(spots)
+        self.ratios = list(ratios)
+        self._index_by_spot = {spot: i for i, spot in enumerate(self.spots)}
+
+        shape = (len(self.spots), len(self.ratios))
+        self.means = {stage: np.full(shape, np.nan) for stage in
+                      (CorrectionStage.NOT_CORRECTED, CorrectionStage.DRIFT_CORRECTED, CorrectionStage.ALPHA_CORRECTED)}
+        self.variances = {stage: np.full(shape, np.nan) for stage in self.means}
+        # The drift coefficient and alpha of each ratio as (mean, standard deviation)
+        self.drift_coefficients = {}
+        self.alpha_sims = {}
+
+        self._relative_times = np.zeros(len(self.spots))
+        self._drift_weights = {}
+
+    def get_mean_and_st_dev(self, spot, stage, ratio=None):
+        i = self._index_by_spot[spot]
+        if stage in (CorrectionStage.CAP_S33, CorrectionStage.CAP_S36):
+            return self.means[stage][i], math.sqrt(self.variances[stage][i])
+        j = self.ratios.index(ratio)
+        return self.means[stage][i, j], math.sqrt(self.variances[stage][i, j])
+
+    def propagate_not_corrected(self, standard_ratios):
+        means = np.array([[spot.mean_st_error_isotope_ratios[ratio][0] for ratio in self.ratios]
+                          for spot in self.spots], dtype=np.float64).reshape(len(self.spots), len(self.ratios))
+        st_errors = np.array([[spot.mean_st_error_isotope_ratios[ratio][1] for ratio in self.ratios]
+                              for spot in self.spots], dtype=np.float64).reshape(len(self.spots), len(self.ratios))
+
+        not_corrected_means = self.means[CorrectionStage.NOT_CORRECTED]
+        not_corrected_variances = self.variances[CorrectionStage.NOT_CORRECTED]
+        for j, ratio in enumerate(self.ratios):
+            if ratio.has_delta:
+                standard_ratio_value, uncertainty = standard_ratios[ratio]
+                # The partial derivatives of the delta by the measured ratio and by the standard ratio
+                d_ratio = 1000 / standard_ratio_value
+                d_standard_ratio = -1000 * means[:, j] / standard_ratio_value ** 2
+                not_corrected_means[:, j] = calculate_delta_from_ratio(means[:, j], standard_ratio_value)
+                not_corrected_variances[:, j] = (d_ratio * st_errors[:, j]) ** 2 + (d_standard_ratio * uncertainty) ** 2
+            else:
+                not_corrected_means[:, j] = means[:, j]
+                not_corrected_variances[:, j] = st_errors[:, j] ** 2
+
+    def propagate_drift_correction(self, ratio, drift_correction_type, relative_times, primary_rm_mask):
+        """
+        :param relative_times: the time of each spot relative to t zero
+        :param primary_rm_mask: the primary reference material spots which are not flagged
+        """
+        j = self.ratios.index(ratio)
+        means = self.means[CorrectionStage.NOT_CORRECTED][:, j]
+        variances = self.variances[CorrectionStage.NOT_CORRECTED][:, j]
+        self._relative_times = relative_times
+
+        # The drift coefficient is a weighted sum of the primary reference material values
+        weights = np.zeros(len(self.spots))
+        if drift_correction_type == DriftCorrectionType.LIN:
+            time_deviations = relative_times[primary_rm_mask] - np.mean(relative_times[primary_rm_mask])
+            weights[primary_rm_mask] = time_deviations / np.sum(time_deviations ** 2)
+            drift_coefficient = np.dot(weights, means)
+            drift_coefficient_variance = np.dot(weights ** 2, variances)
+            self.drift_coefficients[ratio] = (drift_coefficient, math.sqrt(drift_coefficient_variance))
+
+            self.means[CorrectionStage.DRIFT_CORRECTED][:, j] = means - relative_times * drift_coefficient
+            self.variances[CorrectionStage.DRIFT_CORRECTED][:, j] = \
+                variances - 2 * relative_times * weights * variances + relative_times ** 2 * drift_coefficient_variance
+
+        elif drift_correction_type == DriftCorrectionType.NONE:
+            self.means[CorrectionStage.DRIFT_CORRECTED][:, j] = means
+            self.variances[CorrectionStage.DRIFT_CORRECTED][:, j] = variances
+
+        elif drift_correction_type == DriftCorrectionType.QUAD:
+            print("Not yet it's not")
+        else:
+            raise Exception("There is not a valid input drift type.")
+
+        self._drift_weights[ratio] = weights
+
+    def propagate_alpha_correction(self, ratio, external_mean, external_st_dev, primary_rm_mask):
+        j = self.ratios.index(ratio)
+        drift_corrected_means = self.means[CorrectionStage.DRIFT_CORRECTED][:, j]
+        drift_corrected_variances = self.variances[CorrectionStage.DRIFT_CORRECTED][:, j]
+        if not ratio.has_delta:
+            self.means[CorrectionStage.ALPHA_CORRECTED][:, j] = drift_corrected_means
+            self.variances[CorrectionStage.ALPHA_CORRECTED][:, j] = drift_corrected_variances
+            return
+
+        number_of_primary_rm_spots = np.count_nonzero(primary_rm_mask)
+        if number_of_primary_rm_spots == 0:
+            raise Exception("There is not primary reference material data available")
+
+        variances = self.variances[CorrectionStage.NOT_CORRECTED][:, j]
+        weights = self._drift_weights[ratio]
+        relative_times = self._relative_times
+
+        # The weight of the not corrected value of each spot in the mean of the drift corrected primary reference
+        # material, through its own value and through the drift coefficient
+        primary_rm_weights = np.where(primary_rm_mask, 1 / number_of_primary_rm_spots, 0) \
+            - np.mean(relative_times[primary_rm_mask]) * weights
+        primary_rm_mean = np.mean(drift_corrected_means[primary_rm_mask])
+        primary_rm_mean_variance = np.dot(primary_rm_weights ** 2, variances)
+
+        alpha_sims = calculate_sims_alpha(primary_rm_mean, external_mean)
+        d_alpha_primary_rm = 1 / (1000 + external_mean)
+        d_alpha_external = -(1000 + primary_rm_mean) / (1000 + external_mean) ** 2
+        alpha_sims_variance = d_alpha_primary_rm ** 2 * primary_rm_mean_variance \
+            + (d_alpha_external * external_st_dev) ** 2
+        self.alpha_sims[ratio] = (alpha_sims, math.sqrt(alpha_sims_variance))
+
+        d_alpha_corrected_drift_corrected = 1 / alpha_sims
+        d_alpha_corrected_alpha = -(1000 + drift_corrected_means) / alpha_sims ** 2
+        # The covariance of each drift corrected value with the primary reference material mean
+        covariances = primary_rm_weights * variances \
+            - relative_times * np.dot(weights * primary_rm_weights, variances)
+
+        self.means[CorrectionStage.ALPHA_CORRECTED][:, j] = calculate_alpha_correction(drift_corrected_means,
+                                                                                       alpha_sims)
+        self.variances[CorrectionStage.ALPHA_CORRECTED][:, j] = \
+            d_alpha_corrected_drift_corrected ** 2 * drift_corrected_variances \
+            + 2 * d_alpha_corrected_drift_corrected * d_alpha_corrected_alpha * d_alpha_primary_rm * covariances \
+            + d_alpha_corrected_alpha ** 2 * alpha_sims_variance
+
+    def propagate_cap(self, stage, ratio_x, ratio_relative, MDF):
+        x_means = self.means[CorrectionStage.ALPHA_CORRECTED][:, self.ratios.index(ratio_x)]
+        x_variances = self.variances[CorrectionStage.ALPHA_CORRECTED][:, self.ratios.index(ratio_x)]
+        relative_means = self.means[CorrectionStage.ALPHA_CORRECTED][:, self.ratios.index(ratio_relative)]
+        relative_variances = self.variances[CorrectionStage.ALPHA_CORRECTED][:, self.ratios.index(ratio_relative)]
+
+        d_cap_relative = -MDF * (1 + relative_means / 1000) ** (MDF - 1)
+        self.means[stage] = calculate_cap_value_and_uncertainty(x_means, relative_means, MDF)
+        self.variances[stage] = x_variances + d_cap_relative ** 2 * relative_variances
@@ -1,114 +1,255 @@
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+from model.settings.asc_file_settings_general import DATE_INDEX, TIME_INDEX, X_POSITION_INDEX, Y_POSITION_INDEX
+from utils.convert_date_format_from_new_asci import standardise_date_format
+from utils.convert_twelve_to_twenty_four_hour_time import convert_to_twenty_four_hour_time_pm, \
+    convert_to_twenty_four_hour_time_am
+
 ###################################
 ### Getting data from asc file ###
 ###################################
 
 
-def get_acquisition_parameters_line(data):
-    line_number = 10
-    contains_word_acquisition = False
-    while not contains_word_acquisition:
-        line_number += 1
-        line = data[line_number]
-        if any("ACQUISITION PARAMETERS" in i for i in line):
-            contains_word_acquisition = True
-    acquisition_parameters_line_number = line_number
-    return acquisition_parameters_line_number
+def read_asc_file(filename):
+    with open(filename, 'rb') as file:
+        contents = file.read()
 
+    return split_asc_file_contents(contents)
 
-def get_detector_list_line(data):
-    line_number = get_acquisition_parameters_line(data)
-    contains_word_detector = False
-    while not contains_word_detector:
-        line_number += 1
-        line = data[line_number]
-        if any("DETECTOR" in i for i in line):
-            contains_word_detector = True
-    detector_line = line_number
-    return detector_line
 
+def is_zip_archive(filename):
+    return filename.lower().endswith(".zip")
 
-def get_isotopics_ratio_line(spot_data):
-    line_number = 10
-    contains_word_isotopics_data = False
-    while not contains_word_isotopics_data:
-        line_number += 1
-        line = spot_data[line_number]
-        if any("ISOTOPICS RATIO" in i for i in line):
-            contains_word_isotopics_data = True
-    isotopics_ratio_line_number = line_number
-    return isotopics_ratio_line_number
 
+def read_asc_files_from_zip_archive(archive_filename):
+    # Reads the contents of every asc file in the archive in a single pass, without extracting them to disk. The
+    # filename of each is the path of the archive joined to the path of the file within the archive.
+    contents_by_filename = {}
+    with zipfile.ZipFile(archive_filename) as archive:
+        for member in archive.infolist():
+            if member.is_dir() or not member.filename.lower().endswith(".asc"):
+                continue
+            # Skips the resource fork files that macOS adds to archives
+            if member.filename.startswith("__MACOSX/"):
+                continue
+            # Member names always use "/", so they are split to give a path in the style of the operating system
+            filename = os.path.join(archive_filename, *member.filename.split("/"))
+            contents_by_filename[filename] = archive.read(member)
 
-def get_raw_cps_data(raw_data_line_start, column_number, spot_data, block_number, number_of_cycles):
-    range_extent = int(block_number) * int(number_of_cycles)
-    line_range = range(raw_data_line_start, raw_data_line_start + range_extent)
-    raw_cps_data = [spot_data[line][column_number] for line in line_range]
+    if not contents_by_filename:
+        raise Exception("The archive " + archive_filename + " does not contain any asc files.")
 
-    return raw_cps_data
+    return contents_by_filename
 
 
-def get_detector_data(spot_data, column_number):
-    detector_line = get_detector_list_line(spot_data)
-    detector = spot_data[detector_line][column_number - 1]
-    detector_data = []
-    line_number = 55
-    contains_word_detector_data = False
-    while not contains_word_detector_data:
-        line_number += 1
-        line = spot_data[line_number]
-        if any("DETECTOR PARAMETERS" in i for i in line):
-            contains_word_detector_data = True
-    detector_data_line_start = line_number + 4
+def split_asc_file_contents(contents):
+    # Decoded with the same default encoding and newline handling as open() in text mode.
+    with io.TextIOWrapper(io.BytesIO(contents)) as file:
+        csv_data = csv.reader(file, delimiter='\t')
+        data = [[str.strip(i) for i in line] for line in csv_data]
+
+    return data
+
+
+class AscFileData:
+    """
+    Everything that is used from a single asc file. A spot is created from this rather than from the text of the
+    file, so that it can also come from the spot cache.
+    """
+
+    def __init__(self, date, time, x_position, y_position, dtfa_x, dtfa_y, primary_beam_current, block_number,
+                 number_of_cycles, mass_peak_names, detector_names, raw_cps_data, detector_parameters):
+        self.date = date
+        self.time = time
+        self.x_position = x_position
+        self.y_position = y_position
+        self.dtfa_x = dtfa_x
+        self.dtfa_y = dtfa_y
+        self.primary_beam_current = primary_beam_current
+        self.block_number = block_number
+        self.number_of_cycles = number_of_cycles
+        # The column names of the raw data, e.g. "16O", and the detector used for each of them.
+        self.mass_peak_names = mass_peak_names
+        self.detector_names = detector_names
+        # (measurements x mass peaks) array with a column for every mass peak in the file
+        self.raw_cps_data = raw_cps_data
+        # (mass peaks x 3) array of the detector yield, background and dead time for every mass peak in the file
+        self.detector_parameters = detector_parameters
 
-    line = detector_data_line_start
-    contains_detector = detector in spot_data[line]
-    while not contains_detector:
-        line += 1
-        contains_detector = detector in spot_data[line]
+    def get_number_of_measurements(self):
+        return self.block_number * self.number_of_cycles
 
-    detector_data.append(spot_data[line][1])
-    detector_data.append(spot_data[line][2])
-    detector_data.append(spot_data[line][3])
+    def get_mass_peak_column(self, mass_peak_name):
+        if mass_peak_name.isotope_name not in self.mass_peak_names:
+            raise ValueError("The mass peak " + mass_peak_name.isotope_name + " is not in the asc file.")
+        return self.mass_peak_names.index(mass_peak_name.isotope_name)
 
-    return detector_data
 
+def get_asc_file_data(spot_data, section_index_template=None):
+    # The files of a session share a layout, so the section index of another file of the session can be given to be
+    # checked rather than scanning the whole file.
+    section_index = AscSectionIndex(spot_data, section_index_template)
 
-def get_data_from_asc(spot_data, mass_peak_name):
-    block_number = get_block_number_from_asc(spot_data)
+    block_number = get_block_number_from_asc(spot_data, section_index)
 
     # Finding the start of the raw data
-    line_number = 150
-    contains_word_raw_data = False
-    while not contains_word_raw_data:
-        line_number += 1
-        line = spot_data[line_number]
-        if any("RAW DATA" in i for i in line):
-            contains_word_raw_data = True
-    raw_data_mass_peak_line = line_number + 4
-    raw_data_line_start = line_number + 6
+    raw_data_mass_peak_line = section_index.raw_data_line + 4
+    raw_data_line_start = section_index.raw_data_line + 6
 
     number_of_cycles = get_number_of_cycles_from_asc(spot_data, raw_data_line_start)
 
-    number_of_measurements = block_number * number_of_cycles
-
     # +1 is because the file format is fairly terrible
-    column_number = spot_data[raw_data_mass_peak_line].index(mass_peak_name.isotope_name) + 1
+    mass_peak_names = [name for name in spot_data[raw_data_mass_peak_line] if name]
+    column_numbers = [spot_data[raw_data_mass_peak_line].index(name) + 1 for name in mass_peak_names]
+
+    raw_cps_data = get_raw_cps_data(raw_data_line_start, column_numbers, spot_data, block_number, number_of_cycles)
+
+    detector_names = [spot_data[section_index.detector_list_line][column_number - 1]
+                      for column_number in column_numbers]
+    detector_parameters_by_name = get_detector_parameters_by_detector_name(spot_data, section_index)
+    # A detector missing from the detector parameters is only a problem if that mass peak is used.
+    missing_detector_parameters = (np.nan, np.nan, np.nan)
+    detector_parameters = np.array([detector_parameters_by_name.get(detector_name, missing_detector_parameters)
+                                    for detector_name in detector_names], dtype=np.float64)
+
+    dtfa_x, dtfa_y = get_dtfa_x_and_y_from_asc(spot_data, section_index)
+
+    return AscFileData(
+        date=spot_data[DATE_INDEX[0]][DATE_INDEX[1]],
+        time=spot_data[TIME_INDEX[0]][TIME_INDEX[1]],
+        x_position=int(spot_data[X_POSITION_INDEX[0]][X_POSITION_INDEX[1]]),
+        y_position=int(spot_data[Y_POSITION_INDEX[0]][Y_POSITION_INDEX[1]]),
+        dtfa_x=dtfa_x,
+        dtfa_y=dtfa_y,
+        primary_beam_current=get_primary_beam_current_data_asc(spot_data, section_index),
+        block_number=block_number,
+        number_of_cycles=number_of_cycles,
+        mass_peak_names=mass_peak_names,
+        detector_names=detector_names,
+        raw_cps_data=raw_cps_data,
+        detector_parameters=detector_parameters
+    )
+
+
+def get_datetime_from_asc_date_and_time(date, time):
+    standardised_date = standardise_date_format(date)
+    time, twelve_hr_data = str.split(time)
+    # TODO - what happens at midnight?
+    if twelve_hr_data == "AM":
+        twenty_four_hour_time = convert_to_twenty_four_hour_time_am(time)
+    elif twelve_hr_data == "PM":
+        twenty_four_hour_time = convert_to_twenty_four_hour_time_pm(time)
+    else:
+        raise ValueError("The time '" + time + " " + twelve_hr_data + "' in the asc file is not AM or PM.")
+    # Built from the integer fields directly, which is much faster than datetime.strptime.
+    day, month, year = standardised_date.split("/")
+    hour, minute = twenty_four_hour_time.split(":")
+    return datetime(int(year), int(month), int(day), int(hour), int(minute))
+
+
+# The line that marks the start of each section of an asc file, in the order they appear in the file
+ASC_SECTION_MARKERS = [
+    ("acquisition_parameters_line", lambda line: any("ACQUISITION PARAMETERS" in i for i in line)),
+    ("detector_list_line", lambda line: any("DETECTOR" in i for i in line)),
+    ("detector_parameters_line", lambda line: any("DETECTOR PARAMETERS" in i for i in line)),
+    ("isotopics_ratio_line", lambda line: any("ISOTOPICS RATIO" in i for i in line)),
+    ("blocks_line", lambda line: "Blocks" in line),
+    ("primary_current_line", lambda line: "Primary Current START (A):" in line),
+    ("dtfa_line", lambda line: "Field App (DT1)" in line),
+    ("raw_data_line", lambda line: any("RAW DATA" in i for i in line)),
+]
+
+
+class AscSectionIndex:
+    """
+    The line numbers of the section headers of a single asc file, found in one pass through the file so that the
+    helpers below do not each have to rescan the file.
+
+    If the section index of another file from the same session is given as a template, its line numbers are used
+    instead as long as every section header is found on the same line. Otherwise the file is scanned.
+    """
+
+    def __init__(self, spot_data, template=None):
+        self.acquisition_parameters_line = None
+        self.detector_list_line = None
+        self.detector_parameters_line = None
+        self.isotopics_ratio_line = None
+        self.blocks_line = None
+        self.primary_current_line = None
+        self.dtfa_line = None
+        self.raw_data_line = None
+
+        if template is not None and template.matches(spot_data):
+            for name, _ in ASC_SECTION_MARKERS:
+                setattr(self, name, getattr(template, name))
+            return
+
+        self._scan(spot_data)
+
+        missing_sections = [name for name, line_number in vars(self).items() if line_number is None]
+        if missing_sections:
+            raise ValueError("The asc file is missing the following sections: " + ", ".join(missing_sections))
+
+    def _scan(self, spot_data):
+        # Nothing is searched for before the acquisition parameters
+        is_acquisition_parameters_line = ASC_SECTION_MARKERS[0][1]
+        later_section_markers = ASC_SECTION_MARKERS[1:]
+        for line_number, line in enumerate(spot_data):
+            if self.acquisition_parameters_line is None:
+                if is_acquisition_parameters_line(line):
+                    self.acquisition_parameters_line = line_number
+                continue
+
+            for name, is_section_line in later_section_markers:
+                if getattr(self, name) is None and is_section_line(line):
+                    setattr(self, name, line_number)
+                    break
+
+            if self.raw_data_line is not None:
+                # Everything after the raw data is not required.
+                break
+
+    def matches(self, spot_data):
+        # Checks only the lines that the section headers should be on.
+        for name, is_section_line in ASC_SECTION_MARKERS:
+            line_number = getattr(self, name)
+            if line_number >= len(spot_data) or not is_section_line(spot_data[line_number]):
+                return False
+        return True
+
+
+def get_raw_cps_data(raw_data_line_start, column_numbers, spot_data, block_number, number_of_cycles):
+    # The whole raw data block is converted in one go into a (measurements x mass peaks) array, numpy's string to
+    # float conversion copes with both positive and negative exponents.
+    range_extent = int(block_number) * int(number_of_cycles)
+    lines = spot_data[raw_data_line_start:raw_data_line_start + range_extent]
+    raw_cps_data = np.array([[line[column_number] for column_number in column_numbers] for line in lines],
+                            dtype=np.float64)
+
+    return raw_cps_data
 
-    raw_cps_data = get_raw_cps_data(raw_data_line_start, column_number, spot_data, block_number, number_of_cycles)
 
-    detector_data = get_detector_data(spot_data, column_number)
+def get_detector_parameters_by_detector_name(spot_data, section_index):
+    # The yield, background and dead time of each detector in the detector parameters table
+    detector_parameters_by_name = {}
+    line_number = section_index.detector_parameters_line + 4
+    while line_number < len(spot_data) and spot_data[line_number] and spot_data[line_number][0]:
+        line = spot_data[line_number]
+        detector_parameters_by_name[line[0]] = (float(line[1]), float(line[2]), float(line[3]))
+        line_number += 1
 
-    return raw_cps_data, detector_data, number_of_measurements
+    return detector_parameters_by_name
 
 
-def get_primary_beam_current_data_asc(spot_data):
+def get_primary_beam_current_data_asc(spot_data, section_index):
     # Finding the primary ion beam current at the beginning and end of the spot measurement
-    line_number = 131
-    contains_primary = False
-    while not contains_primary:
-        line_number += 1
-        line = spot_data[line_number]
-        contains_primary = "Primary Current START (A):" in line
+    line_number = section_index.primary_current_line
     primary_start_data = spot_data[line_number][-1]
     data, magnitude = primary_start_data.split("E")
     primary_start_value = float(data) * 10 ** int(magnitude)
@@ -119,13 +260,8 @@ def get_primary_beam_current_data_asc(spot_data):
     return primary_beam_current
 
 
-def get_dtfa_x_and_y_from_asc(spot_data):
-    line_number = 138
-    contains_beam_centering = False
-    while not contains_beam_centering:
-        line_number += 1
-        line = spot_data[line_number]
-        contains_beam_centering = "Field App (DT1)" in line
+def get_dtfa_x_and_y_from_asc(spot_data, section_index):
+    line_number = section_index.dtfa_line
 
     dtfa_x = int(spot_data[line_number][3])
     dtfa_y = int(spot_data[line_number][4])
@@ -133,14 +269,9 @@ def get_dtfa_x_and_y_from_asc(spot_data):
     return dtfa_x, dtfa_y
 
 
-def get_block_number_from_asc(spot_data):
+def get_block_number_from_asc(spot_data, section_index):
     # Finding the number of blocks - labelled blocks in the asc file.
-    line_number = 113
-    contains_blocks = "Blocks" in spot_data[line_number]
-    while not contains_blocks:
-        line_number += 1
-        line = spot_data[line_number]
-        contains_blocks = "Blocks" in line
+    line_number = section_index.blocks_line
     block_index = spot_data[line_number].index("Blocks")
     block_number = spot_data[line_number][block_index - 1]
 
@@ -163,9 +294,9 @@ def get_number_of_cycles_from_asc(spot_data, raw_data_line_start):
     return number_of_cycles
 
 
-def get_analytical_conditions_data_from_asc_file(data):
-    start_line_number = get_acquisition_parameters_line(data)
-    end_line_number = get_isotopics_ratio_line(data)
+def get_analytical_conditions_data_from_asc_file(data, section_index):
+    start_line_number = section_index.acquisition_parameters_line
+    end_line_number = section_index.isotopics_ratio_line
     analytical_conditions_data = []
     for i in range(start_line_number, end_line_number):
         analytical_conditions_data.append(data[i])
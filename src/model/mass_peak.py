@@ -1,9 +1,13 @@
-import math
+import numpy as np
 
-from model.maths import calculate_outlier_resistant_mean_and_st_dev
+from model.maths import calculate_outlier_resistant_means_and_st_devs
 
 
 class MassPeak:
+    # There are several mass peaks for every spot in a session, so the attributes are fixed to save memory.
+    __slots__ = ("sample_name", "spot_id", "name", "raw_cps_data", "detector_yield", "detector_background",
+                 "dead_time", "number_of_measurements", "detector_corrected_cps_data", "mean_cps", "st_error_cps")
+
     def __init__(self,
                  sample_name,
                  spot_id,
@@ -16,9 +20,10 @@ class MassPeak:
         self.spot_id = spot_id
         self.name = mass_peak_name
         self.raw_cps_data = raw_cps_data
-        self.detector_yield = detector_data[0]
-        self.detector_background = detector_data[1]
-        self.dead_time = detector_data[2]
+        # Converted once here rather than every time the corrections are applied
+        self.detector_yield = float(detector_data[0])
+        self.detector_background = int(detector_data[1])
+        self.dead_time = float(detector_data[2])
         self.number_of_measurements = number_of_measurements
 
         self.detector_corrected_cps_data = []
@@ -27,32 +32,48 @@ class MassPeak:
 
 
 def correct_cps_data_for_detector_parameters(mass_peak):
-    detector_corrected_cps_data = []
-    for data in mass_peak.raw_cps_data:
-        data, magnitude = data.split("E+")
-        value = float(data) * 10 ** int(magnitude)
-        dead_time_corrected_data = correct_cps_for_deadtime_if_required(mass_peak.dead_time, value)
-        background_corrected_data = dead_time_corrected_data - int(mass_peak.detector_background)
-        yield_corrected_data = background_corrected_data / float(mass_peak.detector_yield)
-        detector_corrected_cps_data.append(yield_corrected_data)
+    detector_corrected_cps_data = correct_cps_array_for_detector_parameters(mass_peak.raw_cps_data,
+                                                                            mass_peak.detector_yield,
+                                                                            mass_peak.detector_background,
+                                                                            mass_peak.dead_time)
 
     return detector_corrected_cps_data
 
 
-def outlier_resistant_mean_and_st_error(mass_peak):
-    mean_cps, st_dev, n, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(
-        mass_peak.detector_corrected_cps_data, 1)
+def correct_cps_array_for_detector_parameters(raw_cps_data, detector_yield, detector_background, dead_time):
+    """
+    Applies the dead time, background and yield corrections to a whole array of cps data at once.
+
+    :param raw_cps_data: (cycles x mass peaks) array for a single spot, or for several spots stacked together
+    :param detector_yield: vector of detector yields, one per mass peak
+    :param detector_background: vector of detector backgrounds, one per mass peak
+    :param dead_time: vector of detector dead times in ns, one per mass peak
+    :return: array of corrected cps data with the same shape as raw_cps_data
+
+    A 1D array of cycles for a single mass peak with scalar detector parameters also works.
+    """
+    raw_cps_data = np.asarray(raw_cps_data, dtype=np.float64)
+    dead_time_corrected_data = correct_cps_for_deadtime_if_required(dead_time, raw_cps_data)
+    background_corrected_data = dead_time_corrected_data - np.asarray(detector_background, dtype=np.float64)
+    yield_corrected_data = background_corrected_data / np.asarray(detector_yield, dtype=np.float64)
 
-    st_error_cps = st_dev / math.sqrt(n)
+    return yield_corrected_data
+
+
+def outlier_resistant_means_and_st_errors(cps_data):
+    """
+    :param cps_data: a 2D array with a column of cycles for each mass peak
+    :return: the outlier resistant mean and standard error of every mass peak, calculated at once
+    """
+    mean_cps, st_devs, numbers_used, _, _ = calculate_outlier_resistant_means_and_st_devs(np.transpose(cps_data), 1)
+    st_error_cps = st_devs / np.sqrt(numbers_used)
 
     return mean_cps, st_error_cps
 
 
 def correct_cps_for_deadtime_if_required(dead_time, value):
-    dead_time_value = float(dead_time)
-    if dead_time_value == 0.0:
-        return value
-
+    dead_time_value = np.asarray(dead_time, dtype=np.float64)
+    # Where the dead time is zero this leaves the value exactly unchanged, as value / (1 - 0) == value.
     corrected_data = value / (1 - value * dead_time_value * 10 ** -9)
 
     return corrected_data
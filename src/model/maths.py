@@ -1,50 +1,145 @@
 import math
 import numpy as np
-import statsmodels.stats.stattools as stattools
 import scipy
 import numpy.typing as npt
 from typing import Any
 
+# The medcouples are calculated for as many rows at a time as have about this many pairs of values in total, as each
+# pair takes several temporary values
+MEDCOUPLE_MAXIMUM_NUMBER_OF_PAIRS = 2 ** 20
 
-def calculate_outlier_resistant_mean_and_st_dev(data, number_of_outliers_allowed):
-    if len(data) == 0:
-        raise Exception("No cycle data input")
-    elif len(data) == 1:
-        return data, 0, len(data), [], ()
-    medcouple = stattools.medcouple(data)
-    Q1 = np.percentile(data, 25, interpolation='midpoint')
-    Q3 = np.percentile(data, 75, interpolation='midpoint')
-    IQR = Q3 - Q1
-
-    if medcouple > 0:
-        lower_constant = -4
-        upper_constant = 3
-    else:
-        lower_constant = -3
-        upper_constant = 4
-
-    skew_corrected_outlier_minimum = Q1 - 1.5 * math.exp(lower_constant * medcouple) * IQR
-    skew_corrected_outlier_maximum = Q3 + 1.5 * math.exp(upper_constant * medcouple) * IQR
 
-    data_without_outliers = []
-    for x in data:
-        if skew_corrected_outlier_minimum <= x <= skew_corrected_outlier_maximum:
-            data_without_outliers.append(x)
+def calculate_outlier_resistant_means_and_st_devs(data, numbers_of_outliers_allowed, mask=None):
+    """
+    Calculates the outlier resistant mean and standard deviation of many series of cycles at once. The outliers are
+    the cycles outside of the skew corrected interquartile range bounds of each series, using its medcouple.
+    :param data: a 2D array with a row of cycles for each series
+    :param numbers_of_outliers_allowed: the number of outliers allowed in each series, or one number for all of them
+    :param mask: the cycles of each series to use, e.g. for series with fewer cycles or with cycles excluded by the
+    user. By default all of the cycles are used.
+    :return: the means, standard deviations and numbers of cycles used for each series, the minimum and maximum
+    outlier bounds of each series, which are NaN for a series with a single cycle, and a mask of the cycles that are
+    removed as outliers.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    mask = np.ones(data.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    numbers_of_outliers_allowed = np.broadcast_to(numbers_of_outliers_allowed, data.shape[:1])
+    numbers_of_cycles = np.count_nonzero(mask, axis=1)
+    if np.any(numbers_of_cycles == 0):
+        raise Exception("No cycle data input")
 
-    if len(data_without_outliers) < len(data) - number_of_outliers_allowed:
-        clean_data = data
+    # The cycles used in each series are moved to the start of its row in their order, so that the series with the
+    # same number of cycles can be calculated together
+    order = np.argsort(~mask, axis=1, kind="stable")
+    ordered_data = np.take_along_axis(data, order, axis=1)
+    ordered_is_kept = np.zeros(data.shape, dtype=bool)
+    outlier_bounds = np.full((len(data), 2), np.nan)
+
+    for number_of_cycles in np.unique(numbers_of_cycles):
+        rows = np.flatnonzero(numbers_of_cycles == number_of_cycles)
+        if number_of_cycles == 1:
+            ordered_is_kept[rows, 0] = True
+            continue
+
+        values = ordered_data[rows, :number_of_cycles]
+        medcouples = calculate_medcouples(values)
+        Q1 = np.percentile(values, 25, axis=1, method='midpoint')
+        Q3 = np.percentile(values, 75, axis=1, method='midpoint')
+        IQR = Q3 - Q1
+
+        lower_constants = np.where(medcouples > 0, -4, -3)
+        upper_constants = np.where(medcouples > 0, 3, 4)
+        # math.exp is used rather than np.exp so that the bounds do not change with the vectorised exp of the platform
+        lower_factors = np.array([math.exp(value) for value in lower_constants * medcouples])
+        upper_factors = np.array([math.exp(value) for value in upper_constants * medcouples])
+        minimums = Q1 - 1.5 * lower_factors * IQR
+        maximums = Q3 + 1.5 * upper_factors * IQR
+
+        is_kept = (minimums[:, np.newaxis] <= values) & (values <= maximums[:, np.newaxis])
+        # If there are more outliers than are allowed then none of them are removed
+        has_too_many_outliers = np.count_nonzero(is_kept, axis=1) < \
+            number_of_cycles - numbers_of_outliers_allowed[rows]
+        is_kept[has_too_many_outliers] = True
+
+        ordered_is_kept[rows, :number_of_cycles] = is_kept
+        outlier_bounds[rows, 0] = minimums
+        outlier_bounds[rows, 1] = maximums
+
+    # The kept cycles are moved to the start of each row in the same way for the means and standard deviations
+    kept_order = np.argsort(~ordered_is_kept, axis=1, kind="stable")
+    kept_data = np.take_along_axis(ordered_data, kept_order, axis=1)
+    numbers_kept = np.count_nonzero(ordered_is_kept, axis=1)
+    means = np.empty(len(data))
+    st_devs = np.empty(len(data))
+    for number_kept in np.unique(numbers_kept):
+        rows = np.flatnonzero(numbers_kept == number_kept)
+        means[rows] = np.mean(kept_data[rows, :number_kept], axis=1)
+        st_devs[rows] = np.std(kept_data[rows, :number_kept], axis=1)
+
+    is_removed = np.zeros(data.shape, dtype=bool)
+    np.put_along_axis(is_removed, order, (np.arange(data.shape[1]) < numbers_of_cycles[:, np.newaxis]) &
+                      ~ordered_is_kept, axis=1)
+
+    return means, st_devs, numbers_kept, outlier_bounds, is_removed
+
+
+def calculate_medcouples(values):
+    """
+    Calculates the medcouple of each row of a 2D array at once, in the same way as
+    statsmodels.stats.stattools.medcouple.
+    """
+    number_of_rows = max(1, MEDCOUPLE_MAXIMUM_NUMBER_OF_PAIRS // max(1, values.shape[1] ** 2))
+    if len(values) <= number_of_rows:
+        return _calculate_medcouples_of_rows(values)
+    return np.concatenate([_calculate_medcouples_of_rows(values[start:start + number_of_rows])
+                           for start in range(0, len(values), number_of_rows)])
+
+
+def _calculate_medcouples_of_rows(values):
+    values = np.sort(values, axis=1)
+    number_of_values = values.shape[1]
+    if number_of_values % 2 == 0:
+        medians = (values[:, number_of_values // 2 - 1] + values[:, number_of_values // 2]) / 2
     else:
-        clean_data = data_without_outliers
-
-    removed_data = [item for item in data if item not in clean_data]
-    outlier_bounds = (skew_corrected_outlier_minimum, skew_corrected_outlier_maximum)
-
-    return np.mean(clean_data), np.std(clean_data), len(clean_data), removed_data, outlier_bounds
-
+        medians = values[:, (number_of_values - 1) // 2]
+
+    z = values - medians[:, np.newaxis]
+    upper = z[:, :, np.newaxis]
+    lower = z[:, np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kernel = (upper + lower) / (upper - lower)
+
+    # Values equal to the median are ordered among themselves, with a kernel of -1, 0 or 1 for each pair of them
+    is_tie = z == 0
+    tie_indices = np.cumsum(is_tie, axis=1) - 1
+    numbers_of_ties = np.count_nonzero(is_tie, axis=1)
+    tie_kernel = np.sign(tie_indices[:, :, np.newaxis] + tie_indices[:, np.newaxis, :]
+                         - (numbers_of_ties[:, np.newaxis, np.newaxis] - 1)).astype(np.float64)
+    is_tie_pair = is_tie[:, :, np.newaxis] & is_tie[:, np.newaxis, :]
+    kernel[is_tie_pair] = tie_kernel[is_tie_pair]
+
+    # The median of the kernel over every pair of a value above the median with a value below it
+    is_pair = (upper >= 0) & (lower <= 0)
+    kernel[~is_pair] = np.nan
+    kernel = np.sort(kernel.reshape(len(values), -1), axis=1)
+    numbers_of_pairs = np.count_nonzero(is_pair.reshape(len(values), -1), axis=1)
+    middle = np.take_along_axis(kernel, (numbers_of_pairs // 2)[:, np.newaxis], axis=1)[:, 0]
+    below_middle = np.take_along_axis(kernel, ((numbers_of_pairs - 1) // 2)[:, np.newaxis], axis=1)[:, 0]
+    return np.where(numbers_of_pairs % 2 == 1, middle, (below_middle + middle) / 2)
+
+
+def calculate_delta_from_ratio(mean: npt.ArrayLike, standard_ratio: npt.ArrayLike, out=None) -> npt.NDArray[Any]:
+    """
+    :param out: a double precision array to write the delta into, without allocating any temporary arrays
+    """
+    if out is None:
+        delta = ((mean / standard_ratio) - 1) * 1000
+        return delta
 
-def calculate_delta_from_ratio(mean: npt.ArrayLike, standard_ratio: npt.ArrayLike) -> npt.NDArray[Any]:
-    delta = ((mean / standard_ratio) - 1) * 1000
-    return delta
+    np.divide(mean, standard_ratio, out=out, dtype=np.float64)
+    np.subtract(out, 1, out=out)
+    np.multiply(out, 1000, out=out)
+    return out
 
 
 def vector_length_from_origin(x: int, y: int):
@@ -52,14 +147,20 @@ def vector_length_from_origin(x: int, y: int):
     return vector_length
 
 
-def drift_correction(x: float, y: npt.NDArray[Any], drift_coefficient: npt.NDArray[Any], zero_time: float) -> \
-        npt.NDArray[Any]:
+def drift_correction(x: float, y: npt.NDArray[Any], drift_coefficient: npt.NDArray[Any], zero_time: float,
+                     out=None) -> npt.NDArray[Any]:
     """
     Drift correction is independent of the y-intercept of the linear drift equation
+    :param out: a double precision array to write the corrected values into, without allocating any temporary arrays
     """
-    correction = x * drift_coefficient
-    y_corrected = y - correction
-    return y_corrected
+    if out is None:
+        correction = x * drift_coefficient
+        y_corrected = y - correction
+        return y_corrected
+
+    np.multiply(x, drift_coefficient, out=out, dtype=np.float64)
+    np.subtract(y, out, out=out)
+    return out
 
 
 def calculate_error_weighted_mean_and_st_dev(values, errors):
@@ -91,11 +192,21 @@ def calculate_sims_alpha(primary_reference_material_mean_delta: npt.NDArray[Any]
     return alpha_sims
 
 
-def calculate_alpha_correction(data: npt.NDArray[Any], alpha_sims: npt.NDArray[Any]) -> npt.NDArray[Any]:
+def calculate_alpha_correction(data: npt.NDArray[Any], alpha_sims: npt.NDArray[Any], out=None) -> npt.NDArray[Any]:
+    """
+    :param out: a double precision array to write the corrected values into, without allocating any temporary arrays
+    """
     # from kita et al, 2009
-    alpha_corrected_data = (((1 + (data / 1000)) / alpha_sims) - 1) * 1000
+    if out is None:
+        alpha_corrected_data = (((1 + (data / 1000)) / alpha_sims) - 1) * 1000
+        return alpha_corrected_data
 
-    return alpha_corrected_data
+    np.divide(data, 1000, out=out, dtype=np.float64)
+    np.add(out, 1, out=out)
+    np.divide(out, alpha_sims, out=out)
+    np.subtract(out, 1, out=out)
+    np.multiply(out, 1000, out=out)
+    return out
 
 
 def calculate_binomial_distribution_probability(probability_of_success, number_of_successes, number_of_tests):
@@ -126,10 +237,21 @@ def calculate_number_of_outliers_to_remove(number_of_tests, probability_cutoff,
 
 
 def calculate_cap_value_and_uncertainty(delta_value_x: npt.NDArray[Any], delta_value_relative: npt.NDArray[Any],
-                                        MDF: float) -> npt.NDArray[Any]:
-    cap = delta_value_x - 1000 * ((((delta_value_relative / 1000) + 1) ** MDF) - 1)
-
-    return cap
+                                        MDF: float, out=None) -> npt.NDArray[Any]:
+    """
+    :param out: a double precision array to write the CAP values into, without allocating any temporary arrays
+    """
+    if out is None:
+        cap = delta_value_x - 1000 * ((((delta_value_relative / 1000) + 1) ** MDF) - 1)
+        return cap
+
+    np.divide(delta_value_relative, 1000, out=out, dtype=np.float64)
+    np.add(out, 1, out=out)
+    np.power(out, MDF, out=out)
+    np.subtract(out, 1, out=out)
+    np.multiply(out, 1000, out=out)
+    np.subtract(delta_value_x, out, out=out, dtype=np.float64)
+    return out
 
 
 def calculate_the_total_sum_of_squares_from_the_mean(values: npt.NDArray[Any]) -> npt.NDArray[Any]:
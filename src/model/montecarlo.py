@@ -0,0 +1,587 @@
+import hashlib
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.special
+import scipy.stats.qmc
+
+from model.correction_stage import CorrectionStage
+from model.sampling_method import SamplingMethod
+from model.maths import calculate_delta_from_ratio, drift_correction, calculate_alpha_correction, \
+    calculate_cap_value_and_uncertainty
+from model.streaming_statistics import StreamingMeanAndVariance, QuantileSketch
+
+
+def create_montecarlo_seed():
+    return np.random.SeedSequence().entropy
+
+
+# In chunked mode the trials are calculated this many at a time, so the memory used does not depend on their number.
+MONTECARLO_CHUNK_SIZE = 10000
+
+# In adaptive mode the number of trials starts at this and is doubled until the results converge.
+ADAPTIVE_MONTECARLO_INITIAL_NUMBER = 1000
+# The largest change in the mean and standard deviation of a converged value, in standard deviations of that value
+ADAPTIVE_MONTECARLO_TOLERANCE = 0.02
+
+# The number of times the calculation is repeated to measure the precision of a sampling method
+SAMPLING_DIAGNOSTICS_NUMBER_OF_REPEATS = 10
+
+# Single precision results are checked against double precision for the first few spots of each batch.
+SINGLE_PRECISION_CHECK_NUMBER_OF_SPOTS = 3
+# The largest difference allowed, in standard deviations of the double precision data
+SINGLE_PRECISION_TOLERANCE = 1e-3
+
+
+class MonteCarloRandomStreams:
+    """
+    Independent random number generators derived from the session seed. Each spot and ratio has its own child stream,
+    so the values drawn for a spot depend only on the seed, the spot and the ratio, and not on the other spots that are
+    calculated with it or the order in which they are calculated.
+
+    Standard normal values are drawn from a stream with the sampling method of the session. The quasi-random methods
+    stratify the values of each stream, and antithetic sampling pairs each trial with its negation in every stream.
+    """
+    MEASUREMENT = 0
+    REFERENCE_MATERIAL = 1
+    STANDARD_RATIO = 2
+
+    def __init__(self, seed, sampling_method=SamplingMethod.PSEUDO_RANDOM):
+        self.seed = seed
+        self.sampling_method = sampling_method
+
+    def get_chunk_streams(self):
+        return MonteCarloChunkStreams(self.seed, self.sampling_method)
+
+    def get_generator(self, stream, *keys):
+        return self._create_generator(self._get_spawn_key(stream, *keys))
+
+    def _get_spawn_key(self, stream, *keys):
+        return (stream,) + tuple(_get_stream_key(key) for key in keys)
+
+    def _create_generator(self, spawn_key):
+        return np.random.Generator(np.random.PCG64(np.random.SeedSequence(self.seed, spawn_key=spawn_key)))
+
+    def get_spot_generator(self, stream, spot, ratio):
+        return self.get_generator(stream, _get_spot_key(spot), ratio.name())
+
+    def draw_spot_standard_normal(self, spot, ratio, montecarlo_number, out, standard_ratio_out=None):
+        """
+        Draws the standard normal deviates of the measured ratio of the spot into out, followed by those of the
+        standard ratio into standard_ratio_out if it is given.
+        """
+        generator = self.get_spot_generator(MonteCarloRandomStreams.MEASUREMENT, spot, ratio)
+        self.draw_standard_normal(generator, montecarlo_number, out=out)
+        if standard_ratio_out is not None:
+            generator = self.get_spot_generator(MonteCarloRandomStreams.STANDARD_RATIO, spot, ratio)
+            self.draw_standard_normal(generator, montecarlo_number, out=standard_ratio_out)
+
+    def draw_reference_material_standard_normal(self, ratio, montecarlo_number):
+        generator = self.get_generator(MonteCarloRandomStreams.REFERENCE_MATERIAL, ratio.name())
+        return self.draw_standard_normal(generator, montecarlo_number)
+
+    def draw_standard_normal(self, generator, montecarlo_number, out=None):
+        if out is None:
+            out = np.empty(montecarlo_number)
+
+        if self.sampling_method == SamplingMethod.PSEUDO_RANDOM:
+            generator.standard_normal(out=out)
+
+        elif self.sampling_method == SamplingMethod.LATIN_HYPERCUBE:
+            # One value from each of montecarlo_number equally probable strata, in a random order
+            uniform_values = generator.permutation(montecarlo_number) + generator.random(montecarlo_number)
+            out[...] = scipy.special.ndtri(uniform_values / montecarlo_number)
+
+        elif self.sampling_method == SamplingMethod.SOBOL:
+            sobol_sequence = scipy.stats.qmc.Sobol(d=1, scramble=True, seed=generator)
+            with warnings.catch_warnings():
+                # The sequence is best balanced for a power of two trials, but still better than pseudo-random values
+                warnings.simplefilter("ignore", UserWarning)
+                uniform_values = sobol_sequence.random(montecarlo_number)[:, 0]
+            # Every stream is scrambled from the same sequence, so the order of each is shuffled to decorrelate them
+            out[...] = scipy.special.ndtri(generator.permutation(uniform_values))
+
+        elif self.sampling_method == SamplingMethod.ANTITHETIC:
+            # The second half of the trials are the negation of the first, with one more value for an odd number
+            half = montecarlo_number // 2
+            generator.standard_normal(out=out[:half])
+            np.negative(out[:half], out=out[half:2 * half])
+            if montecarlo_number % 2:
+                out[-1] = generator.standard_normal()
+        else:
+            raise Exception("There is not a valid sampling method.")
+
+        return out
+
+
+class MonteCarloChunkStreams(MonteCarloRandomStreams):
+    """
+    The random streams of a session whose trials are drawn one chunk at a time. With pseudo-random sampling every
+    stream carries on from where it stopped in the previous chunk, so the trials are the same as those drawn all at
+    once, whatever the size of the chunks. Drawing a stream again within a chunk, e.g. to check the single precision
+    results, gives the same values again.
+
+    The other sampling methods stratify or pair up the trials that are drawn together, so each chunk is stratified on
+    its own and is drawn from child streams of its own. The first chunk uses the streams of the session, so a single
+    chunk is the same as not chunking, but the trials of more than one chunk depend on the size of the chunks.
+    """
+
+    def __init__(self, seed, sampling_method=SamplingMethod.PSEUDO_RANDOM):
+        MonteCarloRandomStreams.__init__(self, seed, sampling_method)
+        self.chunk = 0
+        # By spawn key, the state of each pseudo-random stream at the start of the chunk and its latest generator
+        self._chunk_start_states = {}
+        self._generators = {}
+
+    def start_next_chunk(self):
+        self.chunk += 1
+        for spawn_key, generator in self._generators.items():
+            self._chunk_start_states[spawn_key] = generator.bit_generator.state
+        self._generators = {}
+
+    def get_generator(self, stream, *keys):
+        spawn_key = self._get_spawn_key(stream, *keys)
+        if self.sampling_method != SamplingMethod.PSEUDO_RANDOM:
+            if self.chunk > 0:
+                spawn_key += (self.chunk,)
+            return self._create_generator(spawn_key)
+
+        generator = self._create_generator(spawn_key)
+        if spawn_key in self._chunk_start_states:
+            generator.bit_generator.state = self._chunk_start_states[spawn_key]
+        self._generators[spawn_key] = generator
+        return generator
+
+
+class MonteCarloBaseDeviates(MonteCarloRandomStreams):
+    """
+    Random streams which keep the standard normal deviates that they draw, i.e. an array of trials for each spot and
+    ratio, along with its standard ratio deviates, and one for the reference material values of each ratio. Every
+    recalculation of a session then builds its distributions from the same deviates rather than drawing them again.
+    The deviates use as much memory again as the not corrected distributions. Chunks of a chunked session are not
+    kept.
+    """
+
+    def __init__(self, seed, sampling_method=SamplingMethod.PSEUDO_RANDOM):
+        MonteCarloRandomStreams.__init__(self, seed, sampling_method)
+        # The deviates of each spot are kept by the key of its stream, so a spot that is imported again reuses them
+        self._spot_deviates = {}
+        self._reference_material_deviates = {}
+
+    def keep_only_spots(self, spots):
+        """
+        Releases the deviates of the spots that are no longer in the session.
+        """
+        spot_keys = {_get_spot_key(spot) for spot in spots}
+        self._spot_deviates = {(spot_key, ratio): deviates for (spot_key, ratio), deviates
+                               in self._spot_deviates.items() if spot_key in spot_keys}
+
+    def draw_spot_standard_normal(self, spot, ratio, montecarlo_number, out, standard_ratio_out=None):
+        key = (_get_spot_key(spot), ratio)
+        deviates, standard_ratio_deviates = self._spot_deviates.get(key, (None, None))
+        if deviates is None or len(deviates) != montecarlo_number or \
+                (standard_ratio_out is not None and standard_ratio_deviates is None):
+            deviates = np.empty(montecarlo_number)
+            standard_ratio_deviates = np.empty(montecarlo_number) if standard_ratio_out is not None else None
+            MonteCarloRandomStreams.draw_spot_standard_normal(self, spot, ratio, montecarlo_number, deviates,
+                                                              standard_ratio_deviates)
+            self._spot_deviates[key] = (deviates, standard_ratio_deviates)
+
+        out[...] = deviates
+        if standard_ratio_out is not None:
+            standard_ratio_out[...] = standard_ratio_deviates
+
+    def draw_reference_material_standard_normal(self, ratio, montecarlo_number):
+        deviates = self._reference_material_deviates.get(ratio)
+        if deviates is None or len(deviates) != montecarlo_number:
+            deviates = MonteCarloRandomStreams.draw_reference_material_standard_normal(self, ratio, montecarlo_number)
+            self._reference_material_deviates[ratio] = deviates
+        return deviates
+
+
+def _get_spot_key(spot):
+    # The file hash identifies the spot, falling back to the filename for spots that were not parsed from a file.
+    return spot.file_hash if spot.file_hash is not None else spot.filename
+
+
+def _get_stream_key(key):
+    # The hash of a str is different in each Python process, so a stable integer is taken from its sha256.
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "little")
+
+
+class MonteCarloBatch:
+    """
+    The Monte Carlo distributions of a group of spots, held in contiguous (spots x ratios x trials) tensors so that
+    every stage of the calculation works on all of the spots at once. The dictionaries on each spot, e.g.
+    spot.not_corrected_deltas, only hold views into these tensors.
+
+    For ratios with a delta value the not corrected data is the delta, otherwise it is the ratio itself. Each ratio is
+    drawn once and shared by every stage that uses it. A corrected distribution is only materialised when it differs
+    from the one it is derived from, e.g. without drift correction the drift corrected data is the not corrected data.
+
+    With more than one thread the spots are split into one chunk per thread. Every spot is drawn from its own stream
+    and calculated independently of the others, and NumPy releases the GIL while it does so, so the chunks run in
+    parallel and give the same results as a single thread.
+    """
+
+    def __init__(self, spots, ratios, montecarlo_number, dtype=np.float64, assign_to_spots=True, number_of_threads=1):
+        self.spots = list(spots)
+        self.ratios = list(ratios)
+        self.delta_ratios = [ratio for ratio in self.ratios if ratio.has_delta]
+        self.montecarlo_number = montecarlo_number
+        self.dtype = np.dtype(dtype)
+        self.number_of_threads = number_of_threads
+        # A batch that is not assigned to its spots is only used for checking the results of another batch
+        self.assign_to_spots = assign_to_spots
+
+        self.not_corrected_data = np.empty((len(self.spots), len(self.ratios), montecarlo_number), dtype=self.dtype)
+        # Allocated on first use
+        self.drift_corrected_data = None
+        self.alpha_corrected_data = None
+        self.cap_data_S33 = None
+        self.cap_data_S36 = None
+
+        self._drift_corrected_data_by_ratio = {}
+        self._alpha_corrected_data_by_ratio = {}
+
+        self._assign_not_corrected_data_to_spots()
+        for spot in self.spots if assign_to_spots else []:
+            spot.drift_corrected_data = {}
+            spot.alpha_corrected_data = {}
+
+    def _assign_not_corrected_data_to_spots(self):
+        for i, spot in enumerate(self.spots if self.assign_to_spots else []):
+            spot.not_corrected_deltas = {ratio: self.not_corrected_data[i, j]
+                                         for j, ratio in enumerate(self.ratios) if ratio.has_delta}
+            spot.not_corrected_ratios = {ratio: self.not_corrected_data[i, j]
+                                         for j, ratio in enumerate(self.ratios) if not ratio.has_delta}
+
+    def draw_not_corrected_data(self, standard_ratios, random_streams):
+        means = np.array([[spot.mean_st_error_isotope_ratios[ratio][0] for ratio in self.ratios]
+                          for spot in self.spots], dtype=np.float64).reshape(len(self.spots), len(self.ratios))
+        st_errors = np.array([[spot.mean_st_error_isotope_ratios[ratio][1] for ratio in self.ratios]
+                              for spot in self.spots], dtype=np.float64).reshape(len(self.spots), len(self.ratios))
+
+        # Standard normal deviates are drawn from the stream of each spot and ratio straight into the tensor, then
+        # scaled and converted to deltas in place, one spot at a time. In single precision each spot is calculated in
+        # a double precision buffer and only rounded once its values are final.
+        def draw_spots(spot_slice):
+            deviates = None if self.dtype == np.float64 else np.empty(self.montecarlo_number)
+            standard_ratio_deviates = np.empty(self.montecarlo_number)
+            for i in range(len(self.spots))[spot_slice]:
+                for j, ratio in enumerate(self.ratios):
+                    values = self.not_corrected_data[i, j] if deviates is None else deviates
+                    has_standard_ratio_deviates = ratio.has_delta and standard_ratios[ratio][1] != 0
+                    random_streams.draw_spot_standard_normal(
+                        self.spots[i], ratio, self.montecarlo_number, values,
+                        standard_ratio_deviates if has_standard_ratio_deviates else None)
+                    values *= st_errors[i, j]
+                    values += means[i, j]
+
+                    if ratio.has_delta:
+                        standard_ratio_value, uncertainty = standard_ratios[ratio]
+                        if has_standard_ratio_deviates:
+                            standard_ratio_deviates *= uncertainty
+                            standard_ratio_deviates += standard_ratio_value
+                            standard_ratio_value = standard_ratio_deviates
+                        calculate_delta_from_ratio(values, standard_ratio_value, out=values)
+
+                    if deviates is not None:
+                        self.not_corrected_data[i, j] = values
+
+        self._run_by_spot_chunks(draw_spots)
+
+    def _calculate_by_spot(self, out, calculate):
+        """
+        Calls calculate(i, values) for each spot, where values is the double precision array that the spot is
+        calculated in. This is the row of out for the spot, or in single precision a buffer that is then copied into
+        it.
+        """
+        def calculate_spots(spot_slice):
+            buffer = None if out.dtype == np.float64 else np.empty(self.montecarlo_number)
+            for i in range(len(self.spots))[spot_slice]:
+                if buffer is None:
+                    calculate(i, out[i])
+                else:
+                    calculate(i, buffer)
+                    out[i] = buffer
+
+        self._run_by_spot_chunks(calculate_spots)
+
+    def _run_by_spot_chunks(self, function):
+        """
+        Calls function with a slice of the spots for each chunk, on a thread of its own if there is more than one.
+        """
+        number_of_chunks = min(self.number_of_threads, len(self.spots))
+        if number_of_chunks <= 1:
+            function(slice(None))
+            return
+
+        chunk_bounds = np.linspace(0, len(self.spots), number_of_chunks + 1).astype(int)
+        spot_slices = [slice(start, stop) for start, stop in zip(chunk_bounds[:-1], chunk_bounds[1:])]
+        with ThreadPoolExecutor(number_of_chunks) as executor:
+            # Raises any exception from the threads
+            list(executor.map(function, spot_slices))
+
+    def get_index(self, ratio):
+        return self.ratios.index(ratio)
+
+    def get_not_corrected_data(self, ratio):
+        return self.not_corrected_data[:, self.get_index(ratio)]
+
+    def get_drift_corrected_data(self, ratio):
+        return self._drift_corrected_data_by_ratio[ratio]
+
+    def get_alpha_corrected_data(self, ratio):
+        return self._alpha_corrected_data_by_ratio[ratio]
+
+    def apply_no_drift_correction(self, ratio):
+        self._set_drift_corrected_data(ratio, self.get_not_corrected_data(ratio))
+
+    def apply_linear_drift_correction(self, ratio, relative_times, drift_coefficient):
+        if self.drift_corrected_data is None:
+            self.drift_corrected_data = np.empty(self.not_corrected_data.shape, dtype=self.dtype)
+
+        # Drift correction is independent of the y-intercept of the linear drift equation
+        drift_corrected_data = self.drift_corrected_data[:, self.get_index(ratio)]
+        not_corrected_data = self.get_not_corrected_data(ratio)
+
+        def correct_spot(i, values):
+            # The times are relative to t zero
+            drift_correction(relative_times[i], not_corrected_data[i], drift_coefficient, zero_time=0, out=values)
+
+        self._calculate_by_spot(drift_corrected_data, correct_spot)
+        self._set_drift_corrected_data(ratio, drift_corrected_data)
+
+    def apply_alpha_correction(self, ratio, alpha_sims):
+        if not ratio.has_delta:
+            self._set_alpha_corrected_data(ratio, self.get_drift_corrected_data(ratio))
+            return
+
+        if self.alpha_corrected_data is None:
+            self.alpha_corrected_data = np.empty((len(self.spots), len(self.delta_ratios), self.montecarlo_number),
+                                                 dtype=self.dtype)
+
+        alpha_corrected_data = self.alpha_corrected_data[:, self.delta_ratios.index(ratio)]
+        drift_corrected_data = self.get_drift_corrected_data(ratio)
+
+        def correct_spot(i, values):
+            # Calculated in double precision, as 1 + delta / 1000 loses most of the precision of a single precision
+            # delta
+            calculate_alpha_correction(drift_corrected_data[i], alpha_sims, out=values)
+
+        self._calculate_by_spot(alpha_corrected_data, correct_spot)
+        self._set_alpha_corrected_data(ratio, alpha_corrected_data)
+
+    def extend(self, batches):
+        """
+        Appends the trials of other batches of the same spots and ratios that have been calculated to the same stage,
+        e.g. the next trials drawn from the same random streams.
+        """
+        batches = [self] + list(batches)
+        if len(batches) == 1:
+            return
+        self.montecarlo_number = sum(batch.montecarlo_number for batch in batches)
+        self.not_corrected_data = _concatenate_trials(batch.not_corrected_data for batch in batches)
+        self.drift_corrected_data = _concatenate_trials(batch.drift_corrected_data for batch in batches)
+        self.alpha_corrected_data = _concatenate_trials(batch.alpha_corrected_data for batch in batches)
+        self.cap_data_S33 = _concatenate_trials(batch.cap_data_S33 for batch in batches)
+        self.cap_data_S36 = _concatenate_trials(batch.cap_data_S36 for batch in batches)
+        batch = batches[-1]
+
+        self._assign_not_corrected_data_to_spots()
+        for ratio in list(self._drift_corrected_data_by_ratio):
+            # Without drift correction the drift corrected data is the not corrected data
+            if np.may_share_memory(batch.get_drift_corrected_data(ratio), batch.not_corrected_data):
+                self._set_drift_corrected_data(ratio, self.get_not_corrected_data(ratio))
+            else:
+                self._set_drift_corrected_data(ratio, self.drift_corrected_data[:, self.get_index(ratio)])
+        for ratio in list(self._alpha_corrected_data_by_ratio):
+            if ratio.has_delta:
+                self._set_alpha_corrected_data(ratio, self.alpha_corrected_data[:, self.delta_ratios.index(ratio)])
+            else:
+                self._set_alpha_corrected_data(ratio, self.get_drift_corrected_data(ratio))
+        for i, spot in enumerate(self.spots if self.assign_to_spots else []):
+            if self.cap_data_S33 is not None:
+                spot.cap_data_S33 = self.cap_data_S33[i]
+            if self.cap_data_S36 is not None:
+                spot.cap_data_S36 = self.cap_data_S36[i]
+
+    def remove_from_spots(self):
+        # Once a chunk has been summarised its distributions are not kept on the spots.
+        for spot in self.spots if self.assign_to_spots else []:
+            spot.not_corrected_deltas = {}
+            spot.not_corrected_ratios = {}
+            spot.drift_corrected_data = {}
+            spot.alpha_corrected_data = {}
+            spot.cap_data_S33 = None
+            spot.cap_data_S36 = None
+
+    def _set_drift_corrected_data(self, ratio, drift_corrected_data):
+        self._drift_corrected_data_by_ratio[ratio] = drift_corrected_data
+        for i, spot in enumerate(self.spots if self.assign_to_spots else []):
+            spot.drift_corrected_data[ratio] = drift_corrected_data[i]
+
+    def _set_alpha_corrected_data(self, ratio, alpha_corrected_data):
+        self._alpha_corrected_data_by_ratio[ratio] = alpha_corrected_data
+        for i, spot in enumerate(self.spots if self.assign_to_spots else []):
+            spot.alpha_corrected_data[ratio] = alpha_corrected_data[i]
+
+    def calculate_cap_values(self, ratio_x, ratio_relative, MDF, out=None):
+        """
+        :param out: the CAP values of a previous calculation of the batch, which are overwritten
+        """
+        if out is None:
+            out = np.empty((len(self.spots), self.montecarlo_number), dtype=self.dtype)
+        x_data = self.get_alpha_corrected_data(ratio_x)
+        relative_data = self.get_alpha_corrected_data(ratio_relative)
+
+        def calculate_spot(i, values):
+            calculate_cap_value_and_uncertainty(x_data[i], relative_data[i], MDF, out=values)
+
+        self._calculate_by_spot(out, calculate_spot)
+        return out
+
+    def get_single_precision_error(self, reference_batch, ratio):
+        """
+        :param reference_batch: a double precision batch of the first spots of this batch, drawn from the same streams
+        :return: the largest difference between the alpha corrected data of this batch and the reference batch, in
+        standard deviations of the reference data
+        """
+        data = self.get_alpha_corrected_data(ratio)[:len(reference_batch.spots)]
+        reference_data = reference_batch.get_alpha_corrected_data(ratio)
+        differences = np.max(np.abs(data - reference_data), axis=1)
+        st_devs = np.std(reference_data, axis=1)
+        return np.max(differences / np.where(st_devs > 0, st_devs, np.inf))
+
+
+def _concatenate_trials(data_of_batches):
+    data_of_batches = list(data_of_batches)
+    if data_of_batches[0] is None:
+        return None
+    return np.concatenate(data_of_batches, axis=-1)
+
+
+class MonteCarloSummary:
+    """
+    The summary statistics of the Monte Carlo distribution of one value of a spot. Each is calculated when it is first
+    needed and kept for as long as the distribution is.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._mean_and_st_dev = None
+        self._quartiles = None
+
+    def get_mean_and_st_dev(self):
+        if self._mean_and_st_dev is None:
+            self._mean_and_st_dev = (np.mean(self.data, dtype=np.float64), np.std(self.data, dtype=np.float64))
+        return self._mean_and_st_dev
+
+    def get_quartiles(self):
+        if self._quartiles is None:
+            self._quartiles = np.quantile(self.data, [0.25, 0.75])
+        return self._quartiles
+
+
+class MonteCarloStatistics:
+    """
+    Streaming summary statistics of the Monte Carlo distributions of every spot, which are added to one chunk of trials
+    at a time. Only the mean, variance and a quantile sketch of each distribution are kept.
+    """
+
+    def __init__(self, spots, ratios, are_only_final_values_kept=False):
+        """
+        :param are_only_final_values_kept: only keep the means and variances of the final values, which is all that
+        is needed to check whether adaptive mode has converged
+        """
+        self.spots = list(spots)
+        self.ratios = list(ratios)
+        self.are_only_final_values_kept = are_only_final_values_kept
+        self._index_by_spot = {spot: i for i, spot in enumerate(self.spots)}
+        # By (stage, ratio), where the ratio is None for the CAP values
+        self._means_and_variances = {}
+        self._quantile_sketches = {}
+        self._drift_coefficients = {ratio: StreamingMeanAndVariance(()) for ratio in self.ratios}
+
+    def add_batch(self, batch, all_ratio_results):
+        for ratio in batch.ratios:
+            if not self.are_only_final_values_kept:
+                self._add_data(CorrectionStage.NOT_CORRECTED, ratio, batch.get_not_corrected_data(ratio))
+                self._add_data(CorrectionStage.DRIFT_CORRECTED, ratio, batch.get_drift_corrected_data(ratio))
+            self._add_data(CorrectionStage.ALPHA_CORRECTED, ratio, batch.get_alpha_corrected_data(ratio))
+            self._drift_coefficients[ratio].add(np.asarray(all_ratio_results[ratio].drift_coefficient))
+        if batch.cap_data_S33 is not None:
+            self._add_data(CorrectionStage.CAP_S33, None, batch.cap_data_S33)
+        if batch.cap_data_S36 is not None:
+            self._add_data(CorrectionStage.CAP_S36, None, batch.cap_data_S36)
+
+    def _add_data(self, stage, ratio, data):
+        key = (stage, ratio)
+        if key not in self._means_and_variances:
+            self._means_and_variances[key] = StreamingMeanAndVariance(len(self.spots))
+            if not self.are_only_final_values_kept:
+                self._quantile_sketches[key] = QuantileSketch((len(self.spots),))
+        self._means_and_variances[key].add(data)
+        if not self.are_only_final_values_kept:
+            self._quantile_sketches[key].add(data)
+
+    def get_mean_and_st_dev(self, spot, stage, ratio=None):
+        i = self._index_by_spot[spot]
+        means_and_variances = self._means_and_variances[(stage, ratio)]
+        return means_and_variances.mean[i], np.sqrt(means_and_variances.get_variance()[i])
+
+    def get_quartiles(self, spot, stage, ratio=None):
+        return self._quantile_sketches[(stage, ratio)].get_quantiles([0.25, 0.75], self._index_by_spot[spot])
+
+    def get_drift_coefficient_mean_and_st_dev(self, ratio):
+        drift_coefficients = self._drift_coefficients[ratio]
+        return drift_coefficients.mean, drift_coefficients.get_st_dev()
+
+    def get_summary(self):
+        final_keys = [(CorrectionStage.ALPHA_CORRECTED, ratio) for ratio in self.ratios]
+        final_keys.extend(key for key in ((CorrectionStage.CAP_S33, None), (CorrectionStage.CAP_S36, None))
+                          if key in self._means_and_variances)
+        means = np.concatenate([self._means_and_variances[key].mean for key in final_keys])
+        st_devs = np.concatenate([self._means_and_variances[key].get_st_dev() for key in final_keys])
+        return means, st_devs
+
+
+def get_adaptive_montecarlo_numbers(montecarlo_number):
+    """
+    :return: the numbers of trials at which adaptive mode checks whether the results have converged, doubling from the
+    initial number up to montecarlo_number
+    """
+    montecarlo_numbers = [min(ADAPTIVE_MONTECARLO_INITIAL_NUMBER, montecarlo_number)]
+    while montecarlo_numbers[-1] < montecarlo_number:
+        montecarlo_numbers.append(min(2 * montecarlo_numbers[-1], montecarlo_number))
+    return montecarlo_numbers
+
+
+def has_montecarlo_summary_converged(previous_summary, summary, tolerance):
+    """
+    :param previous_summary: the means and standard deviations of the values with the previous number of trials
+    :param summary: the means and standard deviations of the same values with the current number of trials
+    :param tolerance: the largest change allowed, in standard deviations of each value
+    """
+    previous_means, previous_st_devs = previous_summary
+    means, st_devs = summary
+    changes = np.maximum(np.abs(means - previous_means), np.abs(st_devs - previous_st_devs))
+    return bool(np.all(changes <= tolerance * st_devs))
+
+
+def calculate_equivalent_numbers_of_trials(means, st_devs):
+    """
+    With N pseudo-random trials the mean and standard deviation of a normal value of standard deviation sigma have
+    variances of sigma^2 / N and sigma^2 / 2N. The number of pseudo-random trials that would give the precision reached
+    by a sampling method follows from their variances between independent repeats.
+    :param means: the means of each value, by repeat along the first axis
+    :param st_devs: the standard deviations of each value, by repeat along the first axis
+    :return: the equivalent numbers of trials for the mean and the standard deviation of each value
+    """
+    variances = np.mean(np.square(st_devs), axis=0)
+    with np.errstate(divide="ignore"):
+        mean_equivalent_numbers = variances / np.var(means, axis=0, ddof=1)
+        st_dev_equivalent_numbers = variances / (2 * np.var(st_devs, axis=0, ddof=1))
+    return mean_equivalent_numbers, st_dev_equivalent_numbers
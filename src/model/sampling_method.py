@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class SamplingMethod(Enum):
+    PSEUDO_RANDOM = "Pseudo-random"
+    LATIN_HYPERCUBE = "Latin hypercube"
+    SOBOL = "Scrambled Sobol"
+    ANTITHETIC = "Antithetic"
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class SessionTimeline:
+    """
+    The measurement times of every spot in a session as a single float64 array of epoch times, in the same order as
+    the spots of the samples. Masks select the primary and secondary reference material spots.
+    """
+
+    def __init__(self, samples, primary_reference_material=None, secondary_reference_material=None):
+        self.spots = [spot for sample in samples for spot in sample.spots]
+        self._index_by_spot = {spot: i for i, spot in enumerate(self.spots)}
+        self.epoch_times = np.array([spot.timestamp for spot in self.spots], dtype=np.float64)
+
+        self.primary_mask = self.get_mask(primary_reference_material.spots if primary_reference_material else [])
+        self.secondary_mask = self.get_mask(secondary_reference_material.spots if secondary_reference_material else [])
+
+    def get_indices(self, spots):
+        return np.array([self._index_by_spot[spot] for spot in spots], dtype=np.intp)
+
+    def get_mask(self, spots):
+        mask = np.zeros(len(self.spots), dtype=bool)
+        mask[self.get_indices(spots)] = True
+        return mask
+
+    def get_flagged_mask(self):
+        # Spots can be flagged and unflagged at any time so this is not stored.
+        return np.array([spot.is_flagged for spot in self.spots], dtype=bool)
+
+    def get_epoch_times(self, spots=None):
+        if spots is None:
+            return self.epoch_times
+        return self.epoch_times[self.get_indices(spots)]
+
+    def get_times_relative_to_t_zero(self, t_zero, spots=None):
+        return self.get_epoch_times(spots) - t_zero
+
+    def calculate_t_zero(self):
+        # The median time of the primary reference material spots that are not flagged
+        mask = self.primary_mask & ~self.get_flagged_mask()
+        return np.median(self.epoch_times[mask])
@@ -1,5 +1,11 @@
+import os
+
 
 cycle_data_default_filename = "cycle_data"
 raw_data_default_filename = "raw_data"
 corrected_data_default_filename = "corrected_data"
-analytical_conditions_default_filename = "analytical_conditions"
\ No newline at end of file
+analytical_conditions_default_filename = "analytical_conditions"
+uncertainty_comparison_default_filename = "uncertainty_comparison"
+sampling_diagnostics_default_filename = "sampling_diagnostics"
+
+spot_cache_default_directory = os.path.join(os.path.expanduser("~"), ".csidrs", "spot_cache")
@@ -1,6 +1,8 @@
-import csv
 import math
-import time
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from typing import Iterable, Dict
 
 import numpy as np
@@ -8,25 +10,63 @@ import statsmodels.api as sm
 from PyQt5.QtGui import QColor
 
 from controllers.signals import signals
-from model.calculation import CalculationResults
+from model.asc_folder_watcher import LiveImport
+from model.asc_preflight import preflight_check_asc_files
+from model.calculation import CalculationResults, calculate_relative_secondary_ion_yield
+from model.correction_stage import CorrectionStage
+from model.detector_parameter_table import DetectorParameterTable
 from model.drift_correction_type import DriftCorrectionType
-from model.get_data_from_import import get_analytical_conditions_data_from_asc_file
+from model.get_data_from_import import get_analytical_conditions_data_from_asc_file, AscSectionIndex, read_asc_file, \
+    split_asc_file_contents, is_zip_archive, read_asc_files_from_zip_archive
+from model.isotopes import Isotope
+from model.montecarlo import create_montecarlo_seed, has_montecarlo_summary_converged, \
+    get_adaptive_montecarlo_numbers, ADAPTIVE_MONTECARLO_TOLERANCE, MONTECARLO_CHUNK_SIZE, \
+    SAMPLING_DIAGNOSTICS_NUMBER_OF_REPEATS, calculate_equivalent_numbers_of_trials, MonteCarloBaseDeviates
 from model.sample import Sample
+from model.sampling_method import SamplingMethod
+from model.session_timeline import SessionTimeline
 from model.settings.colours import colour_list, q_colour_list
 from model.settings.methods_from_isotopes import list_of_methods
-from model.spot import Spot
+from model.spot import Spot, parse_asc_file_into_spot
 from model.spot import SpotAttribute
+from model.spot_cache import SpotCache
+from model.uncertainty_method import UncertaintyMethod
 from utils.csv_utils import write_csv_output
 from utils.general_utils import find_longest_common_prefix_index, split_cameca_data_filename
 
+# Each import process imports numpy, scipy, statsmodels and PyQt5 again as it starts, so only a few are used by default,
+# and the files are parsed in this process unless there are at least this many of them for each import process.
+DEFAULT_MAXIMUM_NUMBER_OF_WORKERS = 4
+MINIMUM_NUMBER_OF_FILES_PER_IMPORT_PROCESS = 2
+
 
 class SidrsModel:
     def __init__(self):
         self.montecarlo_number = None
+        # In adaptive mode the number of trials is the maximum, and fewer are used once the results have converged
+        self.is_montecarlo_number_adaptive = False
+        self.montecarlo_tolerance = ADAPTIVE_MONTECARLO_TOLERANCE
+        # The Monte Carlo results of a session are reproducible from its seed
+        self.montecarlo_seed = create_montecarlo_seed()
+        # Single precision halves the memory used by the Monte Carlo distributions
+        self.montecarlo_dtype = np.float64
+        # Chunked distributions use constant memory, however only their summary statistics are kept
+        self.montecarlo_chunk_size = None
+        self.sampling_method = SamplingMethod.PSEUDO_RANDOM
+        # The random deviates of the session can be kept, so that recalculations do not draw them again
+        self.are_montecarlo_deviates_kept = False
+        self.montecarlo_base_deviates = None
+        self.uncertainty_method = UncertaintyMethod.MONTE_CARLO
+        self.number_of_import_processes = 1
+        self.number_of_montecarlo_threads = 1
         self.data = {}
         self.analytical_condition_data = None
         self.samples = []
         self.imported_files = []
+        # Filenames of the imported files by the hash of their contents
+        self.imported_files_by_hash = {}
+        self.spot_cache = None
+        self.live_import = None
         self.number_of_count_measurements = None
         self.element = None
         self.isotopes = None
@@ -35,6 +75,8 @@ class SidrsModel:
         self.secondary_reference_material = None
 
         self.calculation_results = None
+        self.timeline = None
+        self.detector_parameter_table = None
 
         self.drift_correction_type_by_ratio = {}
 
@@ -50,12 +92,35 @@ class SidrsModel:
     #################
 
     def import_all_files(self, filenames):
+        # Zip archives are replaced by the asc files they contain, which are read into memory here.
+        filenames, contents_by_filename = self._read_zip_archives(filenames)
+
         duplicate_files = set(filenames).intersection(set(self.imported_files))
         if len(duplicate_files) != 0:
             raise Exception("The files: " + str(duplicate_files) + " have already been imported.")
 
-        self.imported_files.extend(filenames)
+        # Checks the headers of every file first so that a bad file is found before the full parse, and only the
+        # valid files are parsed. The preflight reads just the pages of each file holding the header, and each valid
+        # file is then read again in full by the parse.
+        preflight_report = preflight_check_asc_files(filenames, self.isotopes or [], contents_by_filename)
+        valid_filenames = preflight_report.get_valid_filenames()
+        if len(valid_filenames) == 0:
+            raise Exception("None of the files can be imported:\n" + preflight_report.get_message())
+
+        spots = self._parse_asc_files_into_data(valid_filenames, contents_by_filename)
+        if self.spot_cache:
+            self.spot_cache.remove_least_recently_used()
+        self._create_session_from_spots(spots, contents_by_filename)
 
+        # The bad files are reported once the session of the other files has been created.
+        if not preflight_report.is_valid():
+            raise Exception("The following files could not be imported:\n" + preflight_report.get_message())
+
+    def _create_session_from_spots(self, spots, contents_by_filename):
+        """
+        :param contents_by_filename: the contents of the files that are not on disk, e.g. from zip archives
+        """
+        filenames = [spot.filename for spot in spots]
         sample_names_by_filename = self._sample_names_from_filenames(filenames)
         unique_sample_names = set(sample_names_by_filename.values())
         sorted_sample_names = list(unique_sample_names)
@@ -67,55 +132,216 @@ class SidrsModel:
             sample.q_colour = q_colour_list[i]
             samples_by_name[sample_name] = sample
 
-        spots = []
-        for filename in filenames:
-            spot = self._parse_asc_file_into_data(filename)
+        self._check_for_duplicate_file_contents(spots)
+        self.imported_files.extend(filenames)
+        for spot in spots:
+            self.imported_files_by_hash[spot.file_hash] = spot.filename
+
+        for filename, spot in zip(filenames, spots):
             sample_name = sample_names_by_filename[filename]
             sample = samples_by_name[sample_name]
             sample.spots.append(spot)
-            spots.append(spot)
 
         self.samples = list(samples_by_name.values())
+        self._update_session_timeline()
+        self.detector_parameter_table = DetectorParameterTable(self.get_all_spots())
 
         if len({spot.number_of_count_measurements for spot in spots}) != 1:
             raise Exception("Spots have different numbers of cycles - you may have input two separate sessions")
 
         self.number_of_count_measurements = spots[0].number_of_count_measurements
 
-        filename_for_analytical_conditions = filenames[0]
-        self.analytical_condition_data = self._parse_asc_file_into_analytical_conditions_data(
-            filename_for_analytical_conditions)
+        # The analytical conditions are read from the text of the first file that is available
+        filename_for_analytical_conditions = next((filename for filename in filenames
+                                                   if filename in contents_by_filename or os.path.isfile(filename)),
+                                                  None)
+        if filename_for_analytical_conditions is not None:
+            self.analytical_condition_data = self._parse_asc_file_into_analytical_conditions_data(
+                filename_for_analytical_conditions, contents_by_filename.get(filename_for_analytical_conditions))
 
         signals.importedFilesUpdated.emit()
         signals.sampleNamesUpdated.emit()
 
-    def _parse_asc_file_into_data(self, filename):
-        with open(filename) as file:
-            csv_data = csv.reader(file, delimiter='\t')
-            count = 0
-            data_for_spot = []
-            for line in csv_data:
-                count += 1
-                for i in line:
-                    line[line.index(i)] = str.strip(i)
-                data_for_spot.append(line)
-        spot = Spot(filename, data_for_spot, self.isotopes)
+    def _read_zip_archives(self, filenames):
+        asc_filenames = []
+        contents_by_filename = {}
+        for filename in filenames:
+            if is_zip_archive(filename):
+                archive_contents_by_filename = read_asc_files_from_zip_archive(filename)
+                asc_filenames.extend(archive_contents_by_filename.keys())
+                contents_by_filename.update(archive_contents_by_filename)
+            else:
+                asc_filenames.append(filename)
+
+        return asc_filenames, contents_by_filename
+
+    def _parse_asc_files_into_data(self, filenames, contents_by_filename=None):
+        if contents_by_filename is None:
+            contents_by_filename = {}
+        contents = [contents_by_filename.get(filename) for filename in filenames]
+        # The files of a session share a layout, so the section index of the first file is given as a template for
+        # every file and only has to be checked against each of them.
+        section_index_template = AscSectionIndex(self._read_asc_file(filenames[0], contents[0]))
+
+        number_of_processes = self._get_number_of_import_processes(len(filenames))
+        if number_of_processes <= 1:
+            return [self._parse_asc_file_into_data(filename, file_contents, section_index_template)
+                    for filename, file_contents in zip(filenames, contents)]
+
+        # The parsing of each file is independent, so the files are shared out between worker processes. Spawn is
+        # used rather than fork as forking a process running Qt is not safe.
+        chunk_size = math.ceil(len(filenames) / (4 * number_of_processes))
+        with ProcessPoolExecutor(max_workers=number_of_processes,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            spots = list(executor.map(parse_asc_file_into_spot, filenames, repeat(self.isotopes),
+                                      repeat(self.spot_cache), contents, repeat(section_index_template),
+                                      chunksize=chunk_size))
+        return spots
+
+    def _get_number_of_import_processes(self, number_of_files):
+        # Starting the processes takes longer than parsing a few files
+        if number_of_files < MINIMUM_NUMBER_OF_FILES_PER_IMPORT_PROCESS * self.number_of_import_processes:
+            return 1
+        return self.number_of_import_processes
+
+    def _parse_asc_file_into_data(self, filename, contents=None, section_index_template=None):
+        spot = parse_asc_file_into_spot(filename, self.isotopes, self.spot_cache, contents, section_index_template)
         return spot
 
-    def _parse_asc_file_into_analytical_conditions_data(self, filename):
-        with open(filename) as file:
-            csv_data = csv.reader(file, delimiter='\t')
-            count = 0
-            data = []
-            for line in csv_data:
-                count += 1
-                for i in line:
-                    line[line.index(i)] = str.strip(i)
-                data.append(line)
-
-        analytical_condition_data = get_analytical_conditions_data_from_asc_file(data)
+    def _read_asc_file(self, filename, contents=None):
+        if contents is None:
+            return read_asc_file(filename)
+        return split_asc_file_contents(contents)
+
+    def _parse_asc_file_into_analytical_conditions_data(self, filename, contents=None):
+        data = self._read_asc_file(filename, contents)
+        section_index = AscSectionIndex(data)
+        analytical_condition_data = get_analytical_conditions_data_from_asc_file(data, section_index)
         return analytical_condition_data
 
+    def _check_for_duplicate_file_contents(self, spots):
+        # The same file copied to a different folder or renamed would otherwise be imported as a second spot.
+        filenames_by_hash = dict(self.imported_files_by_hash)
+        duplicate_files = []
+        for spot in spots:
+            if spot.file_hash in filenames_by_hash:
+                duplicate_files.append((spot.filename, filenames_by_hash[spot.file_hash]))
+            else:
+                filenames_by_hash[spot.file_hash] = spot.filename
+
+        if len(duplicate_files) != 0:
+            raise Exception("The files: " + ", ".join(filename + " (the same as " + original_filename + ")"
+                                                      for filename, original_filename in duplicate_files)
+                            + " have already been imported.")
+
+    def start_watching_folder(self, directory, poll_interval_ms=5000):
+        self.stop_watching_folder()
+        self.live_import = LiveImport(self, directory, poll_interval_ms)
+
+    def stop_watching_folder(self):
+        if self.live_import is not None:
+            self.live_import.stop()
+            self.live_import = None
+
+    def add_spots_to_session(self, spots):
+        """
+        Adds spots to a session that may already have been processed, e.g. while the session is still running. Only
+        the new spots are processed unless they change the drift correction or the secondary ion yield factor. Spots
+        that have already been imported or have a different number of cycles are skipped, and an exception listing
+        them is raised once the other spots have been added.
+        """
+        if not self.samples:
+            self._create_session_from_spots(spots, {})
+            return
+
+        filenames_by_hash = dict(self.imported_files_by_hash)
+        spots_to_add = []
+        skipped_files = []
+        for spot in spots:
+            if spot.file_hash in filenames_by_hash:
+                skipped_files.append(spot.filename + " (the same as " + filenames_by_hash[spot.file_hash] + ")")
+            elif spot.number_of_count_measurements != self.number_of_count_measurements:
+                skipped_files.append(spot.filename + " (a different number of cycles to the session)")
+            else:
+                filenames_by_hash[spot.file_hash] = spot.filename
+                spots_to_add.append(spot)
+
+        if spots_to_add:
+            self._add_new_spots_to_session(spots_to_add)
+
+        if skipped_files:
+            raise Exception("The files: " + ", ".join(skipped_files) + " could not be added to the session.")
+
+    def _add_new_spots_to_session(self, spots):
+        self.imported_files.extend(spot.filename for spot in spots)
+        for spot in spots:
+            self.imported_files_by_hash[spot.file_hash] = spot.filename
+
+        number_of_samples = len(self.samples)
+        self._add_spots_to_samples(spots)
+        self._update_session_timeline()
+        for spot in spots:
+            self.detector_parameter_table.add_spot(spot)
+
+        signals.importedFilesUpdated.emit()
+        if len(self.samples) != number_of_samples:
+            signals.sampleNamesUpdated.emit()
+
+        if self.calculation_results is None:
+            return
+
+        primary_rm = self.get_primary_reference_material()
+        factor = self.set_secondary_ion_yield_factor()
+        if factor != self.calculation_results.secondary_ion_yield_factor:
+            # The yields of all spots are relative to the same factor.
+            self.calculation_results.secondary_ion_yield_factor = factor
+            for spot in self.get_all_spots():
+                spot.secondary_ion_yield = calculate_relative_secondary_ion_yield(spot, factor)
+
+        if any(spot in primary_rm.spots for spot in spots) or self.calculation_results.is_montecarlo_chunked():
+            # New primary reference material spots change the drift correction and alpha for every spot. The drift
+            # correction and alpha of each chunked trial are not kept, so chunked spots are all recalculated.
+            # The new spots use the number of trials of the rest of the session.
+            montecarlo_number = self.calculation_results.montecarlo_number
+            self.calculation_results.calculate_raw_delta_values_for_spots(spots, self.method, self.element,
+                                                                          montecarlo_number, factor)
+            self.calculation_results.calculate_data_from_drift_correction_onwards(primary_rm, self.method,
+                                                                                  self.get_samples(),
+                                                                                  self.drift_correction_type_by_ratio,
+                                                                                  self.element, self.material,
+                                                                                  montecarlo_number)
+        else:
+            self.calculation_results.calculate_data_for_new_spots(spots, self.method, self.element,
+                                                                  self.calculation_results.montecarlo_number,
+                                                                  self.drift_correction_type_by_ratio)
+
+        signals.dataRecalculated.emit()
+
+    def _add_spots_to_samples(self, spots):
+        # Spots go into the sample that already holds spots with the same full sample name, so that renamed and merged
+        # samples still receive their new spots.
+        samples_by_full_sample_name = {}
+        for sample in self.get_samples():
+            for spot in sample.spots:
+                samples_by_full_sample_name[spot.full_sample_name] = sample
+
+        prefix_index = find_longest_common_prefix_index(list(samples_by_full_sample_name.keys()))
+        prefix = next(iter(samples_by_full_sample_name))[:prefix_index]
+        for spot in spots:
+            sample = samples_by_full_sample_name.get(spot.full_sample_name)
+            if sample is None:
+                sample_name = spot.full_sample_name
+                if sample_name.startswith(prefix) and len(sample_name) > len(prefix) and len(self.samples) > 1:
+                    sample_name = sample_name[prefix_index:]
+                sample = Sample(sample_name)
+                colour_index = len(self.samples) % len(colour_list)
+                sample.colour = colour_list[colour_index]
+                sample.q_colour = q_colour_list[colour_index]
+                self.samples.append(sample)
+                samples_by_full_sample_name[spot.full_sample_name] = sample
+
+            sample.spots.append(spot)
+
     def _sample_names_from_filenames(self, filenames):
         """
         :param filenames:
@@ -151,17 +377,47 @@ class SidrsModel:
     ##################
 
     def calculate_results(self):
-        self.calculation_results = CalculationResults()
+        self._calculate_with_montecarlo_number(self._calculate_results_with_montecarlo_number)
+
+        signals.dataRecalculated.emit()
+
+    def _calculate_results_with_montecarlo_number(self, montecarlo_number, montecarlo_tolerance=None):
+        self.calculation_results = CalculationResults(self.timeline, self.montecarlo_seed, self.montecarlo_dtype,
+                                                     self.uncertainty_method, self.montecarlo_chunk_size,
+                                                     self.sampling_method, self._get_kept_random_streams(),
+                                                     self.number_of_montecarlo_threads, montecarlo_tolerance)
         samples = self.get_samples()
         primary_rm = self.get_primary_reference_material()
         factor = self.set_secondary_ion_yield_factor()
-        self.calculation_results.calculate_raw_delta_values(samples, self.method, self.element, self.montecarlo_number, factor)
+        self.calculation_results.calculate_raw_delta_values(samples, self.method, self.element, montecarlo_number, factor)
         self.calculation_results.calculate_data_from_drift_correction_onwards(primary_rm, self.method, samples,
                                                                               self.drift_correction_type_by_ratio,
                                                                               self.element, self.material,
-                                                                              self.montecarlo_number)
+                                                                              montecarlo_number)
 
-        signals.dataRecalculated.emit()
+    def _calculate_with_montecarlo_number(self, calculate):
+        """
+        Calls calculate with the number of trials to use. In adaptive mode the number of trials is doubled, up to the
+        maximum, until the final corrected values change by less than the tolerance.
+        """
+        if not self.is_montecarlo_number_adaptive or self.uncertainty_method != UncertaintyMethod.MONTE_CARLO:
+            calculate(self.montecarlo_number)
+            return
+
+        if self.sampling_method == SamplingMethod.PSEUDO_RANDOM:
+            # The calculation only draws the new trials of each doubling, carrying on the random streams of the others
+            calculate(self.montecarlo_number, self.montecarlo_tolerance)
+            return
+
+        # The other sampling methods stratify all of the trials together, so every number of trials is calculated
+        # from the start
+        summary = None
+        for montecarlo_number in get_adaptive_montecarlo_numbers(self.montecarlo_number):
+            calculate(montecarlo_number)
+            previous_summary, summary = summary, self.calculation_results.get_montecarlo_summary()
+            if previous_summary is not None and \
+                    has_montecarlo_summary_converged(previous_summary, summary, self.montecarlo_tolerance):
+                break
 
     def characterise_multiple_linear_regression(self, factors, ratio):
 
@@ -179,10 +435,7 @@ class SidrsModel:
         lists_of_independent_variables = []
         for factor in factors:
             if factor == SpotAttribute.TIME:
-                times = []
-                for spot in spots_to_use:
-                    timestamp = time.mktime(spot.datetime.timetuple())
-                    times.append(timestamp)
+                times = self.timeline.get_epoch_times(spots_to_use)
                 lists_of_independent_variables.append(times)
             elif factor == SpotAttribute.DTFAX:
                 dtfa_xs = []
@@ -268,6 +521,7 @@ class SidrsModel:
     def rename_and_merge_samples(self, rename_operations, merge_operations):
         self._rename_samples(rename_operations)
         self._merge_samples(merge_operations)
+        self._update_session_timeline()
 
         if len(rename_operations) > 0 or len(merge_operations) > 0:
             signals.sampleNamesUpdated.emit()
@@ -295,6 +549,15 @@ class SidrsModel:
             if self.secondary_reference_material is None:
                 raise Exception("The secondary reference material selected does not match your sample data")
 
+        self._update_session_timeline()
+
+    def _update_session_timeline(self):
+        # Rebuilt whenever the spots of the session or the reference materials change
+        self.timeline = SessionTimeline(self.get_samples(), self.primary_reference_material,
+                                        self.secondary_reference_material)
+        if self.calculation_results is not None:
+            self.calculation_results.timeline = self.timeline
+
     def create_method_dictionary_from_isotopes(self, isotopes):
         for method in list_of_methods:
             if set(isotopes) == set(method.isotopes):
@@ -305,18 +568,25 @@ class SidrsModel:
 
     def recalculate_data_with_cycles_changed(self):
         self.calculation_results = None
+        self._calculate_with_montecarlo_number(self._recalculate_data_with_cycles_changed_with_montecarlo_number)
+        signals.dataRecalculated.emit()
+
+    def _recalculate_data_with_cycles_changed_with_montecarlo_number(self, montecarlo_number,
+                                                                     montecarlo_tolerance=None):
         primary_rm = self.get_primary_reference_material()
         samples = self.get_samples()
         factor = self.set_secondary_ion_yield_factor()
-        self.calculation_results = CalculationResults()
+        self.calculation_results = CalculationResults(self.timeline, self.montecarlo_seed, self.montecarlo_dtype,
+                                                     self.uncertainty_method, self.montecarlo_chunk_size,
+                                                     self.sampling_method, self._get_kept_random_streams(),
+                                                     self.number_of_montecarlo_threads, montecarlo_tolerance)
         self.calculation_results.calculate_raw_delta_with_changed_cycle_data(samples,self.method, self.element,
-                                                                             self.montecarlo_number, factor)
+                                                                             montecarlo_number, factor)
 
         self.calculation_results.calculate_data_from_drift_correction_onwards(primary_rm, self.method, samples,
                                                                               self.drift_correction_type_by_ratio,
                                                                               self.element, self.material,
-                                                                              self.montecarlo_number)
-        signals.dataRecalculated.emit()
+                                                                              montecarlo_number)
 
     def remove_cycle_from_spot(self, spot, cycle_number, is_flagged, ratio):
         spot.cycle_flagging_information[ratio][cycle_number] = is_flagged
@@ -328,14 +598,16 @@ class SidrsModel:
         self.calculation_results.calculate_data_from_drift_correction_onwards(primary_rm, self.method, samples,
                                                                               self.drift_correction_type_by_ratio,
                                                                               self.element, self.material,
-                                                                              self.montecarlo_number)
+                                                                              self.calculation_results.montecarlo_number)
         signals.dataRecalculated.emit()
 
     def clear_all_data_and_methods(self):
+        self.stop_watching_folder()
         self.data.clear()
         self.analytical_condition_data = None
         self.samples = []
         self.imported_files = []
+        self.imported_files_by_hash.clear()
         self.number_of_count_measurements = None
         self.element = None
         self.isotopes = None
@@ -343,7 +615,11 @@ class SidrsModel:
         self.primary_reference_material = None
         self.secondary_reference_material = None
         self.calculation_results = None
+        self.timeline = None
+        self.detector_parameter_table = None
         self.drift_correction_type_by_ratio.clear()
+        self.montecarlo_seed = create_montecarlo_seed()
+        self.montecarlo_base_deviates = None
 
         self.method = None
 
@@ -413,9 +689,8 @@ class SidrsModel:
                     ratio_uncertainty_2 = ratio_uncertainty
                     row.append(ratio_uncertainty_2)
                     if ratio.has_delta:
-                        delta_data = spot.not_corrected_deltas[ratio]
-                        delta = np.mean(delta_data)
-                        delta_uncertainty = (np.std(delta_data))
+                        delta, delta_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.NOT_CORRECTED, ratio)
                         row.append(delta)
                         row.append(delta_uncertainty)
 
@@ -456,17 +731,17 @@ class SidrsModel:
 
                 for ratio in method.ratios:
                     if ratio.has_delta:
-                        delta, delta_uncertainty = np.mean(spot.alpha_corrected_data[ratio]), np.std(
-                            spot.alpha_corrected_data[ratio])
-                        uncorrected_delta, uncorrected_delta_uncertainty = np.mean(
-                            spot.not_corrected_deltas[ratio]), np.std(spot.not_corrected_deltas[ratio])
+                        delta, delta_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+                        uncorrected_delta, uncorrected_delta_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.NOT_CORRECTED, ratio)
                         row.append(delta)
                         row.append(delta_uncertainty)
                         row.append(uncorrected_delta)
                         row.append(uncorrected_delta_uncertainty)
                     else:
-                        corrected_ratio, corrected_ratio_uncertainty = np.mean(
-                            spot.alpha_corrected_data[ratio]), np.std(spot.alpha_corrected_data[ratio])
+                        corrected_ratio, corrected_ratio_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.ALPHA_CORRECTED, ratio)
                         row.append(corrected_ratio)
                         row.append(corrected_ratio_uncertainty)
 
@@ -483,7 +758,101 @@ class SidrsModel:
 
         write_csv_output(output_file=filename, headers=column_headers, rows=rows)
 
+    def export_uncertainty_comparison_csv(self, filename):
+        # The uncertainties are always propagated, so they can be compared with the Monte Carlo results
+        if self.calculation_results.uncertainty_method != UncertaintyMethod.MONTE_CARLO:
+            raise Exception("The uncertainties can only be compared if the Monte Carlo results have been calculated.")
+
+        method = self.method
+
+        column_headers = ["Sample name"]
+        for ratio in method.ratios:
+            name = ratio.delta_name() if ratio.has_delta else ratio.name()
+            column_headers.extend(["corrected " + name + " (Monte Carlo)", "uncertainty 1sig (Monte Carlo)",
+                                   "corrected " + name + " (error propagation)",
+                                   "uncertainty 1sig (error propagation)", "uncertainty difference (%)"])
+
+        rows = []
+        for sample in self.get_samples():
+            for spot in sample.spots:
+                row = [str(sample.name + "-" + spot.id)]
+                for ratio in method.ratios:
+                    montecarlo_value, montecarlo_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.ALPHA_CORRECTED, ratio, UncertaintyMethod.MONTE_CARLO)
+                    propagated_value, propagated_uncertainty = self.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.ALPHA_CORRECTED, ratio, UncertaintyMethod.ERROR_PROPAGATION)
+                    row.extend([montecarlo_value, montecarlo_uncertainty, propagated_value, propagated_uncertainty,
+                                100 * (propagated_uncertainty - montecarlo_uncertainty) / montecarlo_uncertainty])
+                rows.append(row)
+
+        write_csv_output(output_file=filename, headers=column_headers, rows=rows)
+
+    def calculate_sampling_diagnostics(self, number_of_repeats=SAMPLING_DIAGNOSTICS_NUMBER_OF_REPEATS):
+        """
+        Repeats the Monte Carlo calculation of the session with independent seeds, to measure the precision reached by
+        the sampling method with the number of trials of the session.
+        :return: the names of the final corrected values, and for each the median over the spots of the equivalent
+        number of pseudo-random trials for its mean and its standard deviation
+        """
+        if self.calculation_results.uncertainty_method != UncertaintyMethod.MONTE_CARLO:
+            raise Exception("The sampling can only be checked if the Monte Carlo results have been calculated.")
+
+        stages_and_ratios = [(CorrectionStage.ALPHA_CORRECTED, ratio) for ratio in self.method.ratios]
+        names = [ratio.delta_name() if ratio.has_delta else ratio.name() for ratio in self.method.ratios]
+        if Isotope.S33 in self.method.isotopes:
+            stages_and_ratios.append((CorrectionStage.CAP_S33, None))
+            names.append("CAP S33")
+        if Isotope.S36 in self.method.isotopes:
+            stages_and_ratios.append((CorrectionStage.CAP_S36, None))
+            names.append("CAP S36")
+
+        montecarlo_seed = self.montecarlo_seed
+        montecarlo_base_deviates = self.montecarlo_base_deviates
+        montecarlo_number = self.calculation_results.montecarlo_number
+        spots = list(self.get_all_spots())
+        # By repeat, value and spot
+        means_and_st_devs = np.empty((number_of_repeats, len(stages_and_ratios), len(spots), 2))
+        # Each repeat keeps the cycles that are currently flagged, rather than removing the outliers again, so that the
+        # cycles flagged by the user are kept
+        try:
+            for repeat in range(number_of_repeats):
+                self.montecarlo_seed = [montecarlo_seed, repeat]
+                self._recalculate_data_with_cycles_changed_with_montecarlo_number(montecarlo_number)
+                for i, (stage, ratio) in enumerate(stages_and_ratios):
+                    for j, spot in enumerate(spots):
+                        means_and_st_devs[repeat, i, j] = self.calculation_results.get_mean_and_st_dev(spot, stage,
+                                                                                                      ratio)
+        finally:
+            # The session is recalculated from its own seed and deviates, which gives the same results as before
+            self.montecarlo_seed = montecarlo_seed
+            self.montecarlo_base_deviates = montecarlo_base_deviates
+            self._recalculate_data_with_cycles_changed_with_montecarlo_number(montecarlo_number)
+            signals.dataRecalculated.emit()
+
+        mean_equivalent_numbers, st_dev_equivalent_numbers = calculate_equivalent_numbers_of_trials(
+            means_and_st_devs[..., 0], means_and_st_devs[..., 1])
+        return names, np.median(mean_equivalent_numbers, axis=-1), np.median(st_dev_equivalent_numbers, axis=-1)
+
+    def export_sampling_diagnostics_csv(self, filename):
+        montecarlo_number = self.calculation_results.montecarlo_number
+        names, mean_equivalent_numbers, st_dev_equivalent_numbers = self.calculate_sampling_diagnostics()
+
+        column_headers = ["Value", "Sampling method", "Number of trials",
+                          "Equivalent pseudo-random trials (mean)", "Equivalent pseudo-random trials (uncertainty)",
+                          "Precision gain (mean)", "Precision gain (uncertainty)"]
+        rows = []
+        for name, mean_equivalent_number, st_dev_equivalent_number in zip(names, mean_equivalent_numbers,
+                                                                           st_dev_equivalent_numbers):
+            rows.append([name, self.sampling_method.value, montecarlo_number, mean_equivalent_number,
+                         st_dev_equivalent_number, mean_equivalent_number / montecarlo_number,
+                         st_dev_equivalent_number / montecarlo_number])
+
+        write_csv_output(output_file=filename, headers=column_headers, rows=rows)
+
     def export_analytical_conditions_csv(self, filename):
+        if self.analytical_condition_data is None:
+            raise Exception("The analytical conditions are not available, as none of the imported files could be "
+                            "read.")
         column_headers = []
         rows = [row for row in self.analytical_condition_data if row]
 
@@ -498,6 +867,60 @@ class SidrsModel:
     def set_montecarlo_number(self, montecarlo_number):
         self.montecarlo_number = montecarlo_number
 
+    def set_montecarlo_number_adaptive(self, is_adaptive):
+        self.is_montecarlo_number_adaptive = is_adaptive
+
+    def set_montecarlo_chunked(self, is_chunked):
+        self.montecarlo_chunk_size = MONTECARLO_CHUNK_SIZE if is_chunked else None
+
+    def set_montecarlo_deviates_kept(self, are_kept):
+        self.are_montecarlo_deviates_kept = are_kept
+        self.montecarlo_base_deviates = None
+
+    def _get_kept_random_streams(self):
+        if not self.are_montecarlo_deviates_kept:
+            return None
+        # The deviates are drawn again if the seed or sampling method has changed
+        if self.montecarlo_base_deviates is None or self.montecarlo_base_deviates.seed != self.montecarlo_seed or \
+                self.montecarlo_base_deviates.sampling_method != self.sampling_method:
+            self.montecarlo_base_deviates = MonteCarloBaseDeviates(self.montecarlo_seed, self.sampling_method)
+        self.montecarlo_base_deviates.keep_only_spots(self.get_all_spots())
+        return self.montecarlo_base_deviates
+
+    def redraw_montecarlo_deviates(self):
+        self.montecarlo_seed = create_montecarlo_seed()
+        self.montecarlo_base_deviates = None
+        # Only the deviates change, so the cycles flagged by the user are kept
+        self.recalculate_data_with_cycles_changed()
+
+    def set_sampling_method(self, sampling_method):
+        self.sampling_method = sampling_method
+
+    def set_montecarlo_seed(self, montecarlo_seed):
+        self.montecarlo_seed = montecarlo_seed
+
+    def set_montecarlo_single_precision(self, is_single_precision):
+        self.montecarlo_dtype = np.float32 if is_single_precision else np.float64
+
+    def set_uncertainty_method(self, uncertainty_method):
+        self.uncertainty_method = uncertainty_method
+
+    def set_number_of_import_processes(self, number_of_import_processes):
+        self.number_of_import_processes = number_of_import_processes
+
+    def set_number_of_montecarlo_threads(self, number_of_montecarlo_threads):
+        self.number_of_montecarlo_threads = number_of_montecarlo_threads
+
+    def set_spot_cache_directory(self, cache_directory):
+        if cache_directory is None:
+            self.spot_cache = None
+        else:
+            self.spot_cache = SpotCache(cache_directory)
+
+    def clear_spot_cache(self):
+        if self.spot_cache:
+            self.spot_cache.clear()
+
     def set_secondary_ion_yield_factor(self):
         spots = self.get_all_spots()
         factors = []
@@ -1,82 +1,133 @@
 import math
 import re
-from datetime import datetime
-
-from model.get_data_from_import import get_data_from_asc, get_primary_beam_current_data_asc, \
-    get_dtfa_x_and_y_from_asc
-from model.mass_peak import MassPeak, correct_cps_data_for_detector_parameters, outlier_resistant_mean_and_st_error
-from model.maths import vector_length_from_origin, calculate_outlier_resistant_mean_and_st_dev
-from model.settings.asc_file_settings_general import *
-from utils.convert_date_format_from_new_asci import standardise_date_format
-from utils.convert_twelve_to_twenty_four_hour_time import convert_to_twenty_four_hour_time_pm, \
-    convert_to_twenty_four_hour_time_am
+import time
+
+import numpy as np
+
+from model.get_data_from_import import get_asc_file_data, split_asc_file_contents, \
+    get_datetime_from_asc_date_and_time
+from model.mass_peak import MassPeak, correct_cps_array_for_detector_parameters, outlier_resistant_means_and_st_errors
+from model.maths import vector_length_from_origin
+from model.spot_cache import hash_asc_file_contents
 from utils.general_utils import split_cameca_data_filename
 
 
 class Spot:
-    def __init__(self, filename, spot_data, mass_peak_names):
+    # Sessions can contain hundreds of spots so the attributes are fixed, rather than each spot carrying a __dict__.
+    __slots__ = ("filename", "full_sample_name", "id", "sample_name", "mass_peak_names", "file_hash", "datetime",
+                 "timestamp", "x_position", "y_position", "distance_from_mount_centre", "dtfa_x", "dtfa_y",
+                 "primary_beam_current", "is_flagged", "secondary_ion_yield", "mass_peaks", "raw_isotope_ratios",
+                 "mean_st_dev_isotope_ratios", "mean_st_error_isotope_ratios", "outliers_removed_from_raw_data",
+                 "outlier_bounds_by_ratio", "cycle_flagging_information", "not_corrected_deltas",
+                 "not_corrected_ratios", "drift_corrected_data", "alpha_corrected_data", "cap_data_S33",
+                 "cap_data_S36", "raw_cps_data", "detector_names", "detector_parameter_set_id", "detector_yields",
+                 "detector_backgrounds", "dead_times", "detector_corrected_cps_data", "number_of_count_measurements")
+
+    def __init__(self, filename, asc_file_data, mass_peak_names, file_hash=None):
         self.filename = filename
         self.full_sample_name, self.id = split_cameca_data_filename(filename)
         split_sample_name = re.split('-|_', self.full_sample_name)
         self.sample_name = split_sample_name[-1]
         # TODO change how this works - currently doesn't update
         self.mass_peak_names = mass_peak_names
+        # Hash of the contents of the asc file, used to recognise the same file imported from two places
+        self.file_hash = file_hash
 
-        self.spot_data = spot_data
-        self.date = standardise_date_format(self.spot_data[DATE_INDEX[0]][DATE_INDEX[1]])
-        self.time, self.twelve_hr_data = str.split(self.spot_data[TIME_INDEX[0]][TIME_INDEX[1]])
-        # TODO - what happens at midnight?
-        if self.twelve_hr_data == "AM":
-            self.twenty_four_hour_time = convert_to_twenty_four_hour_time_am(self.time)
-        elif self.twelve_hr_data == "PM":
-            self.twenty_four_hour_time = convert_to_twenty_four_hour_time_pm(self.time)
-        self.datetime = datetime.strptime(self.date + " " + self.twenty_four_hour_time, "%d/%m/%Y %H:%M")
+        # Only the parsed datetime is kept, not the strings it is made from.
+        self.datetime = get_datetime_from_asc_date_and_time(asc_file_data.date, asc_file_data.time)
+        # Seconds since the epoch in local time, calculated once here for the session timeline
+        self.timestamp = time.mktime(self.datetime.timetuple())
 
-        self.x_position = int(spot_data[X_POSITION_INDEX[0]][X_POSITION_INDEX[1]])
-        self.y_position = int(spot_data[Y_POSITION_INDEX[0]][Y_POSITION_INDEX[1]])
+        self.x_position = asc_file_data.x_position
+        self.y_position = asc_file_data.y_position
 
         self.distance_from_mount_centre = vector_length_from_origin(self.x_position, self.y_position)
 
-        self.dtfa_x, self.dtfa_y = get_dtfa_x_and_y_from_asc(self.spot_data)
+        self.dtfa_x, self.dtfa_y = asc_file_data.dtfa_x, asc_file_data.dtfa_y
 
-        self.primary_beam_current = get_primary_beam_current_data_asc(self.spot_data)
+        self.primary_beam_current = asc_file_data.primary_beam_current
 
         self.is_flagged = False
         self.secondary_ion_yield = None
         self.mass_peaks = {}
         self.raw_isotope_ratios = {}
         self.mean_st_dev_isotope_ratios = {}
+        self.mean_st_error_isotope_ratios = {}
         self.outliers_removed_from_raw_data = {}
         self.outlier_bounds_by_ratio = {}
         self.cycle_flagging_information = {}
-        self.standard_ratios = None
-        self.drift_corrected_ratio_values_by_ratio = {}
         self.not_corrected_deltas = {}
         self.not_corrected_ratios = {}
         self.drift_corrected_data = {}
         self.alpha_corrected_data = {}
-
-        for mass_peak_name in self.mass_peak_names:
-            raw_cps_data, detector_data, number_of_measurements = get_data_from_asc(self.spot_data, mass_peak_name)
+        self.cap_data_S33 = None
+        self.cap_data_S36 = None
+
+        # Raw cps data for all mass peaks, one column per mass peak in the order of self.mass_peak_names
+        columns = [asc_file_data.get_mass_peak_column(mass_peak_name) for mass_peak_name in self.mass_peak_names]
+        self.raw_cps_data = asc_file_data.raw_cps_data[:, columns]
+        detector_parameters = asc_file_data.detector_parameters[columns]
+        if np.isnan(detector_parameters).any():
+            raise ValueError("The detector parameters for one of the mass peaks are missing from the asc file.")
+        number_of_measurements = asc_file_data.get_number_of_measurements()
+
+        for i, mass_peak_name in enumerate(self.mass_peak_names):
             mass_peak = MassPeak(
                 self.full_sample_name,
                 self.id,
                 mass_peak_name,
-                raw_cps_data,
-                detector_data,
+                self.raw_cps_data[:, i],
+                detector_parameters[i],
                 number_of_measurements
             )
-
-            mass_peak.detector_corrected_cps_data = correct_cps_data_for_detector_parameters(mass_peak)
-            mass_peak.mean_cps, mass_peak.st_error_cps = outlier_resistant_mean_and_st_error(mass_peak)
             self.mass_peaks[mass_peak_name] = mass_peak
 
+        self.detector_names = [asc_file_data.detector_names[column] for column in columns]
+        # Set when the spot is added to the session's DetectorParameterTable
+        self.detector_parameter_set_id = None
+        self.detector_yields = np.array([mass_peak.detector_yield for mass_peak in self.mass_peaks.values()])
+        self.detector_backgrounds = np.array([mass_peak.detector_background for mass_peak in self.mass_peaks.values()])
+        self.dead_times = np.array([mass_peak.dead_time for mass_peak in self.mass_peaks.values()])
+
+        self.detector_corrected_cps_data = None
+        self.correct_cps_data_for_detector_parameters()
+
+        mean_cps, st_error_cps = outlier_resistant_means_and_st_errors(self.detector_corrected_cps_data)
+        for i, mass_peak in enumerate(self.mass_peaks.values()):
+            mass_peak.mean_cps, mass_peak.st_error_cps = mean_cps[i], st_error_cps[i]
+
         if len({mass_peak.number_of_measurements for mass_peak in self.mass_peaks.values()}) != 1:
             raise Exception("Mass peaks have different numbers of cycles - this indicates a problem with the input "
                             "data file")
         self.number_of_count_measurements = [mass_peak for mass_peak in self.mass_peaks.values()][
             0].number_of_measurements
 
+    def correct_cps_data_for_detector_parameters(self):
+        # Corrects the cps data of every mass peak at once, each mass peak keeps a view of its column.
+        self.detector_corrected_cps_data = correct_cps_array_for_detector_parameters(self.raw_cps_data,
+                                                                                     self.detector_yields,
+                                                                                     self.detector_backgrounds,
+                                                                                     self.dead_times)
+        for i, mass_peak in enumerate(self.mass_peaks.values()):
+            mass_peak.detector_corrected_cps_data = self.detector_corrected_cps_data[:, i]
+
+
+def parse_asc_file_into_spot(filename, mass_peak_names, spot_cache=None, contents=None, section_index_template=None):
+    # Module level so that it can be run in an import worker process. The contents are given for files that have
+    # already been read, e.g. from a zip archive, otherwise the file is read here. The section index template is the
+    # AscSectionIndex of another file of the session.
+    if contents is None:
+        with open(filename, 'rb') as file:
+            contents = file.read()
+
+    file_hash = hash_asc_file_contents(contents)
+    asc_file_data = spot_cache.load(file_hash) if spot_cache else None
+    if asc_file_data is None:
+        asc_file_data = get_asc_file_data(split_asc_file_contents(contents), section_index_template)
+        if spot_cache:
+            spot_cache.save(file_hash, asc_file_data)
+
+    return Spot(filename, asc_file_data, mass_peak_names, file_hash)
 
 
 from enum import Enum
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from model.get_data_from_import import AscFileData
+
+# Increase this whenever the contents of AscFileData change so that old cache files are ignored.
+SPOT_CACHE_VERSION = 1
+# The cache is kept below this size by removing the files that were used least recently
+SPOT_CACHE_MAXIMUM_SIZE_IN_BYTES = 500 * 1024 ** 2
+
+
+def hash_asc_file_contents(contents):
+    return hashlib.sha256(contents).hexdigest()
+
+
+class SpotCache:
+    """
+    The parsed contents of asc files stored on disk by the hash of the file contents, so that re-importing a file
+    (from any path) does not need the text of the file to be parsed again.
+    """
+
+    def __init__(self, cache_directory, maximum_size_in_bytes=SPOT_CACHE_MAXIMUM_SIZE_IN_BYTES):
+        self.cache_directory = cache_directory
+        self.maximum_size_in_bytes = maximum_size_in_bytes
+
+    def _get_cache_filename(self, file_hash):
+        return os.path.join(self.cache_directory, file_hash + ".npz")
+
+    def load(self, file_hash):
+        # Returns None if the file has not been cached, or if the cache file cannot be used.
+        filename = self._get_cache_filename(file_hash)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            # The modification time records when the file was last used, for removing the least recently used files
+            os.utime(filename)
+            with np.load(filename, allow_pickle=False) as cached:
+                if int(cached["version"]) != SPOT_CACHE_VERSION:
+                    return None
+                return AscFileData(
+                    date=str(cached["date"]),
+                    time=str(cached["time"]),
+                    x_position=int(cached["x_position"]),
+                    y_position=int(cached["y_position"]),
+                    dtfa_x=int(cached["dtfa_x"]),
+                    dtfa_y=int(cached["dtfa_y"]),
+                    primary_beam_current=float(cached["primary_beam_current"]),
+                    block_number=int(cached["block_number"]),
+                    number_of_cycles=int(cached["number_of_cycles"]),
+                    mass_peak_names=[str(name) for name in cached["mass_peak_names"]],
+                    detector_names=[str(name) for name in cached["detector_names"]],
+                    raw_cps_data=cached["raw_cps_data"],
+                    detector_parameters=cached["detector_parameters"]
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, file_hash, asc_file_data):
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        # Written to a temporary file first so that import processes never read a partially written cache file.
+        file_descriptor, temporary_filename = tempfile.mkstemp(dir=self.cache_directory, suffix=".npz")
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                np.savez(
+                    file,
+                    version=SPOT_CACHE_VERSION,
+                    date=asc_file_data.date,
+                    time=asc_file_data.time,
+                    x_position=asc_file_data.x_position,
+                    y_position=asc_file_data.y_position,
+                    dtfa_x=asc_file_data.dtfa_x,
+                    dtfa_y=asc_file_data.dtfa_y,
+                    primary_beam_current=asc_file_data.primary_beam_current,
+                    block_number=asc_file_data.block_number,
+                    number_of_cycles=asc_file_data.number_of_cycles,
+                    mass_peak_names=np.array(asc_file_data.mass_peak_names, dtype=str),
+                    detector_names=np.array(asc_file_data.detector_names, dtype=str),
+                    raw_cps_data=asc_file_data.raw_cps_data,
+                    detector_parameters=asc_file_data.detector_parameters
+                )
+            os.replace(temporary_filename, self._get_cache_filename(file_hash))
+        except OSError:
+            # The cache is only an optimisation, failing to write to it should not stop the import.
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+
+    def _get_cache_files(self):
+        # The (modification time, size, path) of each cache file
+        if not os.path.isdir(self.cache_directory):
+            return []
+        cache_files = []
+        with os.scandir(self.cache_directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+        return cache_files
+
+    def remove_least_recently_used(self):
+        """
+        Removes the least recently used files until the cache is no larger than its maximum size.
+        """
+        cache_files = sorted(self._get_cache_files())
+        total_size = sum(size for _, size, _ in cache_files)
+        for _, size, path in cache_files:
+            if total_size <= self.maximum_size_in_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process may have removed or replaced the file
+                pass
+            total_size -= size
+
+    def clear(self):
+        for _, _, path in self._get_cache_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
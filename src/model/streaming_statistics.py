@@ -0,0 +1,82 @@
+import numpy as np
+
+# The number of bins of a quantile sketch, spread over this many standard deviations either side of the mean
+QUANTILE_SKETCH_NUMBER_OF_BINS = 1024
+QUANTILE_SKETCH_RANGE_IN_ST_DEVS = 10
+
+
+class StreamingMeanAndVariance:
+    """
+    The mean and variance of each row of values that arrive in chunks along the last axis, using Welford's algorithm
+    generalised to chunks (Chan et al., 1979) so that only the count, mean and sum of squared deviations are kept.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._sum_of_squared_deviations = np.zeros(shape)
+
+    def add(self, values):
+        chunk_count = values.shape[-1]
+        chunk_mean = np.mean(values, axis=-1, dtype=np.float64)
+        chunk_sum_of_squared_deviations = np.sum(np.square(values - chunk_mean[..., np.newaxis], dtype=np.float64),
+                                                 axis=-1)
+
+        count = self.count + chunk_count
+        difference = chunk_mean - self.mean
+        self.mean = self.mean + difference * chunk_count / count
+        self._sum_of_squared_deviations = self._sum_of_squared_deviations + chunk_sum_of_squared_deviations \
+            + difference ** 2 * self.count * chunk_count / count
+        self.count = count
+
+    def get_variance(self):
+        return self._sum_of_squared_deviations / self.count
+
+    def get_st_dev(self):
+        return np.sqrt(self.get_variance())
+
+
+class QuantileSketch:
+    """
+    A histogram of each row of values that arrive in chunks along the last axis, from which quantiles are interpolated.
+    The bins are placed around the mean and standard deviation of the first chunk, and values outside of them are
+    counted in the first or last bin. The memory used is independent of the number of values.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.bin_edges = None
+        self.counts = np.zeros(self.shape + (QUANTILE_SKETCH_NUMBER_OF_BINS,), dtype=np.int64)
+
+    def add(self, values):
+        if self.bin_edges is None:
+            self._create_bin_edges(values)
+
+        values = values.reshape(-1, values.shape[-1])
+        minimums = self.bin_edges[..., 0].reshape(-1, 1)
+        bin_widths = (self.bin_edges[..., -1] - self.bin_edges[..., 0]).reshape(-1, 1) / QUANTILE_SKETCH_NUMBER_OF_BINS
+
+        bin_indices = np.floor((values - minimums) / bin_widths).astype(np.int64)
+        np.clip(bin_indices, 0, QUANTILE_SKETCH_NUMBER_OF_BINS - 1, out=bin_indices)
+        # Each row is offset into its own range of bins so that all rows are counted at once
+        bin_indices += np.arange(values.shape[0])[:, np.newaxis] * QUANTILE_SKETCH_NUMBER_OF_BINS
+        counts = np.bincount(bin_indices.ravel(), minlength=values.shape[0] * QUANTILE_SKETCH_NUMBER_OF_BINS)
+        self.counts += counts.reshape(self.counts.shape)
+
+    def _create_bin_edges(self, values):
+        means = np.mean(values, axis=-1, dtype=np.float64)
+        st_devs = np.std(values, axis=-1, dtype=np.float64)
+        half_widths = QUANTILE_SKETCH_RANGE_IN_ST_DEVS * np.where(st_devs > 0, st_devs, 1)
+        self.bin_edges = np.linspace(means - half_widths, means + half_widths, QUANTILE_SKETCH_NUMBER_OF_BINS + 1,
+                                     axis=-1)
+
+    def get_quantiles(self, quantiles, index=()):
+        """
+        :param quantiles: the quantiles to calculate, between 0 and 1
+        :param index: the index of the row
+        :return: the quantiles of the row, interpolated linearly within the bins
+        """
+        counts = self.counts[index]
+        bin_edges = self.bin_edges[index]
+        cumulative_counts = np.concatenate(([0], np.cumsum(counts)))
+        return np.interp(np.asarray(quantiles) * cumulative_counts[-1], cumulative_counts, bin_edges)
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class UncertaintyMethod(Enum):
+    MONTE_CARLO = "Monte Carlo"
+    ERROR_PROPAGATION = "Error propagation"
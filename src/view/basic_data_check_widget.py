@@ -9,6 +9,7 @@ from matplotlib.gridspec import GridSpec
 from matplotlib.patches import Circle
 
 from controllers.signals import signals
+from model.correction_stage import CorrectionStage
 from model.settings.default_filenames import raw_data_default_filename
 from utils.csv_utils import export_csv, request_output_csv_filename_from_user, csv_exported_successfully_popup
 from utils.gui_utils import create_figure_widget
@@ -106,7 +107,9 @@ class BasicDataCheckWidget(QWidget):
             ys = []
             for spot in spots:
                 if ratio.has_delta:
-                    ys.append(np.mean(spot.not_corrected_deltas[ratio]))
+                    y, _ = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.NOT_CORRECTED,
+                                                                              ratio)
+                    ys.append(y)
                 else:
                     ys.append(spot.mean_st_error_isotope_ratios[ratio][0])
 
@@ -183,11 +186,13 @@ class BasicDataCheckWidget(QWidget):
 
                 for ratio in method.ratios:
                     if ratio.has_delta:
-                        values = spot.not_corrected_deltas[ratio]
-                        value = np.mean(values)
-                        uncertainty = np.std(values)
-                        neg_uncertainty = value - np.quantile(values, 0.25)
-                        pos_uncertainty = np.quantile(values, 0.75) - value
+                        calculation_results = self.model.calculation_results
+                        value, uncertainty = calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.NOT_CORRECTED, ratio)
+                        lower_quartile, upper_quartile = calculation_results.get_quartiles(
+                            spot, CorrectionStage.NOT_CORRECTED, ratio)
+                        neg_uncertainty = value - lower_quartile
+                        pos_uncertainty = upper_quartile - value
                         value_format = ".3f"
                         uncertainty_format = ".4f"
                     else:
@@ -252,8 +257,9 @@ class BasicDataCheckWidget(QWidget):
             dys = []
             for spot in sample.spots:
                 if ratio.has_delta:
-                    y = np.mean(spot.not_corrected_deltas[ratio])
-                    dy = 2 * np.std(spot.not_corrected_deltas[ratio])
+                    y, st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.NOT_CORRECTED, ratio)
+                    dy = 2 * st_dev
                     ys.append(y)
                     dys.append(dy)
 
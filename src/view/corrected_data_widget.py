@@ -1,11 +1,13 @@
-import numpy as np
 from PyQt5 import QtCore
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QPushButton, QWidget, QTableWidget, QTableWidgetItem, QFileDialog
 
 from controllers.signals import signals
-from model.settings.default_filenames import corrected_data_default_filename, analytical_conditions_default_filename
+from model.correction_stage import CorrectionStage
+from model.settings.default_filenames import corrected_data_default_filename, analytical_conditions_default_filename, \
+    uncertainty_comparison_default_filename, sampling_diagnostics_default_filename
+from model.uncertainty_method import UncertaintyMethod
 from utils.csv_utils import write_csv_output, request_output_csv_filename_from_user, export_csv, \
     csv_exported_successfully_popup
 from view.cycle_data_dialog import CycleDataDialog
@@ -42,8 +44,26 @@ class CorrectedDataWidget(QWidget):
         analytical_conditions_button = QPushButton("Export analytical conditions file")
         analytical_conditions_button.clicked.connect(self.on_analytical_conditions_button_pushed)
 
+        uncertainty_comparison_button = QPushButton("Export uncertainty comparison")
+        uncertainty_comparison_button.clicked.connect(self.on_uncertainty_comparison_button_pushed)
+        # The comparison needs the Monte Carlo distributions
+        uncertainty_comparison_button.setEnabled(
+            self.data_processing_dialog.model.uncertainty_method == UncertaintyMethod.MONTE_CARLO)
+
+        sampling_diagnostics_button = QPushButton("Export sampling diagnostics")
+        sampling_diagnostics_button.clicked.connect(self.on_sampling_diagnostics_button_pushed)
+        sampling_diagnostics_button.setEnabled(
+            self.data_processing_dialog.model.uncertainty_method == UncertaintyMethod.MONTE_CARLO)
+
+        redraw_button = QPushButton("Redraw Monte Carlo trials")
+        redraw_button.clicked.connect(self.on_redraw_button_pushed)
+        redraw_button.setEnabled(self.data_processing_dialog.model.uncertainty_method == UncertaintyMethod.MONTE_CARLO)
+
+        button_layout.addWidget(redraw_button)
         button_layout.addWidget(data_output_button)
         button_layout.addWidget(analytical_conditions_button)
+        button_layout.addWidget(uncertainty_comparison_button)
+        button_layout.addWidget(sampling_diagnostics_button)
 
         layout.addWidget(self.corrected_data_table)
         layout.addLayout(button_layout)
@@ -58,6 +78,10 @@ class CorrectedDataWidget(QWidget):
         dialog = CycleDataDialog(self.data_processing_dialog)
         result = dialog.exec()
 
+    def on_redraw_button_pushed(self):
+        # Draws new random numbers for the session, including any that are kept between recalculations
+        self.data_processing_dialog.model.redraw_montecarlo_deviates()
+
     def on_data_output_button_pushed(self):
         filename = request_output_csv_filename_from_user(corrected_data_default_filename)
         if not filename:
@@ -75,6 +99,23 @@ class CorrectedDataWidget(QWidget):
 
         csv_exported_successfully_popup(self, filename)
 
+    def on_uncertainty_comparison_button_pushed(self):
+        filename = request_output_csv_filename_from_user(uncertainty_comparison_default_filename)
+        if not filename:
+            return
+        self.data_processing_dialog.model.export_uncertainty_comparison_csv(filename)
+
+        csv_exported_successfully_popup(self, filename)
+
+    def on_sampling_diagnostics_button_pushed(self):
+        filename = request_output_csv_filename_from_user(sampling_diagnostics_default_filename)
+        if not filename:
+            return
+        # The session is recalculated several times, with the same results at the end
+        self.data_processing_dialog.model.export_sampling_diagnostics_csv(filename)
+
+        csv_exported_successfully_popup(self, filename)
+
 
     #############
     ### Table ###
@@ -130,9 +171,8 @@ class CorrectedDataWidget(QWidget):
                 row_items.append(str(sample.name + " " + spot.id))
 
                 for ratio in method.ratios:
-                    values = spot.alpha_corrected_data[ratio]
-                    value = np.mean(values)
-                    uncertainty = np.std(values)
+                    value, uncertainty = self.data_processing_dialog.model.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.ALPHA_CORRECTED, ratio)
                     if ratio.has_delta:
                         value_format = ".3f"
                         uncertainty_format = ".4f"
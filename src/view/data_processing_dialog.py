@@ -1,6 +1,7 @@
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTabWidget
 
 from model.elements import Element
+from model.uncertainty_method import UncertaintyMethod
 from view.basic_data_check_widget import BasicDataCheckWidget
 from view.corrected_data_widget import CorrectedDataWidget
 from view.drift_correction_widget import DriftCorrectionWidget
@@ -20,7 +21,7 @@ class DataProcessingDialog(QDialog):
         self.method = model.method
         self.element = model.element
 
-        self.setWindowTitle("Data processing")
+        self.setWindowTitle(self._get_window_title())
         self.setMinimumWidth(1000)
 
         right_layout = self._create_right_layout()
@@ -61,6 +62,12 @@ class DataProcessingDialog(QDialog):
 
         return layout
 
+    def _get_window_title(self):
+        if self.model.calculation_results.uncertainty_method == UncertaintyMethod.ERROR_PROPAGATION:
+            return "Data processing (error propagation)"
+        # In adaptive mode this is the number of trials at which the results converged
+        return "Data processing (" + str(self.model.calculation_results.montecarlo_number) + " Monte Carlo trials)"
+
     def get_current_ratio(self):
         return self.ratio_radiobox_widget.get_ratio()
 
@@ -1,5 +1,3 @@
-import time
-
 import matplotlib.dates as mdates
 import numpy as np
 from PyQt5.QtCore import Qt
@@ -9,6 +7,7 @@ from matplotlib import pyplot as plt
 from matplotlib.gridspec import GridSpec
 
 from controllers.signals import signals
+from model.correction_stage import CorrectionStage
 from model.drift_correction_type import DriftCorrectionType
 from utils import gui_utils
 from view.further_MLR_dialog import FurtherMultipleLinearRegressionDialog
@@ -176,14 +175,12 @@ class DriftCorrectionWidget(QWidget):
     def update_stats_text(self, ratio):
         linear_r_squared_mc = \
         self.data_processing_dialog.model.calculation_results.all_ratio_results[ratio].linear_regression_result[0]
-        linear_gradient_mc = self.data_processing_dialog.model.calculation_results.all_ratio_results[
-            ratio].drift_coefficient
 
         linear_r_squared = np.mean(linear_r_squared_mc)
         linear_r_squared_median = np.median(linear_r_squared_mc)
         linear_r_squared_st_dev = np.std(linear_r_squared_mc)
-        linear_gradient = np.mean(linear_gradient_mc)
-        linear_gradient_st_dev = np.std(linear_gradient_mc)
+        linear_gradient, linear_gradient_st_dev = \
+            self.data_processing_dialog.model.calculation_results.get_drift_coefficient_mean_and_st_dev(ratio)
 
         self.r_squared_text.setText("R<sup>2</sup>:\n" + format(linear_r_squared, ".3f"))
         self.r_squared_uncertainty_range.setText(
@@ -224,7 +221,8 @@ class DriftCorrectionWidget(QWidget):
             primary_ys = []
             for spot in self.primary_sample.spots:
                 if ratio.has_delta:
-                    primary_ys.append(np.mean(spot.not_corrected_deltas[ratio]))
+                    primary_ys.append(self.model.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.NOT_CORRECTED, ratio)[0])
                 else:
                     primary_ys.append(spot.mean_st_error_isotope_ratios[ratio][0])
 
@@ -235,7 +233,8 @@ class DriftCorrectionWidget(QWidget):
                 secondary_ys = []
                 for spot in self.secondary_sample.spots:
                     if ratio.has_delta:
-                        secondary_ys.append(np.mean(spot.not_corrected_deltas[ratio]))
+                        secondary_ys.append(self.model.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.NOT_CORRECTED, ratio)[0])
                     else:
                         secondary_ys.append(spot.mean_st_error_isotope_ratios[ratio][0])
 
@@ -261,8 +260,8 @@ class DriftCorrectionWidget(QWidget):
                             self.secondary_check_axis.errorbar(x, secondary_y, ls="", marker="o",
                                                                color=self.secondary_sample.colour)
 
-            for primary_x, primary_y in zip(primary_spots, primary_ys):
-                x = time.mktime(primary_x.datetime.timetuple()) - t_zero
+            primary_relative_times = self.model.timeline.get_times_relative_to_t_zero(t_zero, primary_spots)
+            for primary_x, primary_y, x in zip(primary_spots, primary_ys, primary_relative_times):
                 if primary_x == current_spot:
                     self.primary_drift_axis.errorbar(x, primary_y, ls="", marker="o", color="yellow")
 
@@ -293,20 +292,22 @@ class DriftCorrectionWidget(QWidget):
 
         t_zero = self.data_processing_dialog.model.calculation_results.get_t_zero()
 
-        for spot in sample.spots:
-            relative_time = time.mktime(spot.datetime.timetuple()) - t_zero
+        relative_times = self.model.timeline.get_times_relative_to_t_zero(t_zero, sample.spots)
+        for spot, relative_time in zip(sample.spots, relative_times):
             if ratio.has_delta:
                 if not spot.is_flagged:
                     xs.append(relative_time)
-                    y = np.mean(spot.not_corrected_deltas[ratio])
-                    dy = 2 * np.std(spot.not_corrected_deltas[ratio])
+                    y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.NOT_CORRECTED, ratio)
+                    dy = 2 * y_st_dev
                     ys.append(y)
                     yerrors.append(dy)
 
                 else:
                     xs_removed.append(relative_time)
-                    y = np.mean(spot.not_corrected_deltas[ratio])
-                    dy = 2 * np.std(spot.not_corrected_deltas[ratio])
+                    y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                        spot, CorrectionStage.NOT_CORRECTED, ratio)
+                    dy = 2 * y_st_dev
                     ys_removed.append(y)
                     yerrors_removed.append(dy)
 
@@ -367,14 +368,16 @@ class DriftCorrectionWidget(QWidget):
 
         for spot in sample.spots:
             if not spot.is_flagged:
-                y = np.mean(spot.drift_corrected_data[ratio])
-                dy = 2 * np.std(spot.drift_corrected_data[ratio])
+                y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                    spot, CorrectionStage.DRIFT_CORRECTED, ratio)
+                dy = 2 * y_st_dev
                 dc_ys.append(y)
                 dc_yerrors.append(dy)
 
             else:
-                y = np.mean(spot.drift_corrected_data[ratio])
-                dy = 2 * np.std(spot.drift_corrected_data[ratio])
+                y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                    spot, CorrectionStage.DRIFT_CORRECTED, ratio)
+                dy = 2 * y_st_dev
                 dc_ys_removed.append(y)
                 dc_yerrors_removed.append(dy)
 
@@ -417,14 +420,16 @@ class DriftCorrectionWidget(QWidget):
                     if not spot.is_flagged:
                         xs.append(spot.datetime)
 
-                        y = np.mean(spot.drift_corrected_data[ratio])
-                        dy = 2 * np.std(spot.drift_corrected_data[ratio])
+                        y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.DRIFT_CORRECTED, ratio)
+                        dy = 2 * y_st_dev
                         ys.append(y)
                         yerrors.append(dy)
                     else:
                         xs_removed.append(spot.datetime)
-                        y = np.mean(spot.drift_corrected_data[ratio])
-                        dy = 2 * np.std(spot.drift_corrected_data[ratio])
+                        y, y_st_dev = self.model.calculation_results.get_mean_and_st_dev(
+                            spot, CorrectionStage.DRIFT_CORRECTED, ratio)
+                        dy = 2 * y_st_dev
                         ys_removed.append(y)
                         yerrors_removed.append(dy)
                 else:
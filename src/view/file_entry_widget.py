@@ -3,7 +3,7 @@ import os.path
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QPushButton, QFileDialog, QTreeWidget, QTreeWidgetItem, \
-    QVBoxLayout
+    QVBoxLayout, QMessageBox
 
 from controllers.signals import signals
 from view.change_sample_names_dialog import ChangeSampleNamesDialog
@@ -13,6 +13,7 @@ class FileEntryWidget(QWidget):
     def __init__(self, model):
         QWidget.__init__(self)
         self.model = model
+        self.number_of_detector_parameter_sets = 1
 
         layout = QHBoxLayout()
         self.setLayout(layout)
@@ -23,6 +24,10 @@ class FileEntryWidget(QWidget):
         self.file_entry_button = QPushButton("Select data files")
         self.file_entry_button.clicked.connect(self.on_file_entry_button_clicked)
 
+        self.watch_folder_button = QPushButton("Watch data folder")
+        self.watch_folder_button.setCheckable(True)
+        self.watch_folder_button.clicked.connect(self.on_watch_folder_button_clicked)
+
         self.sample_name_tree_widget = QTreeWidget()
         self.sample_name_tree_widget.setHeaderLabel("Sample names")
 
@@ -37,6 +42,7 @@ class FileEntryWidget(QWidget):
         rhs_layout = QVBoxLayout()
 
         rhs_layout.addWidget(self.file_entry_button)
+        rhs_layout.addWidget(self.watch_folder_button)
         rhs_layout.addWidget(self.sample_name_tree_widget)
         rhs_layout.addWidget(self.manual_sample_names_button)
 
@@ -54,12 +60,28 @@ class FileEntryWidget(QWidget):
         filenames, _ = QFileDialog.getOpenFileNames(self,
                                                     "Select files",
                                                     "home",
-                                                    "ASCII files (*.asc)"
+                                                    "ASCII files or zip archives of them (*.asc *.zip)"
                                                     )
         if filenames:
             self.model.import_all_files(filenames)
 
+    def on_watch_folder_button_clicked(self, checked):
+        if not checked:
+            self.model.stop_watching_folder()
+            self.watch_folder_button.setText("Watch data folder")
+            return
+
+        directory = QFileDialog.getExistingDirectory(self, "Select the folder the data files are written to", "home")
+        if directory:
+            self.model.start_watching_folder(directory)
+            # New files in the folder are added to the session until the button is pressed again
+            self.watch_folder_button.setText("Stop watching " + os.path.basename(directory))
+        else:
+            self.watch_folder_button.setChecked(False)
+
     def on_imported_files_updated(self):
+        # Files can be added to the session more than once while a folder is being watched
+        self.filename_tree_widget.clear()
         for filename in self.model.imported_files:
             base_name = os.path.basename(filename)
             filename_item = QTreeWidgetItem(self.filename_tree_widget)
@@ -70,6 +92,21 @@ class FileEntryWidget(QWidget):
         self.filename_tree_widget.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
         self.filename_tree_widget.header().setStretchLastSection(False)
 
+        self.warn_if_detector_calibration_changed()
+
+    def warn_if_detector_calibration_changed(self):
+        # Only warns about each recalibration once, as files can be added to the session more than once.
+        detector_parameter_table = self.model.detector_parameter_table
+        if len(detector_parameter_table.parameter_sets) <= self.number_of_detector_parameter_sets:
+            return
+        self.number_of_detector_parameter_sets = len(detector_parameter_table.parameter_sets)
+
+        changes = ["Spot " + spot.full_sample_name + "@" + spot.id + " (" + spot.datetime.strftime("%d/%m/%Y %H:%M")
+                   + ") uses detector parameter set " + str(new_id) + " rather than " + str(previous_id)
+                   for spot, previous_id, new_id in detector_parameter_table.get_calibration_changes()]
+        QMessageBox.warning(self, "Detector calibration changed",
+                            "The detector parameters change partway through the session:\n" + "\n".join(changes))
+
     def on_change_sample_names_button_clicked(self):
         sample_names = [sample.name for sample in self.model.get_samples()]
         dialog = ChangeSampleNamesDialog(sample_names)
@@ -81,6 +118,9 @@ class FileEntryWidget(QWidget):
         return sample_names
 
     def on_data_cleared(self):
+        self.number_of_detector_parameter_sets = 1
+        self.watch_folder_button.setChecked(False)
+        self.watch_folder_button.setText("Watch data folder")
         self.filename_tree_widget.clear()
         self.sample_name_tree_widget.clear()
 
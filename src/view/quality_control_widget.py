@@ -5,6 +5,7 @@ from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTabWidget
 from matplotlib.patches import Circle
 
 from controllers.signals import signals
+from model.correction_stage import CorrectionStage
 from utils import gui_utils
 
 matplotlib.use('QT5Agg')
@@ -109,8 +110,10 @@ class QualityControlWidget(QWidget):
             ys = []
             dys = []
             for spot in sample.spots:
-                ys.append(np.mean(spot.alpha_corrected_data[ratio]))
-                dys.append((2 * np.std(spot.alpha_corrected_data[ratio])))
+                y, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+                ys.append(y)
+                dys.append(2 * st_dev)
 
             self.corrected_value_vs_time_axis.errorbar(xs, ys, yerr=dys, ls="", marker="o", color=sample.colour)
 
@@ -160,8 +163,10 @@ class QualityControlWidget(QWidget):
             ys = []
             dys = []
             for spot in sample.spots:
-                ys.append(np.mean(spot.alpha_corrected_data[ratio]))
-                dys.append((2 * np.std(spot.alpha_corrected_data[ratio])))
+                y, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+                ys.append(y)
+                dys.append(2 * st_dev)
 
 
             self.corrected_value_vs_secondary_ion_yield_axis.errorbar(xs, ys, yerr=dys, ls="", marker="o",
@@ -183,8 +188,10 @@ class QualityControlWidget(QWidget):
             ys = []
             dys = []
             for spot in sample.spots:
-                ys.append(np.mean(spot.alpha_corrected_data[ratio]))
-                dys.append((2 * np.std(spot.alpha_corrected_data[ratio])))
+                y, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+                ys.append(y)
+                dys.append(2 * st_dev)
 
             self.corrected_value_vs_distance_from_mount_centre_axis.errorbar(xs, ys, yerr=dys, ls="", marker="o",
                                                                              color=sample.colour)
@@ -205,8 +212,10 @@ class QualityControlWidget(QWidget):
             ys = []
             dys = []
             for spot in sample.spots:
-                ys.append(np.mean(spot.alpha_corrected_data[ratio]))
-                dys.append((2 * np.std(spot.alpha_corrected_data[ratio])))
+                y, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+                ys.append(y)
+                dys.append(2 * st_dev)
 
             self.corrected_value_vs_dtfa_x_axis.errorbar(xs, ys, yerr=dys, ls="", marker="o", color=sample.colour)
         self.corrected_value_vs_dtfa_x_axis.set_xlabel("dtfa-x")
@@ -227,8 +236,10 @@ class QualityControlWidget(QWidget):
             ys = []
             dys = []
             for spot in sample.spots:
-                ys.append(np.mean(spot.alpha_corrected_data[ratio]))
-                dys.append((2 * np.std(spot.alpha_corrected_data[ratio])))
+                y, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+                ys.append(y)
+                dys.append(2 * st_dev)
 
             total_xs.extend(xs)
 
@@ -1,8 +1,13 @@
+import os
+
 from PyQt5.QtCore import Qt, QSize
 from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QLabel, QPushButton, QHBoxLayout, QLineEdit, QSpinBox, \
-    QMessageBox
+    QMessageBox, QCheckBox, QComboBox
 
 from controllers.signals import signals
+from model.sampling_method import SamplingMethod
+from model.sidrs_model import DEFAULT_MAXIMUM_NUMBER_OF_WORKERS
+from model.uncertainty_method import UncertaintyMethod
 from view.data_processing_dialog import DataProcessingDialog
 from view.file_entry_widget import FileEntryWidget
 from view.isotope_button_widget import IsotopeButtonWidget
@@ -40,6 +45,45 @@ class SidrsWindow(QMainWindow):
         self.montecarlo_number_input.setValue(10000)
         montecarlo_text = QLabel("Number of trials for Monte Carlo distributions:")
 
+        self.single_precision_checkbox = QCheckBox("Single precision (half the memory)")
+        self.single_precision_checkbox.toggled.connect(self.model.set_montecarlo_single_precision)
+
+        self.sampling_method_input = QComboBox()
+        for sampling_method in SamplingMethod:
+            self.sampling_method_input.addItem(sampling_method.value, sampling_method)
+        self.sampling_method_input.currentIndexChanged.connect(self.on_sampling_method_changed)
+
+        self.chunked_montecarlo_checkbox = QCheckBox("Constant memory (summary statistics only)")
+        self.chunked_montecarlo_checkbox.toggled.connect(self.model.set_montecarlo_chunked)
+
+        self.kept_deviates_checkbox = QCheckBox("Keep random numbers between recalculations")
+        self.kept_deviates_checkbox.toggled.connect(self.model.set_montecarlo_deviates_kept)
+
+        # The number of trials is then the maximum
+        self.adaptive_montecarlo_checkbox = QCheckBox("Stop when converged")
+        self.adaptive_montecarlo_checkbox.toggled.connect(self.model.set_montecarlo_number_adaptive)
+
+        self.error_propagation_checkbox = QCheckBox("Error propagation instead of Monte Carlo")
+        self.error_propagation_checkbox.toggled.connect(self.on_error_propagation_toggled)
+
+        self.import_process_number_input = QSpinBox()
+        self.import_process_number_input.setMinimum(1)
+        self.import_process_number_input.setMaximum(os.cpu_count() or 1)
+        self.import_process_number_input.valueChanged.connect(self.model.set_number_of_import_processes)
+        self.import_process_number_input.setValue(min(os.cpu_count() or 1, DEFAULT_MAXIMUM_NUMBER_OF_WORKERS))
+        import_process_text = QLabel("Number of processes used to import files:")
+
+        self.montecarlo_thread_number_input = QSpinBox()
+        self.montecarlo_thread_number_input.setMinimum(1)
+        self.montecarlo_thread_number_input.setMaximum(os.cpu_count() or 1)
+        self.montecarlo_thread_number_input.valueChanged.connect(self.model.set_number_of_montecarlo_threads)
+        self.montecarlo_thread_number_input.setValue(min(os.cpu_count() or 1, DEFAULT_MAXIMUM_NUMBER_OF_WORKERS))
+        montecarlo_thread_text = QLabel("Number of threads used for Monte Carlo:")
+
+        # Imported files are cached so that importing them again is faster
+        self.clear_spot_cache_button = QPushButton("Clear import cache")
+        self.clear_spot_cache_button.clicked.connect(self.model.clear_spot_cache)
+
         main_layout = QVBoxLayout()
         main_widget.setLayout(main_layout)
 
@@ -50,6 +94,14 @@ class SidrsWindow(QMainWindow):
         self.clear_data_button.setDisabled(True)
 
         self.montecarlo_number_input.setDisabled(True)
+        self.single_precision_checkbox.setDisabled(True)
+        self.sampling_method_input.setDisabled(True)
+        self.chunked_montecarlo_checkbox.setDisabled(True)
+        self.adaptive_montecarlo_checkbox.setDisabled(True)
+        self.kept_deviates_checkbox.setDisabled(True)
+        self.error_propagation_checkbox.setDisabled(True)
+        self.import_process_number_input.setDisabled(True)
+        self.montecarlo_thread_number_input.setDisabled(True)
 
         signals.materialInput.connect(self.enable_widgets)
 
@@ -59,9 +111,23 @@ class SidrsWindow(QMainWindow):
         montecarlo_layout = QHBoxLayout()
         montecarlo_layout.addWidget(montecarlo_text)
         montecarlo_layout.addWidget(self.montecarlo_number_input)
+        montecarlo_layout.addWidget(self.single_precision_checkbox)
+        montecarlo_layout.addWidget(self.sampling_method_input)
+        montecarlo_layout.addWidget(self.chunked_montecarlo_checkbox)
+        montecarlo_layout.addWidget(self.adaptive_montecarlo_checkbox)
+        montecarlo_layout.addWidget(self.kept_deviates_checkbox)
+        montecarlo_layout.addWidget(self.error_propagation_checkbox)
+
+        import_process_layout = QHBoxLayout()
+        import_process_layout.addWidget(import_process_text)
+        import_process_layout.addWidget(self.import_process_number_input)
+        import_process_layout.addWidget(montecarlo_thread_text)
+        import_process_layout.addWidget(self.montecarlo_thread_number_input)
+        import_process_layout.addWidget(self.clear_spot_cache_button)
 
         main_layout.addWidget(title)
         main_layout.addWidget(IsotopeButtonWidget(self.model))
+        main_layout.addLayout(import_process_layout)
         main_layout.addWidget(self.file_entry_widget)
         main_layout.addLayout(montecarlo_layout)
         main_layout.addLayout(button_layout)
@@ -72,17 +138,31 @@ class SidrsWindow(QMainWindow):
         self.file_entry_widget.setEnabled(True)
         self.next_button.setEnabled(True)
         self.clear_data_button.setEnabled(True)
-        self.montecarlo_number_input.setEnabled(True)
+        self.montecarlo_number_input.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.single_precision_checkbox.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.sampling_method_input.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.chunked_montecarlo_checkbox.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.adaptive_montecarlo_checkbox.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.kept_deviates_checkbox.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.montecarlo_thread_number_input.setEnabled(not self.error_propagation_checkbox.isChecked())
+        self.error_propagation_checkbox.setEnabled(True)
+        self.import_process_number_input.setEnabled(True)
 
     def next_button_clicked(self):
         popup = QMessageBox()
 
         popup.setWindowTitle('Monte Carlo warning')
-        if self.montecarlo_number_input.value() < 1000:
+        # Single precision distributions use half the memory
+        maximum_trials = 2000000 if self.single_precision_checkbox.isChecked() else 1000000
+        if self.error_propagation_checkbox.isChecked():
+            # The number of trials is not used
+            pass
+        elif self.montecarlo_number_input.value() < 1000:
             popup.setText('Less than 1000 trials leads to high variance in the mean and standard deviation of results.')
             popup.exec()
-        elif self.montecarlo_number_input.value() > 1000000:
-            popup.setText('More than 1000000 trials will cause significant memory usage and the program may crash.')
+        elif self.montecarlo_number_input.value() > maximum_trials and not self.chunked_montecarlo_checkbox.isChecked():
+            popup.setText('More than ' + str(maximum_trials) + ' trials will cause significant memory usage and the '
+                          'program may crash.')
             popup.exec()
         dialog = ReferenceMaterialSelectionDialog(self.model)
         result = dialog.exec()
@@ -99,10 +179,28 @@ class SidrsWindow(QMainWindow):
         dialog = DataProcessingDialog(self.model)
         dialog.exec()
 
+    def on_sampling_method_changed(self):
+        self.model.set_sampling_method(self.sampling_method_input.currentData())
+
+    def on_error_propagation_toggled(self, is_error_propagation):
+        if is_error_propagation:
+            self.model.set_uncertainty_method(UncertaintyMethod.ERROR_PROPAGATION)
+        else:
+            self.model.set_uncertainty_method(UncertaintyMethod.MONTE_CARLO)
+        # The number of trials and their precision only apply to Monte Carlo
+        self.montecarlo_number_input.setDisabled(is_error_propagation)
+        self.single_precision_checkbox.setDisabled(is_error_propagation)
+        self.sampling_method_input.setDisabled(is_error_propagation)
+        self.chunked_montecarlo_checkbox.setDisabled(is_error_propagation)
+        self.adaptive_montecarlo_checkbox.setDisabled(is_error_propagation)
+        self.kept_deviates_checkbox.setDisabled(is_error_propagation)
+        self.montecarlo_thread_number_input.setDisabled(is_error_propagation)
+
     def clear_data_button_clicked(self):
         self.model.clear_all_data_and_methods()
 
     def on_data_cleared(self):
         self.file_entry_widget.setDisabled(True)
+        self.import_process_number_input.setDisabled(True)
         self.next_button.setDisabled(True)
         self.clear_data_button.setDisabled(True)
\ No newline at end of file
@@ -1,9 +1,9 @@
 import math
 
-import numpy as np
 from PyQt5.QtWidgets import QWidget, QTabWidget, QVBoxLayout
 from matplotlib import pyplot as plt
 
+from model.correction_stage import CorrectionStage
 from model.isotopes import Isotope
 from utils import gui_utils
 
@@ -99,14 +99,10 @@ class SulphurCAPWidget(QWidget):
         list_for_finding_minimum_and_maximum_y_values = [0]
 
         for sample in self.model.get_samples():
-            delta_y_value = [np.mean(spot.alpha_corrected_data[ratio_y]) for spot in
-                             sample.spots]
-            delta_y_errors = [2 * np.std(spot.alpha_corrected_data[ratio_y]) for spot in
-                              sample.spots]
-            delta_x_value = [np.mean(spot.alpha_corrected_data[ratio_x]) for spot in
-                             sample.spots]
-            delta_x_errors = [2 * np.std(spot.alpha_corrected_data[ratio_x]) for spot in
-                              sample.spots]
+            delta_y_value, delta_y_errors = self._get_values_and_errors(sample, CorrectionStage.ALPHA_CORRECTED,
+                                                                        ratio_y)
+            delta_x_value, delta_x_errors = self._get_values_and_errors(sample, CorrectionStage.ALPHA_CORRECTED,
+                                                                        ratio_x)
             list_for_finding_minimum_and_maximum_y_values.extend(delta_y_value)
             list_for_finding_minimum_and_maximum_x_values.extend(delta_x_value)
             axis.errorbar(delta_x_value, delta_y_value, xerr=delta_x_errors,
@@ -135,10 +131,8 @@ class SulphurCAPWidget(QWidget):
         axis.set_xlabel("delta S34")
         axis.set_ylabel("Cap S33")
         for sample in self.model.get_samples():
-            xs = [np.mean(spot.alpha_corrected_data[S34_S32]) for spot in sample.spots]
-            x_errors = [2 * np.std(spot.alpha_corrected_data[S34_S32]) for spot in sample.spots]
-            ys = [np.mean(spot.cap_data_S33) for spot in sample.spots]
-            y_errors = [2 * np.std(spot.cap_data_S33) for spot in sample.spots]
+            xs, x_errors = self._get_values_and_errors(sample, CorrectionStage.ALPHA_CORRECTED, S34_S32)
+            ys, y_errors = self._get_values_and_errors(sample, CorrectionStage.CAP_S33)
 
             axis.errorbar(x=xs, xerr=x_errors, y=ys, yerr=y_errors, ls="", marker="o", color=sample.colour,
                           label=sample.name)
@@ -154,15 +148,23 @@ class SulphurCAPWidget(QWidget):
         axis.set_ylabel("Cap S36")
 
         for sample in self.model.get_samples():
-            xs = [np.mean(spot.cap_data_S33) for spot in sample.spots]
-            x_errors = [2 * np.std(spot.cap_data_S33) for spot in sample.spots]
-            ys = [np.mean(spot.cap_data_S36) for spot in sample.spots]
-            y_errors = [2 * np.std(spot.cap_data_S36) for spot in sample.spots]
+            xs, x_errors = self._get_values_and_errors(sample, CorrectionStage.CAP_S33)
+            ys, y_errors = self._get_values_and_errors(sample, CorrectionStage.CAP_S36)
 
             axis.errorbar(x=xs, xerr=x_errors, y=ys, yerr=y_errors, ls="", marker="o", color=sample.colour,
                           label=sample.name)
 
         axis.legend()
+
+    def _get_values_and_errors(self, sample, stage, ratio=None):
+        # The errors are 2 sigma
+        values = []
+        errors = []
+        for spot in sample.spots:
+            value, st_dev = self.model.calculation_results.get_mean_and_st_dev(spot, stage, ratio)
+            values.append(value)
+            errors.append(2 * st_dev)
+        return values, errors
 ###############
 ### ACTIONS ###
 ###############
@@ -0,0 +1,419 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+import numpy as np
+
+from model.get_data_from_import import AscSectionIndex, get_block_number_from_asc, get_dtfa_x_and_y_from_asc, \
+    get_primary_beam_current_data_asc, get_analytical_conditions_data_from_asc_file, read_asc_file, get_asc_file_data, \
+    get_raw_cps_data, read_asc_files_from_zip_archive
+from model.asc_folder_watcher import AscFolderWatcher, LiveImport
+from model.asc_preflight import read_asc_file_header, preflight_check_asc_files
+from model.elements import Element
+from model.isotopes import Isotope
+from model.sampling_method import SamplingMethod
+from model.settings.material_lists import Material
+from model.sidrs_model import SidrsModel
+from model.spot import parse_asc_file_into_spot
+from model.spot_cache import SpotCache
+from model.uncertainty_method import UncertaintyMethod
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "integration_tests", "fixtures")
+
+
+def read_fixture(filename):
+    return read_asc_file(os.path.join(FIXTURES_DIRECTORY, filename))
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_section_index_oxygen(self):
+        spot_data = read_fixture("OGC@01.asc")
+        section_index = AscSectionIndex(spot_data)
+
+        self.assertEqual(13, section_index.acquisition_parameters_line)
+        self.assertEqual(25, section_index.detector_list_line)
+        self.assertEqual(58, section_index.detector_parameters_line)
+        self.assertEqual(112, section_index.isotopics_ratio_line)
+        self.assertEqual(123, section_index.blocks_line)
+        self.assertEqual(142, section_index.primary_current_line)
+        self.assertEqual(150, section_index.dtfa_line)
+        self.assertEqual(164, section_index.raw_data_line)
+
+    def test_section_index_sulphur(self):
+        spot_data = read_fixture("Sierra@01.asc")
+        section_index = AscSectionIndex(spot_data)
+
+        self.assertEqual(131, section_index.blocks_line)
+        self.assertEqual(176, section_index.raw_data_line)
+        self.assertEqual(30, get_block_number_from_asc(spot_data, section_index))
+        self.assertEqual((-20, -18), get_dtfa_x_and_y_from_asc(spot_data, section_index))
+        self.assertAlmostEqual(2.472374E-9, get_primary_beam_current_data_asc(spot_data, section_index))
+
+    def test_section_index_missing_section(self):
+        spot_data = read_fixture("OGC@01.asc")[:150]
+        self.assertRaises(ValueError, AscSectionIndex, spot_data)
+
+    def test_section_index_template(self):
+        oxygen_spot_data = read_fixture("OGC@02.asc")
+        template = AscSectionIndex(read_fixture("OGC@01.asc"))
+        self.assertTrue(template.matches(oxygen_spot_data))
+        self.assertEqual(vars(AscSectionIndex(oxygen_spot_data)), vars(AscSectionIndex(oxygen_spot_data, template)))
+
+        # A file with a different layout falls back to a full scan
+        sulphur_spot_data = read_fixture("Sierra@01.asc")
+        self.assertFalse(template.matches(sulphur_spot_data))
+        self.assertEqual(176, AscSectionIndex(sulphur_spot_data, template).raw_data_line)
+
+        shifted_spot_data = [[]] + oxygen_spot_data
+        self.assertFalse(template.matches(shifted_spot_data))
+        self.assertEqual(165, AscSectionIndex(shifted_spot_data, template).raw_data_line)
+
+    def test_asc_file_data_with_section_index_template(self):
+        template = AscSectionIndex(read_fixture("OGC@01.asc"))
+        for fixture in ["OGC@02.asc", "Sierra@01.asc"]:
+            spot_data = read_fixture(fixture)
+            asc_file_data = get_asc_file_data(spot_data, template)
+            np.testing.assert_array_equal(get_asc_file_data(spot_data).raw_cps_data, asc_file_data.raw_cps_data)
+
+    def test_analytical_conditions_data(self):
+        spot_data = read_fixture("OGC@01.asc")
+        section_index = AscSectionIndex(spot_data)
+        analytical_conditions_data = get_analytical_conditions_data_from_asc_file(spot_data, section_index)
+
+        self.assertEqual(99, len(analytical_conditions_data))
+        self.assertIn("ACQUISITION PARAMETERS", analytical_conditions_data[0][0])
+
+    def test_raw_cps_data_array(self):
+        spot_data = read_fixture("Sierra@01.asc")
+        asc_file_data = get_asc_file_data(spot_data)
+        columns = [asc_file_data.get_mass_peak_column(isotope) for isotope in [Isotope.S32, Isotope.S34]]
+
+        self.assertEqual(30, asc_file_data.get_number_of_measurements())
+        self.assertEqual(np.float64, asc_file_data.raw_cps_data.dtype)
+        self.assertEqual(1.954018E+9, asc_file_data.raw_cps_data[0, columns[0]])
+        self.assertEqual(8.586207E+7, asc_file_data.raw_cps_data[29, columns[1]])
+        np.testing.assert_array_equal(np.array([[1.005054, 446847, 0.0], [1.0, -91675, 0.0]]),
+                                      asc_file_data.detector_parameters[columns])
+
+    def test_raw_cps_data_negative_exponents(self):
+        spot_data = [["0", "0", "2.5E-12", "4.0E+3"], ["1", "0", "-1.25E-3", "1E0"]]
+        raw_cps_data = get_raw_cps_data(0, [2, 3], spot_data, 2, 1)
+
+        np.testing.assert_array_equal(np.array([[2.5E-12, 4.0E+3], [-1.25E-3, 1.0]]), raw_cps_data)
+
+    def test_spot_pickles(self):
+        spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), [Isotope.O16, Isotope.O18])
+        unpickled_spot = pickle.loads(pickle.dumps(spot))
+
+        self.assertEqual(spot.datetime, unpickled_spot.datetime)
+        np.testing.assert_array_equal(spot.raw_cps_data, unpickled_spot.raw_cps_data)
+        np.testing.assert_array_equal(spot.mass_peaks[Isotope.O18].detector_corrected_cps_data,
+                                      unpickled_spot.mass_peaks[Isotope.O18].detector_corrected_cps_data)
+
+    def test_spot_is_compact(self):
+        spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), [Isotope.O16, Isotope.O18])
+
+        self.assertFalse(hasattr(spot, "__dict__"))
+        self.assertFalse(hasattr(spot.mass_peaks[Isotope.O16], "__dict__"))
+        self.assertEqual((20, 2), spot.raw_cps_data.shape)
+        # The mass peaks share the memory of the spot's arrays rather than holding copies.
+        self.assertTrue(np.shares_memory(spot.raw_cps_data, spot.mass_peaks[Isotope.O18].raw_cps_data))
+
+    def test_spot_cache_round_trip(self):
+        filename = os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc")
+        with tempfile.TemporaryDirectory() as cache_directory:
+            spot_cache = SpotCache(cache_directory)
+            spot = parse_asc_file_into_spot(filename, [Isotope.O16, Isotope.O18], spot_cache)
+            self.assertIsNotNone(spot_cache.load(spot.file_hash))
+
+            cached_spot = parse_asc_file_into_spot(filename, [Isotope.O16, Isotope.O18], spot_cache)
+
+        self.assertEqual(spot.file_hash, cached_spot.file_hash)
+        self.assertEqual(spot.datetime, cached_spot.datetime)
+        self.assertEqual((spot.x_position, spot.y_position), (cached_spot.x_position, cached_spot.y_position))
+        self.assertEqual((spot.dtfa_x, spot.dtfa_y), (cached_spot.dtfa_x, cached_spot.dtfa_y))
+        self.assertEqual(spot.primary_beam_current, cached_spot.primary_beam_current)
+        np.testing.assert_array_equal(spot.raw_cps_data, cached_spot.raw_cps_data)
+        np.testing.assert_array_equal(spot.detector_corrected_cps_data, cached_spot.detector_corrected_cps_data)
+
+    def test_spot_cache_miss(self):
+        with tempfile.TemporaryDirectory() as cache_directory:
+            spot_cache = SpotCache(cache_directory)
+            self.assertIsNone(spot_cache.load("0" * 64))
+
+            with open(os.path.join(cache_directory, "1" * 64 + ".npz"), "wb") as file:
+                file.write(b"not a cache file")
+            self.assertIsNone(spot_cache.load("1" * 64))
+
+    def test_spot_cache_removes_least_recently_used_files(self):
+        filenames = [os.path.join(FIXTURES_DIRECTORY, "OGC@%02d.asc" % i) for i in range(1, 4)]
+        with tempfile.TemporaryDirectory() as cache_directory:
+            spot_cache = SpotCache(cache_directory)
+            spots = [parse_asc_file_into_spot(filename, [Isotope.O16, Isotope.O18], spot_cache)
+                     for filename in filenames]
+            cache_filenames = [os.path.join(cache_directory, spot.file_hash + ".npz") for spot in spots]
+            for i, cache_filename in enumerate(cache_filenames):
+                os.utime(cache_filename, (i, i))
+            # The first file is used again, so the second is now the least recently used
+            spot_cache.load(spots[0].file_hash)
+
+            spot_cache.maximum_size_in_bytes = sum(os.path.getsize(filename) for filename in cache_filenames[2:]) \
+                + os.path.getsize(cache_filenames[0])
+            spot_cache.remove_least_recently_used()
+            self.assertEqual([True, False, True], [os.path.exists(filename) for filename in cache_filenames])
+
+            spot_cache.clear()
+            self.assertEqual([], os.listdir(cache_directory))
+
+    def test_same_file_contents_imported_twice(self):
+        model = SidrsModel()
+        model.isotopes = [Isotope.O16, Isotope.O18]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "OGC@01.asc")
+            copied_filename = os.path.join(directory, "OGC@02.asc")
+            shutil.copyfile(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), filename)
+            shutil.copyfile(filename, copied_filename)
+
+            self.assertRaises(Exception, model.import_all_files, [filename, copied_filename])
+            self.assertEqual([], model.imported_files)
+
+    def test_read_asc_files_from_zip_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            archive_filename = os.path.join(directory, "session.zip")
+            with zipfile.ZipFile(archive_filename, "w") as archive:
+                archive.write(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), "session/OGC@01.asc")
+                archive.write(os.path.join(FIXTURES_DIRECTORY, "unknown@01.asc"), "session/unknown@01.asc")
+                archive.writestr("session/notes.txt", "not an asc file")
+
+            contents_by_filename = read_asc_files_from_zip_archive(archive_filename)
+
+            model = SidrsModel()
+            model.isotopes = [Isotope.O16, Isotope.O18]
+            model.import_all_files([archive_filename])
+
+        self.assertEqual([os.path.join(archive_filename, "session", "OGC@01.asc"),
+                          os.path.join(archive_filename, "session", "unknown@01.asc")],
+                         list(contents_by_filename.keys()))
+        self.assertEqual(list(contents_by_filename.keys()), model.imported_files)
+        self.assertEqual(["OGC", "unknown"], sorted(sample.name for sample in model.get_samples()))
+        self.assertEqual(99, len(model.analytical_condition_data))
+
+    def test_read_asc_file_header(self):
+        header = read_asc_file_header(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"))
+
+        self.assertEqual(("12/02/2021", "10:16 AM"), (header.date, header.time))
+        self.assertEqual((1883, -2535), (header.x_position, header.y_position))
+        self.assertEqual((20, 1), (header.block_number, header.number_of_cycles))
+        self.assertEqual(["16O", "18O"], header.mass_peak_names)
+
+    def test_preflight_reports_bad_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            bad_filename = os.path.join(directory, "OGC01.asc")
+            shutil.copyfile(os.path.join(FIXTURES_DIRECTORY, "OGC@02.asc"), bad_filename)
+            filenames = [os.path.join(FIXTURES_DIRECTORY, filename) for filename in
+                         ["OGC@01.asc", "OGC@03.asc", "Sierra@01.asc"]] + [bad_filename]
+
+            report = preflight_check_asc_files(filenames, [Isotope.O16, Isotope.O18])
+
+            model = SidrsModel()
+            model.isotopes = [Isotope.O16, Isotope.O18]
+            self.assertRaises(Exception, model.import_all_files, filenames)
+
+        self.assertFalse(report.is_valid())
+        self.assertEqual(filenames[:2], report.get_valid_filenames())
+        self.assertEqual({filenames[2], bad_filename}, set(report.problems_by_filename.keys()))
+        # Sierra@01 has the wrong mass peaks and number of measurements
+        self.assertEqual(3, len(report.problems_by_filename[filenames[2]]))
+        # The bad files are reported after the other files have been imported
+        self.assertEqual(filenames[:2], model.imported_files)
+
+    def test_import_skips_truncated_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            truncated_filename = os.path.join(directory, "OGC@12.asc")
+            with open(os.path.join(FIXTURES_DIRECTORY, "OGC@02.asc"), "rb") as file:
+                contents = file.read()
+            with open(truncated_filename, "wb") as file:
+                file.write(contents[:len(contents) // 4])
+            filenames = [os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), truncated_filename,
+                         os.path.join(FIXTURES_DIRECTORY, "OGC@03.asc")]
+
+            model = SidrsModel()
+            model.isotopes = [Isotope.O16, Isotope.O18]
+            with self.assertRaises(Exception) as context:
+                model.import_all_files(filenames)
+
+        self.assertIn(truncated_filename, str(context.exception))
+        self.assertEqual([filenames[0], filenames[2]], model.imported_files)
+        self.assertEqual(["01", "03"], [spot.id for spot in model.get_all_spots()])
+
+    def test_session_timeline(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"])
+        timeline = model.timeline
+        spots = model.get_all_spots()
+        primary_rm_spots = model.get_primary_reference_material().spots
+
+        self.assertEqual(np.float64, timeline.epoch_times.dtype)
+        self.assertEqual([time.mktime(spot.datetime.timetuple()) for spot in spots], list(timeline.epoch_times))
+        self.assertEqual([spot in primary_rm_spots for spot in spots], list(timeline.primary_mask))
+        self.assertFalse(timeline.secondary_mask.any())
+
+        primary_rm_spots[0].is_flagged = True
+        self.assertEqual(np.median(timeline.get_epoch_times(primary_rm_spots[1:])), timeline.calculate_t_zero())
+        np.testing.assert_array_equal(timeline.get_epoch_times(primary_rm_spots[1:3]) - 100,
+                                      timeline.get_times_relative_to_t_zero(100, primary_rm_spots[1:3]))
+
+    def test_detector_parameter_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = []
+            for i in range(1, 7):
+                filename = os.path.join(directory, "OGC@%02d.asc" % i)
+                with open(os.path.join(FIXTURES_DIRECTORY, "OGC@%02d.asc" % i), "rb") as file:
+                    contents = file.read()
+                if i == 5:
+                    # The L'2 detector is recalibrated for a single spot
+                    contents = contents.replace(b"L'2       \t1.005054", b"L'2       \t1.006054")
+                with open(filename, "wb") as file:
+                    file.write(contents)
+                filenames.append(filename)
+
+            model = SidrsModel()
+            model.isotopes = [Isotope.O16, Isotope.O18]
+            model.import_all_files(filenames)
+
+        detector_parameter_table = model.detector_parameter_table
+        spots = model.get_all_spots()
+        self.assertEqual(2, len(detector_parameter_table.parameter_sets))
+        self.assertTrue(detector_parameter_table.has_calibration_changed())
+        self.assertEqual([0, 0, 0, 0, 1, 0], [spot.detector_parameter_set_id for spot in spots])
+        # Spots with the same parameters share the same arrays
+        self.assertIs(spots[0].detector_yields, spots[5].detector_yields)
+        self.assertEqual(1.006054, spots[4].mass_peaks[Isotope.O16].detector_yield)
+        self.assertEqual([(spots[4], 0, 1), (spots[5], 1, 0)], detector_parameter_table.get_calibration_changes())
+
+    def test_folder_watcher_waits_for_files_to_be_complete(self):
+        with tempfile.TemporaryDirectory() as directory:
+            folder_watcher = AscFolderWatcher(directory)
+            self.assertEqual([], folder_watcher.find_new_files())
+
+            filename = os.path.join(directory, "OGC@01.asc")
+            shutil.copyfile(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), filename)
+            self.assertEqual([], folder_watcher.find_new_files())
+            self.assertEqual([os.path.abspath(filename)], folder_watcher.find_new_files())
+            self.assertEqual([], folder_watcher.find_new_files())
+
+    def test_small_imports_are_parsed_without_worker_processes(self):
+        model = SidrsModel()
+        model.set_number_of_import_processes(4)
+
+        self.assertEqual(1, model._get_number_of_import_processes(7))
+        self.assertEqual(4, model._get_number_of_import_processes(8))
+
+    def test_add_spots_to_empty_session(self):
+        with tempfile.TemporaryDirectory() as directory:
+            archive_filename = os.path.join(directory, "session.zip")
+            with zipfile.ZipFile(archive_filename, "w") as archive:
+                archive.write(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), "OGC@01.asc")
+                archive.write(os.path.join(FIXTURES_DIRECTORY, "unknown@01.asc"), "unknown@01.asc")
+            contents_by_filename = read_asc_files_from_zip_archive(archive_filename)
+
+        model = SidrsModel()
+        model.isotopes = [Isotope.O16, Isotope.O18]
+        spots = [parse_asc_file_into_spot(filename, model.isotopes, contents=contents)
+                 for filename, contents in contents_by_filename.items()]
+        model.add_spots_to_session(spots)
+
+        # The spots that have already been parsed are used, although their files are no longer available
+        self.assertEqual(["OGC", "unknown"], [sample.name for sample in model.get_samples()])
+        self.assertEqual(spots, model.get_all_spots())
+        self.assertIsNone(model.analytical_condition_data)
+
+    def test_add_spots_to_session_skips_spots_that_cannot_be_added(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)])
+        duplicate_spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), model.isotopes)
+        new_spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "unknown@01.asc"), model.isotopes)
+
+        self.assertRaises(Exception, model.add_spots_to_session, [duplicate_spot, new_spot])
+        self.assertIn(new_spot, model.get_all_spots())
+        self.assertNotIn(duplicate_spot, model.get_all_spots())
+        self.assertIn(model.method.ratios[0], new_spot.alpha_corrected_data)
+
+    def test_live_import_skips_files_that_cannot_be_parsed(self):
+        model = SidrsModel()
+        model.isotopes = [Isotope.O16, Isotope.O18]
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "broken@01.asc"), "w") as file:
+                file.write("not an asc file")
+            shutil.copyfile(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), os.path.join(directory, "OGC@01.asc"))
+
+            live_import = LiveImport(model, directory, poll_interval_ms=1000000)
+            try:
+                # The files are only picked up once their sizes are the same in two polls
+                live_import.poll()
+                live_import.poll()
+                for _, future in live_import._parse_futures:
+                    future.exception()
+                self.assertRaises(Exception, live_import.poll)
+            finally:
+                live_import.stop()
+
+        self.assertEqual(["OGC"], [sample.name for sample in model.get_samples()])
+        self.assertEqual([], live_import._parse_futures)
+
+    def test_add_spots_to_processed_session(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)])
+        primary_rm = model.get_primary_reference_material()
+        primary_rm_alpha_corrected_data = [spot.alpha_corrected_data[model.method.ratios[0]]
+                                           for spot in primary_rm.spots]
+
+        new_spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "unknown@01.asc"), model.isotopes)
+        model.add_spots_to_session([new_spot])
+
+        self.assertEqual(["OGC", "unknown"], [sample.name for sample in model.get_samples()])
+        self.assertIn(model.method.ratios[0], new_spot.alpha_corrected_data)
+        # The primary reference material spots are not reprocessed
+        for spot, alpha_corrected_data in zip(primary_rm.spots, primary_rm_alpha_corrected_data):
+            self.assertIs(alpha_corrected_data, spot.alpha_corrected_data[model.method.ratios[0]])
+
+    def test_add_primary_reference_material_spots_to_processed_session(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"])
+        unknown_spot = model.get_samples_by_name()["unknown"].spots[0]
+        unknown_alpha_corrected_data = unknown_spot.alpha_corrected_data[model.method.ratios[0]].copy()
+
+        new_spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@11.asc"), model.isotopes)
+        model.add_spots_to_session([new_spot])
+
+        self.assertEqual(11, len(model.get_primary_reference_material().spots))
+        # A new primary reference material spot changes the correction of every spot
+        self.assertFalse(np.array_equal(unknown_alpha_corrected_data,
+                                        unknown_spot.alpha_corrected_data[model.method.ratios[0]]))
+
+
+def create_processed_oxygen_model(filenames, montecarlo_seed=0, is_single_precision=False, montecarlo_number=100,
+                                  uncertainty_method=UncertaintyMethod.MONTE_CARLO, is_montecarlo_number_adaptive=False,
+                                  is_montecarlo_chunked=False, sampling_method=SamplingMethod.PSEUDO_RANDOM,
+                                  are_montecarlo_deviates_kept=False, number_of_montecarlo_threads=1):
+    model = SidrsModel()
+    model.set_number_of_montecarlo_threads(number_of_montecarlo_threads)
+    model.set_montecarlo_seed(montecarlo_seed)
+    model.set_montecarlo_deviates_kept(are_montecarlo_deviates_kept)
+    model.set_sampling_method(sampling_method)
+    model.set_montecarlo_single_precision(is_single_precision)
+    model.set_montecarlo_number_adaptive(is_montecarlo_number_adaptive)
+    model.set_montecarlo_chunked(is_montecarlo_chunked)
+    model.set_uncertainty_method(uncertainty_method)
+    model._isotopes_input([Isotope.O16, Isotope.O18], Element.OXY)
+    model._material_input(Material.ZIR)
+    model.set_montecarlo_number(montecarlo_number)
+    model.import_all_files([os.path.join(FIXTURES_DIRECTORY, filename) for filename in filenames])
+    model.set_reference_materials("OGC", "No secondary reference material")
+    model.calculate_results()
+    return model
+
+
+if __name__ == '__main__':
+    unittest.main()
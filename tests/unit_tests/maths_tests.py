@@ -1,59 +1,58 @@
 import unittest
 import numpy as np
+from statsmodels.stats.stattools import medcouple
 
-from model.maths import calculate_outlier_resistant_mean_and_st_dev, calculate_sims_alpha, \
+from model.maths import calculate_sims_alpha, \
     calculate_alpha_correction, calculate_cap_value_and_uncertainty, calculate_number_of_outliers_to_remove, \
     calculate_binomial_distribution_probability, calculate_the_total_sum_of_squares_from_the_mean, \
-    calculate_rsquared_from_tss_and_rss
+    calculate_rsquared_from_tss_and_rss, calculate_delta_from_ratio, drift_correction, \
+    calculate_outlier_resistant_means_and_st_devs, calculate_medcouples, MEDCOUPLE_MAXIMUM_NUMBER_OF_PAIRS
 
-from model.mass_peak import MassPeak, correct_cps_data_for_detector_parameters
+from model.streaming_statistics import StreamingMeanAndVariance, QuantileSketch
+from model.mass_peak import MassPeak, correct_cps_data_for_detector_parameters, \
+    correct_cps_array_for_detector_parameters
 
 
 class MathsTests(unittest.TestCase):
 
     def test_outlier_resistant_mean_no_outliers_allowed(self):
         test_data = [1, 1, 2, 1, 4, 1, 2, 3, 9, 2]
-        mean, st_dev, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data, 0)
-        self.assertEqual(np.mean(test_data), mean)
-        self.assertEqual(np.std(test_data), st_dev)
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            [test_data], 0)
+        self.assertEqual(np.mean(test_data), means[0])
+        self.assertEqual(np.std(test_data), st_devs[0])
 
     def test_outlier_resistant_mean_zeros(self):
         test_data = [0] * 10
-        mean, st_dev, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data, 2)
-        self.assertEqual((0, 0), (mean, st_dev))
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            [test_data], 2)
+        self.assertEqual((0, 0), (means[0], st_devs[0]))
 
     def test_outlier_resistant_mean_empty_set(self):
-        self.assertRaises(Exception, calculate_outlier_resistant_mean_and_st_dev, [], 2)
+        self.assertRaises(Exception, calculate_outlier_resistant_means_and_st_devs, [[]], 2)
 
     def test_outlier_resistant_mean_one_higher_outlier(self):
         test_data = [1, 1, 1, 1, 1, 1, 1, 1, 1, 40]
-        mean, st_dev, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data, 1)
-        mean_2, st_dev_2, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data,
-                                                                                                             2)
-        self.assertEqual(1, mean)
-        self.assertEqual(0, st_dev)
-        self.assertEqual(1, mean_2)
-        self.assertEqual(0, st_dev_2)
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            [test_data, test_data], [1, 2])
+        self.assertEqual([1, 1], list(means))
+        self.assertEqual([0, 0], list(st_devs))
 
     def test_outlier_resistant_mean_one_lower_outlier(self):
         test_data = [1, 40, 40, 40, 40, 40, 40, 40, 40, 40]
-        mean, st_dev, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data, 1)
-        mean_2, st_dev_2, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data,
-                                                                                                             2)
-        self.assertEqual(40, mean)
-        self.assertEqual(0, st_dev)
-        self.assertEqual(40, mean_2)
-        self.assertEqual(0, st_dev_2)
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            [test_data, test_data], [1, 2])
+        self.assertEqual([40, 40], list(means))
+        self.assertEqual([0, 0], list(st_devs))
 
     def test_outlier_resistant_mean_two_outliers(self):
         test_data = [1, 40, 40, 40, 40, 40, 40, 40, 40, 400]
-        mean, st_dev, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data, 1)
-        mean_2, st_dev_2, length, removed_data, outlier_bounds = calculate_outlier_resistant_mean_and_st_dev(test_data,
-                                                                                                             2)
-        self.assertEqual(np.mean(test_data), mean)
-        self.assertEqual(np.std(test_data), st_dev)
-        self.assertEqual(40, mean_2)
-        self.assertEqual(0, st_dev_2)
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            [test_data, test_data], [1, 2])
+        self.assertEqual(np.mean(test_data), means[0])
+        self.assertEqual(np.std(test_data), st_devs[0])
+        self.assertEqual(40, means[1])
+        self.assertEqual(0, st_devs[1])
 
     def test_background_correction(self):
         test_data = ["10E+0"]
@@ -71,6 +70,24 @@ class MathsTests(unittest.TestCase):
 
         self.assertEqual(data[0], 0)
 
+    def test_detector_correction_of_cps_array(self):
+        raw_cps_data = np.array([[2.0E+9, 1.5E+7, 2.7E+5],
+                                 [1.9E+9, 1.4E+7, 2.6E+5]])
+        detector_yields = np.array([1.005054, 1.008507, 0.956])
+        detector_backgrounds = np.array([446847, -149845, 0])
+        dead_times = np.array([0.0, 0.0, 65.0])
+
+        data = correct_cps_array_for_detector_parameters(raw_cps_data, detector_yields, detector_backgrounds,
+                                                         dead_times)
+
+        for i in range(2):
+            for j in range(3):
+                value = raw_cps_data[i, j]
+                if dead_times[j] != 0:
+                    value = value / (1 - value * dead_times[j] * 10 ** -9)
+                expected = (value - detector_backgrounds[j]) / detector_yields[j]
+                self.assertEqual(expected, data[i, j])
+
     def test_alpha_correction_factor_calculation_zero_uncertainty(self):
         alpha_sims = calculate_sims_alpha(1, 1)
 
@@ -400,5 +417,87 @@ class MathsTests(unittest.TestCase):
         self.assertAlmostEqual(m, -0.05)
         self.assertAlmostEqual(c, 3.05)
 
+    def test_streaming_mean_and_variance_of_chunks(self):
+        values = np.random.default_rng(0).normal(5, 2, size=(3, 1000))
+        streaming_mean_and_variance = StreamingMeanAndVariance(3)
+        for chunk in np.array_split(values, 7, axis=1):
+            streaming_mean_and_variance.add(chunk)
+
+        np.testing.assert_allclose(np.mean(values, axis=1), streaming_mean_and_variance.mean)
+        np.testing.assert_allclose(np.std(values, axis=1), streaming_mean_and_variance.get_st_dev())
+
+    def test_quantile_sketch_of_chunks(self):
+        values = np.random.default_rng(0).normal(5, 2, size=(3, 100000))
+        quantile_sketch = QuantileSketch((3,))
+        for chunk in np.array_split(values, 7, axis=1):
+            quantile_sketch.add(chunk)
+
+        for i in range(3):
+            np.testing.assert_allclose(np.quantile(values[i], [0.25, 0.75]),
+                                       quantile_sketch.get_quantiles([0.25, 0.75], i), atol=0.01)
+
+    def test_kernels_written_into_an_output_array(self):
+        generator = np.random.default_rng(0)
+        ratios = generator.normal(0.002, 0.00001, 1000)
+        deltas = generator.normal(10, 1, 1000).astype(np.float32)
+        alpha_sims = generator.normal(1.002, 0.0003, 1000)
+        out = np.empty(1000)
+
+        np.testing.assert_allclose(calculate_delta_from_ratio(ratios, 0.0020052),
+                                   calculate_delta_from_ratio(ratios, 0.0020052, out=out), rtol=1e-12)
+        np.testing.assert_allclose(drift_correction(3.5, deltas, alpha_sims, 0),
+                                   drift_correction(3.5, deltas, alpha_sims, 0, out=out), rtol=1e-12)
+        # Single precision values are calculated in double precision
+        np.testing.assert_allclose(calculate_alpha_correction(deltas.astype(np.float64), alpha_sims),
+                                   calculate_alpha_correction(deltas, alpha_sims, out=out), rtol=1e-12)
+        np.testing.assert_allclose(calculate_cap_value_and_uncertainty(deltas.astype(np.float64),
+                                                                       2 * deltas.astype(np.float64), 0.515),
+                                   calculate_cap_value_and_uncertainty(deltas, 2 * deltas, 0.515, out=out), rtol=1e-12)
+        self.assertIs(out, calculate_cap_value_and_uncertainty(deltas, 2 * deltas, 0.515, out=out))
+
+    def test_outlier_resistant_means_of_many_series(self):
+        generator = np.random.default_rng(0)
+        data = generator.normal(10, 1, (6, 20))
+        data[0, 3] = 30
+        data[1, [2, 5]] = -20
+        # Values tied with the median
+        data[2] = np.repeat([9.0, 10.0, 11.0, 10.0], 5)
+        is_cycle = np.ones(data.shape, dtype=bool)
+        is_cycle[3, 15:] = False
+        is_cycle[4, [0, 7]] = False
+        is_cycle[5, 1:] = False
+        numbers_of_outliers_allowed = [1, 2, 1, 1, 0, 1]
+
+        means, st_devs, numbers_used, outlier_bounds, is_removed = calculate_outlier_resistant_means_and_st_devs(
+            data, numbers_of_outliers_allowed, is_cycle)
+        # Each series gives the same values as it does on its own
+        for i in range(5):
+            mean, st_dev, number_used, bounds, removed = calculate_outlier_resistant_means_and_st_devs(
+                [data[i][is_cycle[i]]], numbers_of_outliers_allowed[i])
+            self.assertEqual(mean[0], means[i])
+            self.assertEqual(st_dev[0], st_devs[i])
+            self.assertEqual(number_used[0], numbers_used[i])
+            self.assertEqual(list(data[i][is_cycle[i]][removed[0]]), list(data[i][is_removed[i]]))
+            self.assertEqual(tuple(bounds[0]), tuple(outlier_bounds[i]))
+        # The first series has another value outside of its bounds, so there are more outliers than are allowed
+        self.assertFalse(np.any(is_removed[0]))
+        self.assertEqual([2, 5], list(np.flatnonzero(is_removed[1])))
+        self.assertEqual(np.mean(np.delete(data[1], [2, 5])), means[1])
+        self.assertEqual(np.std(np.delete(data[1], [2, 5])), st_devs[1])
+
+        self.assertEqual((data[5, 0], 0, 1), (means[5], st_devs[5], numbers_used[5]))
+        self.assertTrue(np.all(np.isnan(outlier_bounds[5])))
+        self.assertRaises(Exception, calculate_outlier_resistant_means_and_st_devs, data, 1, np.zeros(data.shape, bool))
+
+    def test_medcouples_of_many_series(self):
+        data = np.random.default_rng(0).lognormal(0, 1, (5, 21))
+        data[4] = np.repeat([1.0, 2.0, 3.0], 7)
+        np.testing.assert_array_equal([medcouple(values) for values in data], calculate_medcouples(data))
+
+    def test_medcouples_of_more_rows_than_fit_in_one_chunk(self):
+        data = np.random.default_rng(0).normal(0, 1, (3000, 21))
+        self.assertLess(MEDCOUPLE_MAXIMUM_NUMBER_OF_PAIRS // 21 ** 2, len(data))
+        np.testing.assert_array_equal([medcouple(values) for values in data], calculate_medcouples(data))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,353 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.stats
+
+from controllers.signals import signals
+from import_tests import FIXTURES_DIRECTORY, create_processed_oxygen_model
+from model.calculation import get_standard_ratios
+from model.correction_stage import CorrectionStage
+from model.drift_correction_type import DriftCorrectionType
+from model.elements import Element
+from model.isotopes import Isotope
+from model.montecarlo import has_montecarlo_summary_converged, MonteCarloRandomStreams, MonteCarloBaseDeviates, \
+    MONTECARLO_CHUNK_SIZE
+from model.sampling_method import SamplingMethod
+from model.settings.methods_from_isotopes import O18_O16
+from model.spot import parse_asc_file_into_spot
+from model.uncertainty_method import UncertaintyMethod
+
+
+class MonteCarloTests(unittest.TestCase):
+    def test_montecarlo_batch_holds_the_distributions_of_every_spot(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"])
+        spots = [spot for sample in model.get_samples() for spot in sample.spots]
+        ratio = model.method.ratios[0]
+        [batch] = model.calculation_results.montecarlo_batches
+
+        self.assertEqual((len(spots), len(model.method.ratios), 100), batch.not_corrected_data.shape)
+        for i, spot in enumerate(spots):
+            self.assertTrue(np.shares_memory(batch.not_corrected_data, spot.not_corrected_deltas[ratio]))
+            self.assertTrue(np.shares_memory(batch.alpha_corrected_data, spot.alpha_corrected_data[ratio]))
+            mean, st_error = spot.mean_st_error_isotope_ratios[ratio]
+            standard_ratio = get_standard_ratios(Element.OXY)[ratio][0]
+            expected_delta = (mean / standard_ratio - 1) * 1000
+            expected_st_error = st_error / standard_ratio * 1000
+            self.assertAlmostEqual(expected_delta, np.mean(spot.not_corrected_deltas[ratio]),
+                                   delta=4 * expected_st_error)
+
+
+    def test_montecarlo_distributions_are_shared_until_they_differ(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)])
+        ratio = model.method.ratios[0]
+        spot = model.get_primary_reference_material().spots[0]
+        [batch] = model.calculation_results.montecarlo_batches
+
+        # Without drift correction the drift corrected data is the not corrected data
+        self.assertIsNone(batch.drift_corrected_data)
+        self.assertTrue(np.shares_memory(spot.not_corrected_deltas[ratio], spot.drift_corrected_data[ratio]))
+
+        model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+        self.assertFalse(np.shares_memory(spot.not_corrected_deltas[ratio], spot.drift_corrected_data[ratio]))
+        self.assertTrue(np.shares_memory(batch.drift_corrected_data, spot.drift_corrected_data[ratio]))
+
+
+    def test_single_precision_montecarlo_matches_double_precision(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames)
+        single_precision_model = create_processed_oxygen_model(filenames, is_single_precision=True)
+        ratio = model.method.ratios[0]
+
+        [batch] = single_precision_model.calculation_results.montecarlo_batches
+        self.assertEqual(np.float32, batch.not_corrected_data.dtype)
+        for spot, single_precision_spot in zip(model.get_samples_by_name()["unknown"].spots,
+                                               single_precision_model.get_samples_by_name()["unknown"].spots):
+            np.testing.assert_allclose(spot.alpha_corrected_data[ratio],
+                                       single_precision_spot.alpha_corrected_data[ratio], rtol=1e-6, atol=1e-5)
+
+
+    def test_montecarlo_draws_of_a_spot_depend_only_on_the_seed(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)]
+        model = create_processed_oxygen_model(filenames + ["unknown@01.asc"], montecarlo_seed=1234)
+        model_without_unknown = create_processed_oxygen_model(filenames, montecarlo_seed=1234)
+        model_with_other_seed = create_processed_oxygen_model(filenames, montecarlo_seed=4321)
+        ratio = model.method.ratios[0]
+
+        spot = model.get_primary_reference_material().spots[0]
+        same_spot = model_without_unknown.get_primary_reference_material().spots[0]
+        np.testing.assert_array_equal(spot.not_corrected_deltas[ratio], same_spot.not_corrected_deltas[ratio])
+        np.testing.assert_array_equal(model.calculation_results.alpha_sims_by_ratio[ratio],
+                                      model_without_unknown.calculation_results.alpha_sims_by_ratio[ratio])
+
+        other_seed_spot = model_with_other_seed.get_primary_reference_material().spots[0]
+        self.assertFalse(np.array_equal(spot.not_corrected_deltas[ratio], other_seed_spot.not_corrected_deltas[ratio]))
+
+
+    def test_error_propagation_matches_montecarlo(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"],
+                                              montecarlo_number=20000)
+        ratio = model.method.ratios[0]
+        model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+        calculation_results = model.calculation_results
+
+        for spot in model.get_all_spots():
+            for stage in (CorrectionStage.NOT_CORRECTED, CorrectionStage.DRIFT_CORRECTED,
+                          CorrectionStage.ALPHA_CORRECTED):
+                mean, st_dev = calculation_results.get_mean_and_st_dev(spot, stage, ratio)
+                propagated_mean, propagated_st_dev = calculation_results.get_mean_and_st_dev(
+                    spot, stage, ratio, UncertaintyMethod.ERROR_PROPAGATION)
+                self.assertAlmostEqual(mean, propagated_mean, delta=0.05 * st_dev)
+                self.assertAlmostEqual(st_dev, propagated_st_dev, delta=0.05 * st_dev)
+
+
+    def test_error_propagation_does_not_draw_montecarlo_distributions(self):
+        model = create_processed_oxygen_model(["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"],
+                                              uncertainty_method=UncertaintyMethod.ERROR_PROPAGATION)
+        ratio = model.method.ratios[0]
+        model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+
+        self.assertEqual([], model.calculation_results.montecarlo_batches)
+        spot = model.get_samples_by_name()["unknown"].spots[0]
+        mean, st_dev = model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+        self.assertTrue(np.isfinite(mean))
+        self.assertGreater(st_dev, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            model.export_corrected_data_csv(os.path.join(directory, "corrected_data.csv"))
+            self.assertTrue(os.path.exists(os.path.join(directory, "corrected_data.csv")))
+
+
+    def test_adaptive_montecarlo_stops_when_converged(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames, montecarlo_number=1000000, is_montecarlo_number_adaptive=True)
+        calculation_results = model.calculation_results
+        montecarlo_number = calculation_results.montecarlo_number
+
+        self.assertLess(montecarlo_number, 1000000)
+        [batch] = calculation_results.montecarlo_batches
+        self.assertEqual(montecarlo_number, batch.not_corrected_data.shape[2])
+
+        # Halving the number of trials changes the results by no more than the tolerance
+        half_model = create_processed_oxygen_model(filenames, montecarlo_number=montecarlo_number // 2)
+        self.assertTrue(has_montecarlo_summary_converged(half_model.calculation_results.get_montecarlo_summary(),
+                                                         calculation_results.get_montecarlo_summary(),
+                                                         model.montecarlo_tolerance))
+
+        # Each doubling only draws the new trials, which carry on the streams of the earlier ones
+        full_model = create_processed_oxygen_model(filenames, montecarlo_number=montecarlo_number)
+        ratio = model.method.ratios[0]
+        for spot, full_spot in zip(model.get_all_spots(), full_model.get_all_spots()):
+            np.testing.assert_array_equal(full_spot.alpha_corrected_data[ratio], spot.alpha_corrected_data[ratio])
+        np.testing.assert_array_equal(full_model.calculation_results.all_ratio_results[ratio].drift_coefficient,
+                                      calculation_results.all_ratio_results[ratio].drift_coefficient)
+        np.testing.assert_array_equal(full_model.calculation_results.alpha_sims_by_ratio[ratio],
+                                      calculation_results.alpha_sims_by_ratio[ratio])
+
+        # Recalculating the session keeps the number of trials
+        model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+        full_model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+        [batch] = model.calculation_results.montecarlo_batches
+        self.assertEqual(montecarlo_number, batch.drift_corrected_data.shape[2])
+        for spot, full_spot in zip(model.get_all_spots(), full_model.get_all_spots()):
+            np.testing.assert_array_equal(full_spot.alpha_corrected_data[ratio], spot.alpha_corrected_data[ratio])
+
+        chunked_model = create_processed_oxygen_model(filenames, montecarlo_number=1000000,
+                                                      is_montecarlo_number_adaptive=True, is_montecarlo_chunked=True)
+        self.assertEqual(montecarlo_number, chunked_model.calculation_results.montecarlo_number)
+
+    def test_chunked_montecarlo_keeps_only_summary_statistics(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        montecarlo_number = 2 * MONTECARLO_CHUNK_SIZE + MONTECARLO_CHUNK_SIZE // 2
+        model = create_processed_oxygen_model(filenames, montecarlo_number=montecarlo_number)
+        # The pseudo-random streams carry on from one chunk to the next, so the chunks draw the same trials
+        chunked_model = create_processed_oxygen_model(filenames, montecarlo_number=montecarlo_number,
+                                                      is_montecarlo_chunked=True)
+        ratio = model.method.ratios[0]
+
+        self.assertEqual([], chunked_model.calculation_results.montecarlo_batches)
+        unknown_spot = chunked_model.get_samples_by_name()["unknown"].spots[0]
+        self.assertEqual({}, unknown_spot.alpha_corrected_data)
+
+        for spot, chunked_spot in zip(model.get_all_spots(), chunked_model.get_all_spots()):
+            for stage in (CorrectionStage.NOT_CORRECTED, CorrectionStage.ALPHA_CORRECTED):
+                mean, st_dev = model.calculation_results.get_mean_and_st_dev(spot, stage, ratio)
+                np.testing.assert_allclose(
+                    [mean, st_dev], chunked_model.calculation_results.get_mean_and_st_dev(chunked_spot, stage, ratio),
+                    rtol=1e-9)
+                np.testing.assert_allclose(
+                    model.calculation_results.get_quartiles(spot, stage, ratio),
+                    chunked_model.calculation_results.get_quartiles(chunked_spot, stage, ratio),
+                    atol=0.01 * st_dev)
+
+    def test_chunk_streams_continue_between_chunks(self):
+        spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"), [Isotope.O16, Isotope.O18])
+        ratio = O18_O16
+        expected_values = np.empty(1000)
+        expected_standard_ratio_values = np.empty(1000)
+        MonteCarloRandomStreams(0).draw_spot_standard_normal(spot, ratio, 1000, expected_values,
+                                                             expected_standard_ratio_values)
+
+        chunk_streams = MonteCarloRandomStreams(0).get_chunk_streams()
+        values = np.empty(1000)
+        standard_ratio_values = np.empty(1000)
+        for start in (0, 300, 600, 900):
+            if start > 0:
+                chunk_streams.start_next_chunk()
+            stop = min(start + 300, 1000)
+            chunk_streams.draw_spot_standard_normal(spot, ratio, stop - start, values[start:stop],
+                                                    standard_ratio_values[start:stop])
+            # Drawing the same chunk again, e.g. for the single precision check, repeats its values
+            repeated_values = np.empty(stop - start)
+            chunk_streams.draw_spot_standard_normal(spot, ratio, stop - start, repeated_values)
+            np.testing.assert_array_equal(values[start:stop], repeated_values)
+
+        np.testing.assert_array_equal(expected_values, values)
+        np.testing.assert_array_equal(expected_standard_ratio_values, standard_ratio_values)
+
+    def test_variance_reduction_sampling_methods(self):
+        generator = np.random.default_rng(0)
+        antithetic_values = MonteCarloRandomStreams(0, sampling_method=SamplingMethod.ANTITHETIC).draw_standard_normal(
+            generator, 1001)
+        np.testing.assert_array_equal(antithetic_values[:500], -antithetic_values[500:1000])
+
+        for sampling_method in (SamplingMethod.LATIN_HYPERCUBE, SamplingMethod.SOBOL):
+            values = MonteCarloRandomStreams(0, sampling_method=sampling_method).draw_standard_normal(generator, 1024)
+            # One value in each of the equally probable strata
+            strata = np.floor(scipy.stats.norm.cdf(values) * 1024)
+            np.testing.assert_array_equal(np.arange(1024), np.sort(strata))
+
+
+    def test_sampling_diagnostics_measure_the_precision_of_the_sampling(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames, montecarlo_number=2000)
+        latin_hypercube_model = create_processed_oxygen_model(filenames, montecarlo_number=2000,
+                                                              sampling_method=SamplingMethod.LATIN_HYPERCUBE)
+        ratio = model.method.ratios[0]
+        spot = latin_hypercube_model.get_samples_by_name()["unknown"].spots[0]
+        values = latin_hypercube_model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio)
+
+        [name], [mean_equivalent_number], [st_dev_equivalent_number] = model.calculate_sampling_diagnostics()
+        self.assertEqual(ratio.delta_name(), name)
+        self.assertLess(500, st_dev_equivalent_number)
+        self.assertLess(st_dev_equivalent_number, 8000)
+
+        _, [mean_equivalent_number], [st_dev_equivalent_number] = latin_hypercube_model.calculate_sampling_diagnostics()
+        self.assertLess(100000, mean_equivalent_number)
+        self.assertLess(4000, st_dev_equivalent_number)
+
+        # The session is left with its own results
+        spot = latin_hypercube_model.get_samples_by_name()["unknown"].spots[0]
+        self.assertEqual(values, latin_hypercube_model.calculation_results.get_mean_and_st_dev(
+            spot, CorrectionStage.ALPHA_CORRECTED, ratio))
+
+
+    def test_sampling_diagnostics_keep_the_cycles_flagged_by_the_user(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames, montecarlo_number=500)
+        ratio = model.method.ratios[0]
+        spot = model.get_samples_by_name()["unknown"].spots[0]
+        model.remove_cycle_from_spot(spot, 0, True, ratio)
+        model.recalculate_data_with_cycles_changed()
+        cycle_flagging_information = list(spot.cycle_flagging_information[ratio])
+        values = model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+
+        recalculations = []
+
+        def on_data_recalculated():
+            recalculations.append(model.calculation_results)
+
+        signals.dataRecalculated.connect(on_data_recalculated)
+        try:
+            model.calculate_sampling_diagnostics(number_of_repeats=3)
+        finally:
+            signals.dataRecalculated.disconnect(on_data_recalculated)
+
+        self.assertTrue(spot.cycle_flagging_information[ratio][0])
+        self.assertEqual(cycle_flagging_information, spot.cycle_flagging_information[ratio])
+        self.assertEqual(values, model.calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED,
+                                                                               ratio))
+        self.assertEqual(1, len(recalculations))
+
+    def test_kept_montecarlo_deviates_are_reused_by_recalculations(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames)
+        kept_deviates_model = create_processed_oxygen_model(filenames, are_montecarlo_deviates_kept=True)
+        ratio = model.method.ratios[0]
+        base_deviates = kept_deviates_model.montecarlo_base_deviates
+
+        spot = kept_deviates_model.get_samples_by_name()["unknown"].spots[0]
+        np.testing.assert_array_equal(model.get_samples_by_name()["unknown"].spots[0].alpha_corrected_data[ratio],
+                                      spot.alpha_corrected_data[ratio])
+
+        alpha_corrected_data = spot.alpha_corrected_data[ratio].copy()
+        kept_deviates_model.recalculate_data_with_cycles_changed()
+        self.assertIs(base_deviates, kept_deviates_model.montecarlo_base_deviates)
+        np.testing.assert_array_equal(alpha_corrected_data, spot.alpha_corrected_data[ratio])
+
+        kept_deviates_model.remove_cycle_from_spot(spot, 0, True, ratio)
+        kept_deviates_model.redraw_montecarlo_deviates()
+        self.assertIsNot(base_deviates, kept_deviates_model.montecarlo_base_deviates)
+        self.assertFalse(np.array_equal(alpha_corrected_data, spot.alpha_corrected_data[ratio]))
+        self.assertTrue(spot.cycle_flagging_information[ratio][0])
+
+    def test_kept_montecarlo_deviates_are_released_with_their_spots(self):
+        spot, other_spot = [parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, filename),
+                                                     [Isotope.O16, Isotope.O18])
+                            for filename in ("OGC@01.asc", "OGC@02.asc")]
+        base_deviates = MonteCarloBaseDeviates(0)
+        values = np.empty(100)
+        base_deviates.draw_spot_standard_normal(spot, O18_O16, 100, values)
+        base_deviates.draw_spot_standard_normal(other_spot, O18_O16, 100, np.empty(100))
+
+        # A spot imported again is the same file, so it reuses the deviates
+        reimported_spot = parse_asc_file_into_spot(os.path.join(FIXTURES_DIRECTORY, "OGC@01.asc"),
+                                                   [Isotope.O16, Isotope.O18])
+        reimported_values = np.empty(100)
+        base_deviates.draw_spot_standard_normal(reimported_spot, O18_O16, 100, reimported_values)
+        np.testing.assert_array_equal(values, reimported_values)
+        self.assertEqual(2, len(base_deviates._spot_deviates))
+
+        base_deviates.keep_only_spots([reimported_spot])
+        self.assertEqual([(spot.file_hash, O18_O16)], list(base_deviates._spot_deviates.keys()))
+
+
+    def test_threaded_montecarlo_is_the_same_as_a_single_thread(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames)
+        threaded_model = create_processed_oxygen_model(filenames, number_of_montecarlo_threads=3)
+        for sample_name, sample in model.get_samples_by_name().items():
+            for spot, threaded_spot in zip(sample.spots, threaded_model.get_samples_by_name()[sample_name].spots):
+                for ratio in model.method.ratios:
+                    np.testing.assert_array_equal(spot.drift_corrected_data[ratio],
+                                                  threaded_spot.drift_corrected_data[ratio])
+                    np.testing.assert_array_equal(spot.alpha_corrected_data[ratio],
+                                                  threaded_spot.alpha_corrected_data[ratio])
+
+
+    def test_summary_statistics_are_kept_until_the_distribution_is_recalculated(self):
+        filenames = ["OGC@%02d.asc" % i for i in range(1, 11)] + ["unknown@01.asc"]
+        model = create_processed_oxygen_model(filenames)
+        calculation_results = model.calculation_results
+        ratio = model.method.ratios[0]
+        spot = model.get_samples_by_name()["unknown"].spots[0]
+
+        mean_and_st_dev = calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+        quartiles = calculation_results.get_quartiles(spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+        self.assertIs(mean_and_st_dev,
+                      calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED, ratio))
+        self.assertIs(quartiles, calculation_results.get_quartiles(spot, CorrectionStage.ALPHA_CORRECTED, ratio))
+        np.testing.assert_array_equal(np.quantile(spot.alpha_corrected_data[ratio], [0.25, 0.75]), quartiles)
+
+        model.recalculate_data_with_drift_correction_changed(ratio, DriftCorrectionType.LIN)
+        mean, st_dev = calculation_results.get_mean_and_st_dev(spot, CorrectionStage.ALPHA_CORRECTED, ratio)
+        self.assertNotEqual(mean_and_st_dev, (mean, st_dev))
+        self.assertEqual(np.mean(spot.alpha_corrected_data[ratio]), mean)
+        self.assertEqual(np.std(spot.alpha_corrected_data[ratio]), st_dev)
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()